@@ -37,6 +37,9 @@ class NetworkCache:
         self.is_local = { }
         self.headers = { }
         self.callbacks = { }
+        # (name, directory) => None for remote drpms/ directories with a
+        # missing delta
+        self.nodeltas = { }
         self.baseurls[name] = baseurls
         self.pos[name] = 0
         self.is_local[name] = self.__isLocalURI(self.baseurls[name])
@@ -256,6 +259,28 @@ class NetworkCache:
             if self.pos[name] == opos:
                 return None
 
+    def cacheDelta(self, filename, name=None, dirname="drpms"):
+        """Cache delta rpm filename from the dirname directory of the
+        repository.
+
+        Deltas in a local repository or already in the cache are used without
+        accessing the network.  After the first delta missing in a remote
+        repository the others are not looked up either, every miss costs a
+        request to each mirror.  Returns the local filename or None if the
+        delta is not available."""
+
+        if name == None:
+            name = self.default_name
+        uri = dirname + "/" + filename
+        if self.isCached(uri, name):
+            return self.getCachedFilename(uri, name)
+        if (name, dirname) in self.nodeltas:
+            return None
+        f = self.cache(uri, name=name)
+        if f is None and not self.is_local[name]:
+            self.nodeltas[(name, dirname)] = None
+        return f
+
     def clear(self, uri=None, name=None):
         """Clears either the single given uri/file or the whole cache"""
 
@@ -335,6 +360,9 @@ class SubNetworkCache:
     def cache(self, uri, force=False, copy_local=False, size=-1, md5=0, async=False, name=None):
         return self.nc.cache(self.prefix + "/" + uri, force, copy_local, size, md5, async, name)
 
+    def cacheDelta(self, filename, name=None, dirname="drpms"):
+        return self.nc.cacheDelta(filename, name, self.prefix + "/" + dirname)
+
     def clear(self, uri=None, name=None):
         if uri == None:
             uri = ''
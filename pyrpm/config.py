@@ -63,8 +63,35 @@ class RpmConfig:
                              ("filesizes", "dirindexes", "basenames",
                               "dirnames", "oldfilenames", "filemodes")
         self.timer = 0                   # Output timing information
+        self.checksum = "sha"            # Package checksums of createRepo()
+        self.repothreads = 4             # Repositories read in parallel
+        self.filelistindex = 0           # Look up repo files in on-disk index
+        self.rpmdbcache = 64             # MB of rpmdb packages kept, 0: all
         self.ldconfig = 0             # Number of ldconfig calls optimized away
         self.delayldconfig = 0           # A delayed ldconfig call is pending
+        self.deferscripts = 1            # Run cache updates once at the end
+        # (program name, arguments regexp) of idempotent scriptlet commands
+        # that are run only once at the end of the transaction
+        self.deferrules = [
+            ("touch", r"--no-create /\S+"),
+            ("gtk-update-icon-cache", r"(-[-a-zA-Z]+ )*/\S+"),
+            ("update-desktop-database", r"(-q|--quiet)?( ?/\S+)?"),
+            ("update-mime-database", r"(-n )?/\S+"),
+            ("fc-cache", r"(-[-a-zA-Z]+ ?)*( ?/\S+)*"),
+            ("install-info", r"(--(info-dir|dir-file|section)=\S+ )*"
+             r"/\S+( /\S+)?"),
+            ("gconftool-2", r"--makefile-install-rule( /\S+)+"),
+            ("depmod", r"(-a|-ae|-A)?( -F /\S+)?( [0-9]\S*)?"),
+            ("scrollkeeper-update", r"(-q)?( -o /\S+)?"),
+            ("update-gtk-immodules", r"\S+"),
+            ("gdk-pixbuf-query-loaders", r"--update-cache"),
+            ("glib-compile-schemas", r"/\S+"),
+            ]
+        self.deferring = 0               # runOperations() defers scripts
+        self.deferredscripts = [ ]       # Deferred [chroot, command, quiet]
+        self.deferred = 0                # Number of scripts deferred
+        self.scriptexecutor = 1          # Run scripts from a helper process
+        self.parallel = 0                # Processes extracting payloads ahead
         self.service = 0                 # Install /sbin/service with "exit 0"
         self.yumconf = ['/etc/yum.conf'] # Yum config files
         self.relver  = None              # Release version, needed by YumConfig
@@ -79,6 +106,10 @@ class RpmConfig:
         self.disablerepo  = [ ]         # Manually disabled repos
         self.cachedir = "/var/cache/pyrpm"      # Directory for cached files
         self.nocache = 0                # Disable caching for packages
+        self.deltas = 0                 # Rebuild packages from delta rpms
+        self.deltadirs = [ ]            # Local directories with delta rpms
+        self.filestore = None           # Directory of stored package files
+        self.filestorelinks = 0         # Hard link files from filestore
         self.excludes = [ ]
         # The first element should be a full path, interpreted outside
         # self.buildroot
@@ -17,14 +17,17 @@
 #
 
 
-import os
+import os, stat
 from time import clock
 import package
 from resolver import *
 from orderer import *
 from logger import log
+from profiling import profiler
 from pyrpm.cache import NetworkCache
-from pyrpm import functions
+from pyrpm import functions, delta
+from pyrpm.database.lists import TriggerIndex
+from pyrpm.extractor import ExtractorPool
 import se_linux
 
 class RpmController:
@@ -39,6 +42,10 @@ class RpmController:
         self.operation = operation
         self.db = db
         self.rpms = []                  # List of RpmPackage's to act upon
+        self.triggers = None            # TriggerIndex during runOperations()
+        # Installed RpmPackage => [RpmPackage's it requires], from
+        # getOperations()
+        self.prereqs = { }
         self.db.open()
         if not self.db.read():
             raise ValueError, "Fatal: Couldn't read database"
@@ -107,8 +114,14 @@ class RpmController:
                 else:
                     log.error("Unknown operation")
         del self.rpms
-        if not self.config.nodeps and not nodeps and resolver.resolve() != 1:
-            return None
+        if not self.config.nodeps and not nodeps:
+            if profiler.enabled:
+                ptime = profiler.start()
+            ret = resolver.resolve()
+            if profiler.enabled:
+                profiler.stop("resolver.resolve", ptime)
+            if ret != 1:
+                return None
         if self.config.timer:
             log.info2("resolver took %s seconds", (clock() - time1))
             time1 = clock()
@@ -117,13 +130,18 @@ class RpmController:
                              resolver.obsoletes, resolver.erases,
                              installdb=installdb, erasedb=erasedb)
         del resolver
+        if profiler.enabled:
+            ptime = profiler.start()
         operations = orderer.order()
+        if profiler.enabled:
+            profiler.stop("orderer.order", ptime)
         if operations is None: # Currently can't happen
             log.error("Errors found during package dependency "
                       "checks and ordering.")
             return None
 
         # replace repodb pkgs by binaryrpm instances
+        replaced = { }
         for idx, (op, pkg) in enumerate(operations):
             if op in (OP_UPDATE, OP_INSTALL, OP_FRESHEN):
                 nc = None
@@ -146,6 +164,11 @@ class RpmController:
                 for tag in self.config.nevratags:
                     p[tag] = pkg[tag]
                 operations[idx] = (op, p)
+                replaced[pkg] = p
+        self.prereqs = { }
+        for (pkg, pres) in orderer.prereqs.iteritems():
+            self.prereqs[replaced.get(pkg, pkg)] = [replaced.get(p, p)
+                                                    for p in pres]
 
         if self.config.timer:
             log.info2("orderer took %s seconds", (clock() - time1))
@@ -180,6 +203,17 @@ class RpmController:
         """Perform (operation, RpmPackage) from list operation.
 
         Return 1 on success, 0 on error (after warning the user)."""
+        try:
+            return self.__runOperations(operations)
+        finally:
+            # Scripts run after the transaction are not deferred
+            self.config.deferring = 0
+            # The helper processes keep the buildroot busy
+            functions.stopScriptExecutors()
+
+    def __runOperations(self, operations):
+        """Perform (operation, RpmPackage) from list operation, see
+        runOperations()."""
         result = 1
         if operations == []:
             log.error("No updates are necessary.")
@@ -197,7 +231,15 @@ class RpmController:
                     pkg.source.startswith("https://") or \
                     pkg.yumrepo != None):
                     log.info3("Caching network package %s", pkg.getNEVRA())
-                    source = pkg.nc.cache(pkg.source)
+                    if profiler.enabled:
+                        ptime = profiler.start()
+                    source = None
+                    if self.config.deltas:
+                        source = self.__rebuildFromDelta(pkg)
+                    if source is None:
+                        source = pkg.nc.cache(pkg.source)
+                    if profiler.enabled:
+                        profiler.stop("download", ptime, pkg.getNEVRA())
                     if source is None:
                         log.error("Error downloading %s", pkg.source)
                         return 0
@@ -205,6 +247,8 @@ class RpmController:
 
                 # check signature
                 if not self.config.nosignature:
+                    if profiler.enabled:
+                        ptime = profiler.start()
                     try:
                         pkg.reread()
                     except Exception, e:
@@ -220,8 +264,12 @@ class RpmController:
                                   pkg.getNEVRA())
                     pkg.close()
                     pkg.clear(ntags=self.config.nevratags)
+                    if profiler.enabled:
+                        profiler.stop("signature", ptime, pkg.getNEVRA())
             new_operations.append((op, pkg))
             if pkg["pretransprog"] != None and not self.config.noscripts:
+                if profiler.enabled:
+                    ptime = profiler.start()
                 try:
                     (status, rusage, output) = functions.runScript(
                         pkg["pretransprog"], pkg["pretrans"], [0],
@@ -237,102 +285,180 @@ class RpmController:
                         log.error("Output running pre transaction script for "
                                   "package %s", pkg.getNEVRA())
                         log.error(output, nofmt=1)
+                if profiler.enabled:
+                    profiler.stop("scriptlet.pretrans", ptime,
+                                  pkg.getNEVRA())
 
         operations = new_operations
         numops = len(operations)
         numops_chars = len("%d" % numops)
         setCloseOnExec()
         sys.stdout.flush()
+        pool = None
+        if self.config.parallel > 1 and not self.config.justdb:
+            pool = ExtractorPool(self.config.parallel,
+                                 lambda j: self.__extractPayload(
+                                     operations[j][1]))
+            # operation index => (files, last prerequisite index,
+            #                     extract ahead, started)
+            extracts = { }
+            positions = { }             # RpmPackage => operation index
+            for (j, (op, pkg)) in enumerate(operations):
+                positions[pkg] = j
         i = 0
         # TODO: Make sure this is always correct. Needed to save memory for
         # now for RpmDB due to obsoletes caching.
         self.db.obsoletes_list = None
+        self.triggers = TriggerIndex(self.db)
+        # Only package and trigger scripts are deferred
+        self.config.deferredscripts[:] = [ ]
+        self.config.deferred = 0
+        self.config.deferring = 1
         posttrans = []
-        for (op, pkg) in operations:
-            # Progress
-            opstring = self.opstrings.get(op, "Cleanup: ")
-            i += 1
-            progress = "[%*d/%d] %s%s"
-            log.info2(progress, numops_chars, i, numops,
-                      opstring, pkg.getNEVRA(), nl=0)
-
-            # Save posttrans for later processing (pkg is removed from rpmdb on erase).
-            if pkg["posttransprog"] != None and not self.config.noscripts:
-                posttrans.append((pkg["posttransprog"], pkg["posttrans"],
-                    pkg.getNEVRA(), pkg["prefixes"]))
-
-            # install
-            if op in (OP_INSTALL, OP_UPDATE, OP_FRESHEN):
-                # reread pkg
-                try:
-                    pkg.close()
-                    pkg.open()
-                except IOError, e:
-                    log.error("Error reopening %s: %s", pkg.getNEVRA(), e)
-                    result = 0
-                    break
-                nevra = pkg.getNEVRA()
-                pkg.clear()
-                # Disable verify, already done
-                pkg.verifySignature = None
-                try:
-                    pkg.read()
-                except (IOError, ValueError), e:
-                    log.error("Error rereading %s: %s", nevra, e)
-                    result = 0
-                    break
-                # install on disk
-                try:
-                    if not self.config.justdb:
-                        pkg.install(self.db, buildroot=self.config.buildroot)
-                        self.__runTriggerIn(pkg, self.config.buildroot)
-                        # Ignore errors
-                    else:
-                        log.info2("", nofmt=1) # newline may be after hashes
-                except (IOError, OSError, ValueError), e:
-                    log.error("Error installing %s: %s", pkg.getNEVRA(), e)
-                    result = 0
-                    break
-                # update DB
-                if self.__addPkgToDB(pkg) == 0:
-                    log.error("Couldn't add package %s to database.",
-                              pkg.getNEVRA())
-                    result = 0
-                    break
-                pkg.clear()
-                try:
-                    pkg.close()
-                except IOError:
-                    # Shouldn't really happen when pkg is open for reading,
-                    # anyway.
-                    pass
-                if not self.config.keepcache and \
-                       pkg.nc != None and pkg.yumhref != None:
-                    pkg.nc.clear(pkg.yumhref)
-            # erase
-            elif op == OP_ERASE:
-                try:
-                    if not self.config.justdb:
-                        self.__runTriggerUn(pkg, self.config.buildroot)
-                        # Ignore errors
-                        pkg.erase(self.db, buildroot=self.config.buildroot)
-                        self.__runTriggerPostUn(pkg, self.config.buildroot)
-                        # Ignore errors
-                    else:
-                        log.info2("", nofmt=1) # newline may be after hashes
-                except (IOError, ValueError), e:
-                    log.error("Error erasing %s: %s", pkg.getNEVRA(), e)
-                    result = 0
-                    break
-                # update DB
-                if self.__erasePkgFromDB(pkg) == 0:
-                    log.error("Couldn't erase package %s from database.",
-                              pkg.getNEVRA())
-                    result = 0
-                    break
+        failed = True
+        try:
+            for (op, pkg) in operations:
+                # Progress
+                opstring = self.opstrings.get(op, "Cleanup: ")
+                i += 1
+                progress = "[%*d/%d] %s%s"
+                log.info2(progress, numops_chars, i, numops,
+                          opstring, pkg.getNEVRA(), nl=0)
+
+                # Save posttrans for later processing (pkg is removed from rpmdb on erase).
+                if pkg["posttransprog"] != None and not self.config.noscripts:
+                    posttrans.append((pkg["posttransprog"], pkg["posttrans"],
+                        pkg.getNEVRA(), pkg["prefixes"]))
+
+                if pool is not None:
+                    self.__startExtracts(pool, extracts, operations, positions,
+                                         i - 1)
+
+                # install
+                if op in (OP_INSTALL, OP_UPDATE, OP_FRESHEN):
+                    extracted = False
+                    if pool is not None and i - 1 in extracts and \
+                           extracts[i - 1][3]:
+                        error = pool.wait(i - 1)
+                        if error is not None:
+                            log.error("Error installing %s: %s",
+                                      pkg.getNEVRA(), error)
+                            result = 0
+                            break
+                        extracted = True
+                        if profiler.enabled:
+                            profiler.count("install.parallel")
+                    # reread pkg
+                    try:
+                        pkg.close()
+                        pkg.open()
+                    except IOError, e:
+                        log.error("Error reopening %s: %s", pkg.getNEVRA(), e)
+                        result = 0
+                        break
+                    nevra = pkg.getNEVRA()
+                    pkg.clear()
+                    # Disable verify, already done
+                    pkg.verifySignature = None
+                    try:
+                        pkg.read()
+                    except (IOError, ValueError), e:
+                        log.error("Error rereading %s: %s", nevra, e)
+                        result = 0
+                        break
+                    # install on disk
+                    try:
+                        if not self.config.justdb:
+                            if profiler.enabled:
+                                ptime = profiler.start()
+                            pkg.install(self.db,
+                                        buildroot=self.config.buildroot,
+                                        extract=not extracted)
+                            if profiler.enabled:
+                                profiler.stop("install", ptime, nevra)
+                            self.__runTriggerIn(pkg, self.config.buildroot)
+                            # Ignore errors
+                        else:
+                            log.info2("", nofmt=1) # newline may be after hashes
+                    except (IOError, OSError, ValueError), e:
+                        log.error("Error installing %s: %s", pkg.getNEVRA(), e)
+                        result = 0
+                        break
+                    # update DB
+                    if profiler.enabled:
+                        ptime = profiler.start()
+                    if self.__addPkgToDB(pkg) == 0:
+                        log.error("Couldn't add package %s to database.",
+                                  pkg.getNEVRA())
+                        result = 0
+                        break
+                    if profiler.enabled:
+                        profiler.stop("rpmdb.add", ptime, nevra)
+                    pkg.clear()
+                    try:
+                        pkg.close()
+                    except IOError:
+                        # Shouldn't really happen when pkg is open for reading,
+                        # anyway.
+                        pass
+                    if not self.config.keepcache and \
+                           pkg.nc != None and pkg.yumhref != None:
+                        pkg.nc.clear(pkg.yumhref)
+                # erase
+                elif op == OP_ERASE:
+                    try:
+                        if not self.config.justdb:
+                            self.__runTriggerUn(pkg, self.config.buildroot)
+                            # Ignore errors
+                            if profiler.enabled:
+                                ptime = profiler.start()
+                            pkg.erase(self.db, buildroot=self.config.buildroot)
+                            if profiler.enabled:
+                                profiler.stop("erase", ptime, pkg.getNEVRA())
+                            self.__runTriggerPostUn(pkg, self.config.buildroot)
+                            # Ignore errors
+                        else:
+                            log.info2("", nofmt=1) # newline may be after hashes
+                    except (IOError, ValueError), e:
+                        log.error("Error erasing %s: %s", pkg.getNEVRA(), e)
+                        result = 0
+                        break
+                    # update DB
+                    if profiler.enabled:
+                        ptime = profiler.start()
+                    if self.__erasePkgFromDB(pkg) == 0:
+                        log.error("Couldn't erase package %s from database.",
+                                  pkg.getNEVRA())
+                        result = 0
+                        break
+                    if profiler.enabled:
+                        profiler.stop("rpmdb.erase", ptime, pkg.getNEVRA())
+            failed = result == 0
+        finally:
+            if pool is not None:
+                pool.close()
+                if failed:
+                    self.__reportExtracts(extracts, operations, i - 1)
+
+        self.config.deferring = 0
+        if self.config.deferred:
+            if profiler.enabled:
+                ptime = profiler.start()
+            try:
+                saved = functions.runDeferredScripts()
+            except (IOError, OSError), e:
+                log.warning("Error running deferred scripts: %s", e)
+            else:
+                log.info2("number of script runs optimized away: %d", saved)
+                if profiler.enabled:
+                    profiler.count("scripts.deferred", saved)
+            if profiler.enabled:
+                profiler.stop("scriptlet.deferred", ptime)
 
         # Start all posttrans scripts:
         for (posttransprog, posttransscript, nevra, prefixes) in posttrans:
+            if profiler.enabled:
+                ptime = profiler.start()
             try:
                 (status, rusage, output) = functions.runScript(
                     posttransprog, posttransscript, [0],
@@ -349,6 +475,8 @@ class RpmController:
                     log.error("Output running post transaction script for "
                               "package %s", nevra)
                     log.error(output, nofmt=1)
+            if profiler.enabled:
+                profiler.stop("scriptlet.posttrans", ptime, nevra)
 
         if self.config.delayldconfig:
             self.config.delayldconfig = 0
@@ -359,6 +487,8 @@ class RpmController:
                 log.warning("Error running /sbin/ldconfig: %s", e)
             log.info2("number of /sbin/ldconfig calls optimized away: %d",
                       self.config.ldconfig)
+            if profiler.enabled:
+                profiler.count("ldconfig.optimized", self.config.ldconfig)
         self.db.close()
         return result
 
@@ -390,16 +520,151 @@ class RpmController:
         if not self.config.ignorearch:
             filterArchCompat(self.rpms, self.config.machine)
 
+    def __rebuildFromDelta(self, pkg):
+        """Rebuild network RpmPackage pkg in the cache from a delta against
+        an installed version, looking in config.deltadirs first and then in
+        the drpms/ directory of the repository.
+
+        Return the file name of the package, or None if no delta can be
+        used."""
+
+        target = pkg.nc.getCachedFilename(pkg.source)
+        if pkg.source.startswith("file:/") or os.path.exists(target):
+            return None
+        for ipkg in self.db.getPkgsByName(pkg["name"]):
+            if ipkg["arch"] != pkg["arch"]:
+                continue
+            name = delta.deltaFilename(ipkg, pkg)
+            filename = None
+            for dirname in self.config.deltadirs:
+                if os.path.isfile(os.path.join(dirname, name)):
+                    filename = os.path.join(dirname, name)
+                    break
+            if filename is None and pkg.yumhref is not None:
+                filename = pkg.nc.cacheDelta(name)
+            if filename is None:
+                continue
+            try:
+                if delta.readDeltaInfo(filename)["target_nevra"] != \
+                       pkg.getNEVRA():
+                    raise ValueError, "not a delta to %s" % pkg.getNEVRA()
+                if not os.path.isdir(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                delta.applyDelta(self.config, filename, ipkg, target)
+            except (IOError, OSError, ValueError), e:
+                log.warning("Can't use delta %s: %s", filename, e)
+                continue
+            log.info2("Rebuilt %s from delta %s", pkg.getNEVRA(), name)
+            return target
+        return None
+
+    def __startExtracts(self, pool, extracts, operations, positions, cur):
+        """Start extracting payloads of operations after index cur ahead of
+        their turn in ExtractorPool pool.
+
+        A package is extracted ahead if it has no %pre script, the packages
+        it requires are installed and none of its files except directories
+        belongs to an installed package or to an earlier pending operation.
+        extracts caches the state of the operations, positions is
+        {RpmPackage: operation index}."""
+
+        extracts.pop(cur - 1, None)
+        busy = { }                      # Files of pending operations
+        for j in xrange(cur, min(len(operations),
+                                 cur + 4 * self.config.parallel)):
+            if not pool.isIdle():
+                break
+            (op, pkg) = operations[j]
+            if op not in (OP_INSTALL, OP_UPDATE, OP_FRESHEN):
+                break
+            if j not in extracts:
+                extracts[j] = self.__checkExtract(pkg, j, positions)
+            (files, last, ahead, started) = extracts[j]
+            if files is None:
+                break
+            if ahead and not started and j > cur and last < cur:
+                for f in files:
+                    if f in busy or self.db.searchFilenames(f):
+                        ahead = False
+                        break
+                if ahead:
+                    pool.start(j)
+                    started = True
+                extracts[j] = (files, last, ahead, started)
+            for f in files:
+                busy[f] = None
+
+    def __reportExtracts(self, extracts, operations, cur):
+        """Log the packages of operations from index cur on which were
+        extracted ahead but not installed, after an error at operation cur.
+
+        Their files are in the buildroot but not in the database."""
+
+        indexes = extracts.keys()
+        indexes.sort()
+        for j in indexes:
+            if j >= cur and extracts[j][3]:
+                log.error("%s: Files were extracted, but the package is not "
+                          "installed", operations[j][1].getNEVRA())
+
+    def __checkExtract(self, pkg, j, positions):
+        """Read the header of RpmPackage pkg of operation index j.
+
+        Return (file names except directories, index of the last operation
+        pkg requires, True if pkg could be extracted ahead, False), files is
+        None on error."""
+
+        try:
+            pkg.open()
+            pkg.verifySignature = None
+            pkg.read()
+            pkg.close()
+        except (IOError, ValueError):
+            # Reported when the operation runs
+            return (None, j - 1, False, False)
+        files = [ ]
+        modes = pkg["filemodes"] or [ ]
+        for (k, filename) in enumerate(pkg.iterFilenames()):
+            if k >= len(modes) or not stat.S_ISDIR(modes[k]):
+                files.append(filename)
+        last = j - 1
+        if pkg in self.prereqs:
+            last = -1
+            for p in self.prereqs[pkg]:
+                last = max(last, positions.get(p, -1))
+        ahead = not pkg.isSourceRPM() and \
+                (pkg["preinprog"] is None or self.config.noscripts)
+        return (files, last, ahead, False)
+
+    def __extractPayload(self, pkg):
+        """Extract the files of RpmPackage pkg in an ExtractorPool worker.
+
+        Raise ValueError, IOError, OSError."""
+
+        self.config.printhash = 0
+        log.setInfoLogLevel(log.NO_INFO)
+        pkg.close()
+        pkg.clear()
+        pkg.verifySignature = None
+        pkg.extractFiles(buildroot=self.config.buildroot)
+        pkg.close()
+
     def __addPkgToDB(self, pkg):
         """Add RpmPackage pkg to self.db"""
         if not pkg.isSourceRPM():
-            return self.db.addPkg(pkg)
+            result = self.db.addPkg(pkg)
+            if result and self.triggers is not None:
+                self.triggers.addPkg(pkg)
+            return result
         return 1
 
     def __erasePkgFromDB(self, pkg):
         """Remove RpmPackage pkg from self.db."""
         if not pkg.isSourceRPM():
-            return self.db.removePkg(pkg)
+            result = self.db.removePkg(pkg)
+            if result and self.triggers is not None:
+                self.triggers.removePkg(pkg)
+            return result
         return 1
 
     # Triggers
@@ -428,13 +693,15 @@ class RpmController:
 
         if self.config.justdb or self.config.notriggers or pkg.isSourceRPM():
             return 1
-        triggers = self.db.searchTriggers(pkg["name"], flag, pkg.getEVR())
+        triggers = self.triggers.search(pkg["name"], flag, pkg.getEVR())
         triggers.pop(pkg, None) # remove this package
         # Set umask to 022, especially important for scripts
         os.umask(022)
 
-        tnumPkgs = str(len(self.db.getPkgsByName(pkg["name"]))+1)
+        tnumPkgs = str(self.triggers.numPkgs(pkg["name"])+1)
 
+        if profiler.enabled:
+            ptime = profiler.start()
         if selffirst:
             r1 = self.__executePkgTriggers(pkg, flag, triggername,
                                            tnumPkgs, buildroot)
@@ -445,6 +712,8 @@ class RpmController:
                                         tnumPkgs, buildroot)
             r1 = self.__executePkgTriggers(pkg, flag, triggername,
                                            tnumPkgs, buildroot)
+        if profiler.enabled:
+            profiler.stop("trigger.%s" % triggername, ptime, pkg.getNEVRA())
         return r1 and r2
 
     def __executeTriggers(self, tlist, triggername, tnumPkgs, buildroot=''):
@@ -453,7 +722,7 @@ class RpmController:
 
         result = 1
         for spkg, l in tlist.iteritems():
-            snumPkgs = str(len(self.db.getPkgsByName(spkg["name"])))
+            snumPkgs = str(self.triggers.numPkgs(spkg["name"]))
             for name, f, v, prog, script in l:
                 try:
                     runScript(prog, script, [snumPkgs, tnumPkgs],
@@ -472,9 +741,9 @@ class RpmController:
 
         result = 1
         evr = (pkg.getEpoch(), pkg["version"], pkg["release"])
-        for name, f, v, prog, script in pkg["triggers"]:
-            if (functions.rangeCompare(flag, evr, f, functions.evrSplit(v)) or
-                v == ""):
+        for name, f, v, tevr, prog, script in \
+                self.triggers.getPkgTriggers(pkg):
+            if functions.rangeCompare(flag, evr, f, tevr) or v == "":
                 try:
                     runScript(prog, script, [tnumPkgs, tnumPkgs],
                               chroot=buildroot)
@@ -21,7 +21,7 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
-import os, re, stat
+import os, re, stat, gzip, struct, zlib, md5, sha
 import base, functions
 
 
@@ -30,6 +30,8 @@ _filerc = re.compile('^(.*bin/.*|/etc/.*|/usr/lib/sendmail)$')
 _dirrc = re.compile('^(.*bin/.*|/etc/.*)$')
 
 
+_nonasciirc = re.compile('[\x80-\xff]')
+
 def _utf8String(string):
     """Return string converted to UTF-8"""
 
@@ -37,19 +39,18 @@ def _utf8String(string):
         return ''
     elif isinstance(string, unicode):
         return string
-    try:
-        x = unicode(string, 'ascii')
+    # Most strings are plain ASCII
+    if _nonasciirc.search(string) is None:
         return string
-    except UnicodeError:
-        encodings = ['utf-8', 'iso-8859-1', 'iso-8859-15', 'iso-8859-2']
-        for enc in encodings:
-            try:
-                x = unicode(string, enc)
-            except UnicodeError:
-                pass
-            else:
-                if x.encode(enc) == string:
-                    return x.encode('utf-8')
+    encodings = ['utf-8', 'iso-8859-1', 'iso-8859-15', 'iso-8859-2']
+    for enc in encodings:
+        try:
+            x = unicode(string, enc)
+        except UnicodeError:
+            pass
+        else:
+            if x.encode(enc) == string:
+                return x.encode('utf-8')
     newstring = ''
     for char in string:
         if ord(char) > 127:
@@ -59,11 +60,16 @@ def _utf8String(string):
     return newstring
 
 
-def _textChildFromTag(parent, ns, tag, value):
-    """Return a new child <ns:tag> under parent from {,i18n}string value."""
+def _tagText(value):
+    """Return the text of {,i18n}string tag value for the metadata."""
     if type(value) in [list, tuple]:
         value = value[0]
-    value = re.sub("\n$", '', _utf8String(value))
+    return re.sub("\n$", '', _utf8String(value))
+
+
+def _textChildFromTag(parent, ns, tag, value):
+    """Return a new child <ns:tag> under parent from {,i18n}string value."""
+    value = _tagText(value)
     if value:
         parent.newTextChild(ns, tag, value)
     else:
@@ -92,28 +98,87 @@ _depString = {
     base.RPMSENSE_GREATER | base.RPMSENSE_EQUAL: 'GE'
 }
 
-def _entryNode(parent, ns, dep):
-    """Create an <ns:entry> node for dependency dep under parent.
+def _entryAttrs(dep):
+    """Return [(name, value)] attributes of an <entry> for dependency dep.
 
-    dep is (name, flags, ver). Return the created node."""
+    dep is (name, flags, ver)."""
 
-    entry = parent.newChild(ns, 'entry', None)
     (name, flags, ver) = dep
-    entry.newProp('name', name)
+    attrs = [('name', name)]
     fl = flags & base.RPMSENSE_SENSEMASK
     if fl != 0:
-        entry.newProp('flags', _depString[fl])
+        attrs.append(('flags', _depString[fl]))
         (e, v, r) = functions.evrSplit(ver)
         # if we've got a flag we've got a version, I hope :)
         if e != '':
-            entry.newProp('epoch', e)
+            attrs.append(('epoch', e))
         if v != '':
-            entry.newProp('ver', v)
+            attrs.append(('ver', v))
         if r != '':
-            entry.newProp('rel', r)
+            attrs.append(('rel', r))
+    if (flags & base.RPMSENSE_PREREQ) != 0:
+        attrs.append(('pre', '1'))
+    return attrs
+
+def _entryNode(parent, ns, dep):
+    """Create an <ns:entry> node for dependency dep under parent.
+
+    dep is (name, flags, ver). Return the created node."""
+
+    entry = parent.newChild(ns, 'entry', None)
+    for (name, value) in _entryAttrs(dep):
+        entry.newProp(name, value)
     return entry
 
 
+def _primaryDeps(pkg):
+    """Return [(tag, sorted deps)] for the non-empty dependency lists of pkg
+    in primary.xml."""
+
+    result = []
+    for nodename in ['provides', 'conflicts', 'obsoletes']:
+        getter = getattr(pkg, "get%s" % nodename.title())
+        lst = [(name, flags & base.RPMSENSE_SENSEMASK, ver)
+               for (name, flags, ver) in getter()]
+        if len(lst) > 0:
+            functions.normalizeList(lst)
+            lst.sort()
+            result.append((nodename, lst))
+
+    depsList = [(name, flags & (base.RPMSENSE_SENSEMASK
+                                | base.RPMSENSE_PREREQ), ver)
+                for (name, flags, ver) in pkg.getRequires()]
+    if len(depsList) > 0:
+        functions.normalizeList(depsList)
+        depsList.sort()
+        result.append(('requires', depsList))
+    return result
+
+
+def _fileLists(pkg, primary):
+    """Return sorted ([files], [dirs], [ghosts]) of pkg, restricted to the
+    files included in primary.xml if primary."""
+
+    files = list(pkg.iterFilenames())
+    fileflags = _listVal(pkg['fileflags'])
+    filemodes = _listVal(pkg['filemodes'])
+    (writefile, writedir, writeghost) = ([], [], [])
+    for (filename, mode, flag) in zip(files, filemodes, fileflags):
+        if stat.S_ISDIR(mode):
+            if not primary or _dirrc.match(filename):
+                writedir.append(filename)
+        elif not primary or _filerc.match(filename):
+            if flag & base.RPMFILE_GHOST:
+                writeghost.append(filename)
+            else:
+                writefile.append(filename)
+    result = []
+    for lst in (writefile, writedir, writeghost):
+        lst.sort()
+        result.append([_utf8String(f) for f in lst])
+    return result
+
+
 def metadataPrimaryNode(parent, formatns, pkg, pkgid, sumtype, filename, url):
     """Return a <package> node for primary.xml, created from pkg."""
 
@@ -150,52 +215,19 @@ def metadataPrimaryNode(parent, formatns, pkg, pkgid, sumtype, filename, url):
     hr = format.newChild(formatns, 'header-range', None)
     hr.newProp('start', str(pkg.range_header[0]))
     hr.newProp('end', str(pkg.range_header[0] + pkg.range_header[1]))
-    for nodename in ['provides', 'conflicts', 'obsoletes']:
-        getter = getattr(pkg, "get%s" % nodename.title())
-        lst = [(name, flags & base.RPMSENSE_SENSEMASK, ver)
-               for (name, flags, ver) in getter()]
-        if len(lst) > 0:
-            functions.normalizeList(lst)
-            rpconode = format.newChild(formatns, nodename, None)
-            lst.sort()
-            for dep in lst:
-                _entryNode(rpconode, formatns, dep)
+    for (nodename, lst) in _primaryDeps(pkg):
+        rpconode = format.newChild(formatns, nodename, None)
+        for dep in lst:
+            _entryNode(rpconode, formatns, dep)
 
-    depsList = [(name, flags & (base.RPMSENSE_SENSEMASK
-                                | base.RPMSENSE_PREREQ), ver)
-                for (name, flags, ver) in pkg.getRequires()]
-    if len(depsList) > 0:
-        functions.normalizeList(depsList)
-        rpconode = format.newChild(formatns, 'requires', None)
-        depsList.sort()
-        for dep in depsList:
-            entry = _entryNode(rpconode, formatns, dep)
-            if (dep[1] & base.RPMSENSE_PREREQ) != 0:
-                entry.newProp('pre', '1')
-
-    files = _listVal(pkg['filenames'])
-    fileflags = _listVal(pkg['fileflags'])
-    filemodes = _listVal(pkg['filemodes'])
-    (writefile, writedir, writeghost) = ([], [], [])
-    for (filename, mode, flag) in zip(files, filemodes, fileflags):
-        if stat.S_ISDIR(mode):
-            if _dirrc.match(filename):
-                writedir.append(filename)
-        elif _filerc.match(filename):
-            if flag & base.RPMFILE_GHOST:
-                writeghost.append(filename)
-            else:
-                writefile.append(filename)
-    writefile.sort()
+    (writefile, writedir, writeghost) = _fileLists(pkg, True)
     for f in writefile:
-        tnode = format.newChild(None, "file", _utf8String(f))
-    writedir.sort()
+        tnode = format.newChild(None, "file", f)
     for f in writedir:
-        tnode = format.newChild(None, "file", _utf8String(f))
+        tnode = format.newChild(None, "file", f)
         tnode.newProp("type", "dir")
-    writeghost.sort()
     for f in writeghost:
-        tnode = format.newChild(None, "file", _utf8String(f))
+        tnode = format.newChild(None, "file", f)
         tnode.newProp("type", "ghost")
     return pkgNode
 
@@ -211,28 +243,14 @@ def metadataFilelistsNode(parent, pkg, pkgid):
     version.newProp('epoch', pkg.getEpoch())
     version.newProp('ver', pkg['version'])
     version.newProp('rel', pkg['release'])
-    files = _listVal(pkg['filenames'])
-    fileflags = _listVal(pkg['fileflags'])
-    filemodes = _listVal(pkg['filemodes'])
-    (writefile, writedir, writeghost) = ([], [], [])
-    for (filename, mode, flag) in zip(files, filemodes, fileflags):
-        if stat.S_ISDIR(mode):
-            writedir.append(filename)
-        else:
-            if flag & base.RPMFILE_GHOST:
-                writeghost.append(filename)
-            else:
-                writefile.append(filename)
-    writefile.sort()
+    (writefile, writedir, writeghost) = _fileLists(pkg, False)
     for f in writefile:
-        tnode = pkgNode.newChild(None, "file", _utf8String(f))
-    writedir.sort()
+        tnode = pkgNode.newChild(None, "file", f)
     for f in writedir:
-        tnode = pkgNode.newChild(None, "file", _utf8String(f))
+        tnode = pkgNode.newChild(None, "file", f)
         tnode.newProp("type", "dir")
-    writeghost.sort()
     for f in writeghost:
-        tnode = pkgNode.newChild(None, "file", _utf8String(f))
+        tnode = pkgNode.newChild(None, "file", f)
         tnode.newProp("type", "ghost")
     return pkgNode
 
@@ -257,4 +275,581 @@ def metadataOtherNode(parent, pkg, pkgid):
         clog.newProp('date', str(time))
     return pkgNode
 
+
+_escapes = [('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'), ('\r', '&#13;')]
+_attrEscapes = _escapes + [('"', '&quot;'), ('\n', '&#10;'), ('\t', '&#9;')]
+_specialrc = re.compile('[&<>\r]')
+_attrSpecialrc = re.compile('[&<>\r"\n\t]')
+
+def _escape(string, escapes=_escapes, specialrc=_specialrc):
+    """Return UTF-8 string escaped for XML text."""
+
+    if isinstance(string, unicode):
+        string = string.encode('utf-8')
+    if specialrc.search(string) is None:
+        return string
+    for (char, entity) in escapes:
+        string = string.replace(char, entity)
+    return string
+
+def _escapeAttr(string):
+    """Return UTF-8 string escaped for an XML attribute value."""
+    return _escape(string, _attrEscapes, _attrSpecialrc)
+
+
+class _XMLText:
+    """Serialize XML elements as libxml2 does, indented if pretty."""
+
+    def __init__(self, pretty=0):
+        self.out = []
+        self.pretty = pretty
+        self.depth = 0
+        self.empty = False # The start tag of the current element is open
+
+    def start(self, tag, attrs=()):
+        """Start element tag with [(name, value)] attrs."""
+
+        self.__child()
+        self.out.append('<' + tag + self.__attrs(attrs))
+        self.depth += 1
+        self.empty = True
+
+    def end(self, tag):
+        self.depth -= 1
+        if self.empty:
+            self.out.append('/>')
+            self.empty = False
+        else:
+            if self.pretty:
+                self.out.append('\n' + '  ' * self.depth)
+            self.out.append('</%s>' % tag)
+
+    def element(self, tag, text=None, attrs=()):
+        """Add element tag containing text, if any."""
+
+        self.__child()
+        if text:
+            self.out.append('<%s%s>%s</%s>' % (tag, self.__attrs(attrs),
+                                               _escape(text), tag))
+        else:
+            self.out.append('<%s%s/>' % (tag, self.__attrs(attrs)))
+
+    def getvalue(self):
+        return ''.join(self.out)
+
+    def __child(self):
+        if self.empty:
+            self.out.append('>')
+            self.empty = False
+        if self.pretty and self.depth:
+            self.out.append('\n' + '  ' * self.depth)
+
+    def __attrs(self, attrs):
+        return ''.join([' %s="%s"' % (name, _escapeAttr(value))
+                        for (name, value) in attrs])
+
+
+def _versionAttrs(pkg):
+    return [('epoch', pkg.getEpoch()), ('ver', pkg['version']),
+            ('rel', pkg['release'])]
+
+def _fileElements(xml, pkg, primary):
+    (writefile, writedir, writeghost) = _fileLists(pkg, primary)
+    for f in writefile:
+        xml.element('file', f)
+    for f in writedir:
+        xml.element('file', f, [('type', 'dir')])
+    for f in writeghost:
+        xml.element('file', f, [('type', 'ghost')])
+
+
+def metadataPrimaryXML(pkg, pkgid, sumtype, filename, url, stats=None,
+                       pretty=0):
+    """Return the <package> element for primary.xml, created from pkg, as
+    UTF-8 text.
+
+    filename is the location of the package relative to the repository,
+    stats the os.stat() result of the package file if filename is not
+    accessible from the current directory."""
+
+    if stats is None:
+        stats = os.stat(filename)
+    xml = _XMLText(pretty)
+    xml.start('package', [('type', 'rpm')])
+    xml.element('name', pkg['name'])
+    xml.element('arch', _archOrSrc(pkg))
+    xml.element('version', None, _versionAttrs(pkg))
+    xml.element('checksum', pkgid, [('type', sumtype), ('pkgid', 'YES')])
+    for tag in ['summary', 'description', 'packager', 'url']:
+        xml.element(tag, _tagText(pkg[tag]))
+    xml.element('time', None, [('file', str(stats.st_mtime)),
+                               ('build', str(pkg['buildtime'][0]))])
+    xml.element('size', None,
+                [('package', str(stats.st_size)),
+                 ('installed', str(pkg['size'][0])),
+                 ('archive', str(pkg['signature']['payloadsize'][0]))])
+    attrs = []
+    if url != None:
+        attrs.append(('xml:base', url))
+    attrs.append(('href', filename))
+    xml.element('location', None, attrs)
+    xml.start('format')
+    for tag in ['license', 'vendor', 'group', 'buildhost', 'sourcerpm']:
+        xml.element('rpm:' + tag, _tagText(pkg[tag]))
+    xml.element('rpm:header-range', None,
+                [('start', str(pkg.range_header[0])),
+                 ('end', str(pkg.range_header[0] + pkg.range_header[1]))])
+    for (nodename, lst) in _primaryDeps(pkg):
+        xml.start('rpm:' + nodename)
+        for dep in lst:
+            xml.element('rpm:entry', None, _entryAttrs(dep))
+        xml.end('rpm:' + nodename)
+    _fileElements(xml, pkg, True)
+    xml.end('format')
+    xml.end('package')
+    return xml.getvalue()
+
+
+def metadataFilelistsXML(pkg, pkgid, pretty=0):
+    """Return the <package> element for filelists.xml, created from pkg, as
+    UTF-8 text."""
+
+    xml = _XMLText(pretty)
+    xml.start('package', [('pkgid', pkgid), ('name', pkg['name']),
+                          ('arch', _archOrSrc(pkg))])
+    xml.element('version', None, _versionAttrs(pkg))
+    _fileElements(xml, pkg, False)
+    xml.end('package')
+    return xml.getvalue()
+
+
+def metadataOtherXML(pkg, pkgid, pretty=0):
+    """Return the <package> element for other.xml, created from pkg, as UTF-8
+    text."""
+
+    xml = _XMLText(pretty)
+    xml.start('package', [('pkgid', pkgid), ('name', pkg['name']),
+                          ('arch', _archOrSrc(pkg))])
+    xml.element('version', None, _versionAttrs(pkg))
+    names = _listVal(pkg['changelogname'])
+    times = _listVal(pkg['changelogtime'])
+    texts = _listVal(pkg['changelogtext'])
+    for (name, time, text) in zip(names, times, texts):
+        xml.element('changelog', _utf8String(text),
+                    [('author', _utf8String(name)), ('date', str(time))])
+    xml.end('package')
+    return xml.getvalue()
+
+
+def metadataRepomdXML(data):
+    """Return repomd.xml as UTF-8 text.
+
+    data is a list of dicts describing the metadata files, with keys 'type',
+    'href', 'sumtype', 'checksum' and 'timestamp' and optional 'xml:base',
+    'open-checksum', 'database_version', 'fileglob' and 'dirglob' (lists of
+    globs)."""
+
+    xml = _XMLText(1)
+    xml.start('repomd', [('xmlns', 'http://linux.duke.edu/metadata/repo')])
+    for d in data:
+        xml.start('data', [('type', d['type'])])
+        attrs = []
+        if d.get('xml:base') is not None:
+            attrs.append(('xml:base', d['xml:base']))
+        attrs.append(('href', d['href']))
+        xml.element('location', None, attrs)
+        xml.element('checksum', d['checksum'], [('type', d['sumtype'])])
+        xml.element('timestamp', str(d['timestamp']))
+        if d.get('open-checksum') is not None:
+            xml.element('open-checksum', d['open-checksum'],
+                        [('type', d['sumtype'])])
+        if d.get('database_version') is not None:
+            xml.element('database_version', str(d['database_version']))
+        for glob in d.get('fileglob', []):
+            xml.element('fileglob', glob)
+        for glob in d.get('dirglob', []):
+            xml.element('dirglob', glob)
+        xml.end('data')
+    xml.end('repomd')
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + xml.getvalue() + '\n'
+
+
+def _newDigest(sumtype):
+    if sumtype == 'md5':
+        return md5.new()
+    elif sumtype == 'sha':
+        return sha.new()
+    raise ValueError, "Unknown checksum type %s" % sumtype
+
+
+class MetadataFile:
+    """A gzip compressed metadata file, written in large blocks and
+    checksummed while it is written.
+
+    After close(), checksum is the checksum of the file, openchecksum the one
+    of the uncompressed data and timestamp the modification time of the
+    file."""
+
+    def __init__(self, filename, sumtype, compresslevel=9, bufsize=262144):
+        self.filename = filename
+        self.sumtype = sumtype
+        self.bufsize = bufsize
+        self.fd = open(filename, "wb")
+        self.buf = []
+        self.buflen = 0
+        self.size = 0
+        self.crc = zlib.crc32('')
+        self.digest = _newDigest(sumtype)
+        self.opendigest = _newDigest(sumtype)
+        self.compressor = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                           -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+                                           0)
+        self.checksum = None
+        self.openchecksum = None
+        self.timestamp = None
+        # The modification time is 0, so unchanged data gives an unchanged
+        # checksum
+        name = os.path.basename(filename)
+        if name.endswith('.gz'):
+            name = name[:-3]
+        self.__write('\037\213\010' + chr(gzip.FNAME) +
+                     struct.pack('<L', 0) + '\002\377' + name + '\000')
+
+    def write(self, data):
+        """Write string data.
+
+        Raise IOError."""
+
+        self.buf.append(data)
+        self.buflen += len(data)
+        if self.buflen >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        """Compress buffered data.
+
+        Raise IOError."""
+
+        data = ''.join(self.buf)
+        self.buf = []
+        self.buflen = 0
+        self.size += len(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.opendigest.update(data)
+        self.__write(self.compressor.compress(data))
+
+    def close(self):
+        """Finish the file.
+
+        Raise IOError, OSError."""
+
+        self.flush()
+        self.__write(self.compressor.flush())
+        self.__write(struct.pack('<LL', self.crc & 0xffffffffL,
+                                 self.size & 0xffffffffL))
+        self.fd.close()
+        self.checksum = self.digest.hexdigest()
+        self.openchecksum = self.opendigest.hexdigest()
+        self.timestamp = int(os.stat(self.filename).st_mtime)
+
+    def __write(self, data):
+        if data:
+            self.digest.update(data)
+            self.fd.write(data)
+
+
+def metadataDatabasesSupported():
+    """Return True if MetadataDatabase can be used."""
+
+    from pyrpm.database import sqlitecompat
+    return sqlitecompat.ok and sqlitecompat.sqlite is None
+
+
+# dbtype => [(table, [columns without pkgKey])] of the per-package rows
+_dbTables = {
+    "primary": [(table, ["name", "flags", "epoch", "version", "release"])
+                for table in ("provides", "conflicts", "obsoletes")] +
+               [("requires", ["name", "flags", "epoch", "version", "release",
+                              "pre"]),
+                ("files", ["name", "type"])],
+    "filelists": [("filelist", ["dirname", "filenames", "filetypes"])],
+    "other": [("changelog", ["author", "date", "changelog"])],
+    }
+
+class MetadataDatabase:
+    """A sqlite database with primary, filelists or other metadata in the
+    format read by SqliteRepoDB, filled in a single transaction.
+
+    close() creates the indexes and compresses the database to
+    filename.bz2.  After that, checksum is the checksum of the compressed
+    file, openchecksum the one of the database and timestamp the
+    modification time of the compressed file.  dbversion is the database
+    format version."""
+
+    def __init__(self, filename, dbtype, sumtype):
+        """Create filename for dbtype ("primary", "filelists" or "other")
+        metadata.
+
+        Raise IOError, OSError, sqlite errors."""
+
+        from pyrpm.database import sqliterepodb, sqlitecompat
+        self.sqliterepodb = sqliterepodb
+        self.dbversion = sqliterepodb.dbversion
+        self.filename = filename
+        self.dbtype = dbtype
+        self.sumtype = sumtype
+        self.checksum = None
+        self.openchecksum = None
+        self.timestamp = None
+        self.oldfilename = None
+        self.pkgkey = 0
+        if os.path.exists(filename):
+            os.unlink(filename)
+        self.db = sqlitecompat.connect(filename)
+        self.db.text_factory = str
+        self.cur = self.db.cursor()
+        # The file is useless until close() anyway
+        self.cur.execute("PRAGMA synchronous = OFF")
+        sqliterepodb.createTables(self.cur, dbtype)
+        self.inserts = { }
+        if dbtype == "primary":
+            columns = ["pkgKey"] + list(sqliterepodb.SqliteRepoDB.COLUMNS)
+        else:
+            columns = ["pkgKey", "pkgId"]
+        self.columns = columns
+        self.inserts["packages"] = "INSERT INTO packages (%s) VALUES (%s)" \
+                                   % (", ".join(columns),
+                                      ", ".join(["?"] * len(columns)))
+        for (table, columns) in _dbTables[dbtype]:
+            self.inserts[table] = "INSERT INTO %s (%s, pkgKey) VALUES (%s)" \
+                                  % (table, ", ".join(columns),
+                                     ", ".join(["?"] * (len(columns) + 1)))
+
+    def addPackage(self, pkg, pkgid, sumtype, filename, url, stats=None):
+        """Add RpmPackage pkg with the arguments of metadataPrimaryXML().
+
+        Raise OSError, sqlite errors."""
+
+        self.pkgkey += 1
+        key = self.pkgkey
+        if self.dbtype == "primary":
+            if stats is None:
+                stats = os.stat(filename)
+            self.cur.execute(self.inserts["packages"], (key,
+                pkgid, pkg['name'], _archOrSrc(pkg), pkg['version'],
+                pkg.getEpoch(), pkg['release'], _tagText(pkg['summary']),
+                _tagText(pkg['description']), _tagText(pkg['url']),
+                str(stats.st_mtime), str(pkg['buildtime'][0]),
+                _tagText(pkg['license']), _tagText(pkg['vendor']),
+                _tagText(pkg['group']), _tagText(pkg['buildhost']),
+                _tagText(pkg['sourcerpm']), str(pkg.range_header[0]),
+                str(pkg.range_header[0] + pkg.range_header[1]),
+                _tagText(pkg['packager']), str(stats.st_size),
+                str(pkg['size'][0]),
+                str(pkg['signature']['payloadsize'][0]), filename, url,
+                sumtype, pkgid))
+            for (table, deps) in _primaryDeps(pkg):
+                rows = []
+                for dep in deps:
+                    attrs = dict(_entryAttrs(dep))
+                    row = [attrs['name'], attrs.get('flags'),
+                           attrs.get('epoch'), attrs.get('ver'),
+                           attrs.get('rel')]
+                    if table == 'requires':
+                        row.append(('FALSE', 'TRUE')[attrs.has_key('pre')])
+                    row.append(key)
+                    rows.append(row)
+                self.cur.executemany(self.inserts[table], rows)
+            (files, dirs, ghosts) = _fileLists(pkg, True)
+            rows = [(f, 'file', key) for f in files] + \
+                   [(f, 'dir', key) for f in dirs] + \
+                   [(f, 'ghost', key) for f in ghosts]
+            self.cur.executemany(self.inserts["files"], rows)
+            return
+
+        self.cur.execute(self.inserts["packages"], (key, pkgid))
+        if self.dbtype == "filelists":
+            dirs = { }
+            order = [ ]
+            (files, dirnames, ghosts) = _fileLists(pkg, False)
+            for (lst, ftype) in ((files, 'f'), (dirnames, 'd'),
+                                 (ghosts, 'g')):
+                for f in lst:
+                    (dirname, basename) = functions.pathsplit(f)
+                    if not dirs.has_key(dirname):
+                        dirs[dirname] = ([ ], [ ])
+                        order.append(dirname)
+                    dirs[dirname][0].append(basename)
+                    dirs[dirname][1].append(ftype)
+            self.cur.executemany(self.inserts["filelist"],
+                                 [(dirname, '/'.join(dirs[dirname][0]),
+                                   ''.join(dirs[dirname][1]), key)
+                                  for dirname in order])
+        else:
+            names = _listVal(pkg['changelogname'])
+            times = _listVal(pkg['changelogtime'])
+            texts = _listVal(pkg['changelogtext'])
+            self.cur.executemany(self.inserts["changelog"],
+                                 [(_utf8String(name), str(time),
+                                   _utf8String(text), key)
+                                  for (name, time, text)
+                                  in zip(names, times, texts)])
+
+    def attachOld(self, filename):
+        """Make the packages in database filename, written by an earlier
+        MetadataDatabase for the same dbtype, available to copyPackage().
+
+        Raise sqlite errors."""
+
+        self.cur.execute("ATTACH DATABASE ? AS old", (filename,))
+        self.oldfilename = filename
+        # Not indexed in SqliteRepoDB databases
+        if self.dbtype == "primary":
+            self.cur.execute("CREATE INDEX IF NOT EXISTS old.filespkg "
+                             "ON files (pkgKey)")
+
+    def getOldKey(self, pkgid):
+        """Return the key of the package with pkgid in the attached
+        database, or None if it is not there."""
+
+        if self.oldfilename is None:
+            return None
+        self.cur.execute("SELECT pkgKey FROM old.packages WHERE pkgId = ?",
+                         (pkgid,))
+        row = self.cur.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def copyPackage(self, oldkey):
+        """Copy the package with oldkey from the attached database.
+
+        Raise sqlite errors."""
+
+        self.pkgkey += 1
+        key = self.pkgkey
+        self.cur.execute("INSERT INTO packages (%s) SELECT ?, %s FROM "
+                         "old.packages WHERE pkgKey = ?" %
+                         (", ".join(self.columns),
+                          ", ".join(self.columns[1:])), (key, oldkey))
+        for (table, columns) in _dbTables[self.dbtype]:
+            self.cur.execute("INSERT INTO %s (%s, pkgKey) SELECT %s, ? FROM "
+                             "old.%s WHERE pkgKey = ?" %
+                             (table, ", ".join(columns), ", ".join(columns),
+                              table), (key, str(oldkey)))
+
+    def close(self, checksum):
+        """Finish the database for XML metadata with checksum and compress
+        it.
+
+        Raise IOError, OSError, sqlite errors."""
+
+        import bz2
+        if self.oldfilename is not None:
+            self.db.commit()
+            self.cur.execute("DETACH DATABASE old")
+        self.sqliterepodb.createIndexes(self.cur, self.dbtype)
+        self.cur.execute("INSERT INTO db_info (dbversion, checksum) "
+                         "VALUES (?, ?)",
+                         (self.dbversion, checksum))
+        self.db.commit()
+        self.cur.close()
+        self.db.close()
+
+        digest = _newDigest(self.sumtype)
+        opendigest = _newDigest(self.sumtype)
+        compressor = bz2.BZ2Compressor(9)
+        infd = open(self.filename, "rb")
+        outfd = open(self.filename + ".bz2", "wb")
+        while True:
+            data = infd.read(65536)
+            if not data:
+                break
+            opendigest.update(data)
+            data = compressor.compress(data)
+            digest.update(data)
+            outfd.write(data)
+        data = compressor.flush()
+        digest.update(data)
+        outfd.write(data)
+        infd.close()
+        outfd.close()
+        os.unlink(self.filename)
+        self.checksum = digest.hexdigest()
+        self.openchecksum = opendigest.hexdigest()
+        self.timestamp = int(os.stat(self.filename + ".bz2").st_mtime)
+
+
+_pkgidrc = re.compile('pkgid="([^"]*)"')
+_checksumrc = re.compile('<checksum[^>]*pkgid="YES"[^>]*>([^<]*)</checksum>')
+
+class MetadataFragments:
+    """The serialized <package> elements of an existing primary.xml.gz,
+    filelists.xml.gz or other.xml.gz, looked up by pkgid.
+
+    The file is read only as far as needed: packages are usually requested
+    in the order they were written, so only the elements skipped over on the
+    way are kept in memory."""
+
+    def __init__(self, filename, bufsize=65536):
+        self.fd = gzip.GzipFile(filename, "rb")
+        self.bufsize = bufsize
+        self.skipped = { }              # pkgid => fragment
+        self.fragments = self.__iterFragments()
+
+    def get(self, pkgid):
+        """Return the <package> element for pkgid as serialized text, or None
+        if it is not in the file.
+
+        Raise IOError."""
+
+        fragment = self.skipped.pop(pkgid, None)
+        if fragment is not None:
+            return fragment
+        if self.fragments is None:
+            return None
+        for (id_, fragment) in self.fragments:
+            if id_ == pkgid:
+                return fragment
+            self.skipped[id_] = fragment
+        self.fragments = None
+        return None
+
+    def close(self):
+        self.fd.close()
+        self.skipped.clear()
+        self.fragments = None
+
+    def __iterFragments(self):
+        """Yield (pkgid, fragment) for each <package> element in self.fd."""
+
+        data = ''
+        pos = 0
+        while True:
+            start = data.find("<package", pos)
+            while start != -1 and data[start + 8:start + 9] not in " >":
+                start = data.find("<package", start + 8)
+            end = -1
+            if start != -1:
+                end = data.find("</package>", start)
+            if end == -1:
+                if start == -1:
+                    # Keep a possibly incomplete "<package" at the end
+                    start = max(pos, len(data) - 8)
+                chunk = self.fd.read(self.bufsize)
+                if not chunk:
+                    return
+                data = data[start:] + chunk
+                pos = 0
+                continue
+            end += len("</package>")
+            fragment = data[start:end]
+            pos = end
+            tag = fragment[:fragment.find(">") + 1]
+            m = _pkgidrc.search(tag)
+            if m is None:
+                m = _checksumrc.search(fragment)
+            if m is not None:
+                yield (m.group(1), fragment)
+
 # vim:ts=4:sw=4:showmatch:expandtab
@@ -17,7 +17,9 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
+import re, weakref
 import pyrpm.openpgp as openpgp
+import lists
 
 #
 # Database base class only __init__ and clear are implemented
@@ -37,6 +39,8 @@ class RpmDatabase:
         self.buildroot = buildroot or ''
         if self.buildroot and self.buildroot[-1] != '/':
             self.buildroot += '/'
+        self._initDependencyCache()
+        self._initNameIndex()
         RpmDatabase.clear(self)
         self.keyring = openpgp.PGPKeyRing()
         self.is_read = 0                # 1 if the database was already read
@@ -46,7 +50,7 @@ class RpmDatabase:
 
     # clear all structures
     def clear(self):
-        pass
+        self._changedDependencies()
 
     # Clears the specified tags resp. keeps the ntags in all packages in repo.
     # Make sure that this only gets implemented properly in databases where
@@ -158,24 +162,73 @@ class RpmDatabase:
     def searchPkgs(self, names):
         raise NotImplementedError
 
+    # Use precompiled regex for faster checks
+    __fnmatchre__ = re.compile(".*[\*\[\]\?].*")
+    __splitre__ = re.compile(r"([:*?\-.]|\[[^]]+\])")
+
+    def _initNameIndex(self):
+        # (generation from _changedDependencies(), sorted getNames())
+        self._sortednames = None
+        # RpmPackage => getAllNames()
+        self._allnames = weakref.WeakKeyDictionary()
+
+    def _getSortedNames(self):
+        if self._sortednames is None or \
+               self._sortednames[0] != self._depgeneration:
+            names = { }
+            for name in self.getNames():
+                names[name] = None
+            names = names.keys()
+            names.sort()
+            self._sortednames = (self._depgeneration, names)
+        return self._sortednames[1]
+
+    def _getAllNames(self, pkg):
+        names = self._allnames.get(pkg)
+        if names is None:
+            names = pkg.getAllNames()
+            self._allnames[pkg] = names
+        return names
+
+    def _searchPkgsByName(self, names):
+        """searchPkgs() using getPkgsByName(): a glob only looks at the
+        packages with names in the sorted range of its literal start."""
+        result = []
+        for name in names:
+            parts = self.__splitre__.split(name)
+            if self.__fnmatchre__.match(name):
+                regex = lists.compileGlob(name)
+                for pkgname in lists.prefixRange(self._getSortedNames(),
+                                                 parts[0]):
+                    for pkg in self.getPkgsByName(pkgname):
+                        for n in self._getAllNames(pkg):
+                            if regex.match(n):
+                                result.append(pkg)
+                                break
+            else:
+                for idx in xrange(1, len(parts)+1, 2):
+                    pkgs = self.getPkgsByName(''.join(parts[:idx]))
+                    for pkg in pkgs:
+                        for n in self._getAllNames(pkg):
+                            if n == name:
+                                result.append(pkg)
+                                break
+        return result
+
     def search(self, words):
+        """Return a list of RpmPackages containing any of words in the name,
+        summary, description, packager, group or url, ignoring case, best
+        matches first."""
+        return lists.rankSearch(self.searchScores(words))
+
+    def searchScores(self, words):
+        """Return [(rank, RpmPackage)] for the packages found by
+        search(words), so the results of several databases can be ranked
+        together by lists.rankSearch()."""
         if not words:
             return []
-        result = []
-        for pkg in self.getPkgs():
-            for word in words:
-                if (word in pkg.get('name', '') or
-                    word in (pkg['summary'] and pkg['summary'][0] or '') or
-                    word in (pkg['description'] and
-                             pkg['description'][0] or '') or
-                    word in (pkg['rpm_packager'] or '') or 
-                    word in (pkg['group'] and pkg['group'][0] or '') or
-                    word in (pkg['url'] and pkg['url'][0] or '')
-                    ):
-                    result.append(pkg)
-                    break
-        return result
-                
+        return lists.scoreSearch(self.getPkgs(), words)
+
 
     def searchProvides(self, name, flag, version):
         raise NotImplementedError
@@ -197,11 +250,61 @@ class RpmDatabase:
 
     def searchDependency(self, name, flag, version):
         """Return list of RpmPackages from self.names providing
-        (name, RPMSENSE_* flag, EVR string) dep."""
+        (name, RPMSENSE_* flag, EVR string) dep.
+
+        Results are remembered until a package providing name is added or
+        removed, see _changedDependencies()."""
+        key = (name, flag, version)
+        generation = self._getDependencyGeneration(name)
+        entry = self._depcache.get(key)
+        if entry is not None and entry[0] == generation:
+            self.depcache_hits += 1
+            return entry[1][:]
+        self.depcache_misses += 1
         s = self.searchProvides(name, flag, version).keys()
         if name[0] == '/': # all filenames are beginning with a '/'
             s += self.searchFilenames(name)
-        return s
+        self._depcache[key] = (generation, s)
+        return s[:]
+
+    def getDependencyCacheStats(self):
+        """Return (hits, misses) of the searchDependency() cache."""
+        return (self.depcache_hits, self.depcache_misses)
+
+    def _initDependencyCache(self):
+        # (name, flag, version) => (generation, [RpmPackage])
+        self._depcache = { }
+        # Bumped by every change of provides or files
+        self._depgeneration = 1
+        # Generation of the last change of all provides and files
+        self._depreset = 1
+        # name or "/" for any file => generation of the last change
+        self._depnames = { }
+        self.depcache_hits = 0
+        self.depcache_misses = 0
+
+    def _changedDependencies(self, pkg=None):
+        """Invalidate searchDependency() results for the provides and files
+        of RpmPackage pkg, or all results if pkg is None."""
+        self._depgeneration += 1
+        if pkg is None:
+            self._depreset = self._depgeneration
+            self._depnames.clear()
+            self._depcache.clear()
+            return
+        generation = self._depgeneration
+        self._depnames[pkg["name"]] = generation
+        for (name, flag, version) in pkg["provides"] or ():
+            self._depnames[name] = generation
+        self._depnames["/"] = generation
+
+    def _getDependencyGeneration(self, name):
+        """Return the generation of the last change that may have changed
+        searchDependency() results for name."""
+        generation = max(self._depreset, self._depnames.get(name, 0))
+        if name[0] == '/':
+            generation = max(generation, self._depnames.get('/', 0))
+        return generation
 
     def _getDBPath(self):
         raise NotImplementedError
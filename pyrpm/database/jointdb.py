@@ -37,6 +37,7 @@ class JointDB(db.RpmDatabase):
         self.config = config
         self.source = source
         self.buildroot = buildroot
+        self._initDependencyCache()
         self.clear()
         self.keyring = openpgp.PGPKeyRing()
         self.is_read = 0                # 1 if the database was already read
@@ -67,17 +68,28 @@ class JointDB(db.RpmDatabase):
 
     def addDB(self, db):
         self.dbs.append(db)
+        self._changedDependencies()
 
     def removeDB(self, db):
         self.dbs.remove(db)
+        self._changedDependencies()
 
     def removeAllDBs(self):
         self.dbs[:] = []
+        self._changedDependencies()
 
     # clear all structures
     def clear(self):
         for db in self.dbs:
             db.clear()
+        self._changedDependencies()
+
+    def _getDependencyGeneration(self, name):
+        # Generations only grow, so the sum changes with any of them
+        generation = db.RpmDatabase._getDependencyGeneration(self, name)
+        for _db in self.dbs:
+            generation += _db._getDependencyGeneration(name)
+        return generation
 
     def clearPkgs(self, tags=None, ntags=None):
         for db in self.dbs:
@@ -225,10 +237,10 @@ class JointDB(db.RpmDatabase):
             result.extend(db.searchPkgs(names))
         return result
 
-    def search(self, names):
+    def searchScores(self, words):
         result = []
         for db in self.dbs:
-            result.extend(db.search(names))
+            result.extend(db.searchScores(words))
         return result
 
     def searchProvides(self, name, flag, version):
@@ -16,9 +16,41 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
-import re, fnmatch
+import re, fnmatch, bisect
 import pyrpm.functions as functions
 from pyrpm.base import RPMSENSE_EQUAL
+from lrucache import LRUCache
+
+# glob pattern => compiled regex
+_globcache = LRUCache(maxsize=1000, name="glob patterns")
+_globprefixre = re.compile(r"[^*?[]*")
+
+def compileGlob(pattern):
+    """Return the compiled regex for the fnmatch pattern."""
+
+    regex = _globcache.get(pattern)
+    if regex is None:
+        regex = re.compile(fnmatch.translate(pattern))
+        _globcache[pattern] = regex
+    return regex
+
+def globPrefix(pattern):
+    """Return the literal start of the fnmatch pattern, all matches start
+    with it."""
+
+    return _globprefixre.match(pattern).group()
+
+def prefixRange(sortedlist, prefix):
+    """Return the items of sorted string list sortedlist that start with
+    prefix."""
+
+    if not prefix:
+        return sortedlist
+    start = bisect.bisect_left(sortedlist, prefix)
+    end = start
+    while end < len(sortedlist) and sortedlist[end].startswith(prefix):
+        end += 1
+    return sortedlist[start:end]
 
 def genBasenames2(oldfilenames):
     (basenames, dirnames) = ([], [])
@@ -226,24 +258,273 @@ class TriggersList(ConflictsList):
     """A database of Triggers:"""
     TAG = "triggers"
 
+
+class TriggerIndex:
+    """The triggers of the installed packages during a transaction.
+
+    The index is read from RpmDatabase db on first use and updated by
+    addPkg() and removePkg() as the transaction installs and erases
+    packages, so running triggers needs no database searches.  Trigger
+    versions are parsed only once."""
+
+    def __init__(self, db):
+        self.db = db
+        # triggered name => [(flag, version, (E, V, R), prog, script,
+        #                     triggering RpmPackage)], None if not read yet
+        self.hash = None
+        self.counts = { }               # name => number of installed pkgs
+        self.parsed = { }               # RpmPackage => getPkgTriggers()
+
+    def getPkgTriggers(self, pkg):
+        """Return [(name, flag, version, (E, V, R), prog, script)] for the
+        triggers of RpmPackage pkg."""
+
+        triggers = self.parsed.get(pkg)
+        if triggers is None:
+            triggers = [(name, flag, version, functions.evrSplit(version),
+                         prog, script)
+                        for (name, flag, version, prog, script)
+                        in pkg["triggers"] or ()]
+            self.parsed[pkg] = triggers
+        return triggers
+
+    def addPkg(self, pkg):
+        """Add RpmPackage pkg, which was added to self.db."""
+
+        name = pkg["name"]
+        if name in self.counts:
+            self.counts[name] += 1
+        if self.hash is not None:
+            self.__addTriggers(pkg)
+
+    def removePkg(self, pkg):
+        """Remove RpmPackage pkg, which was removed from self.db."""
+
+        name = pkg["name"]
+        if name in self.counts:
+            self.counts[name] -= 1
+        if self.hash is not None:
+            for (tname, flag, version, evr, prog, script) in \
+                    self.getPkgTriggers(pkg):
+                l = self.hash.get(tname, [ ])
+                l[:] = [entry for entry in l if entry[-1] is not pkg]
+                if not l:
+                    self.hash.pop(tname, None)
+        self.parsed.pop(pkg, None)
+
+    def search(self, name, flag, version):
+        """Return {RpmPackage: [(name, flag, version, prog, script)]} with the
+        triggers on (name, RPMSENSE_* flag, EVR string version), like
+        RpmDatabase.searchTriggers()."""
+
+        if self.hash is None:
+            self.hash = { }
+            pkgs = { }
+            for entry in self.db.iterTriggers():
+                pkgs[entry[-1]] = None
+            for pkg in pkgs:
+                self.__addTriggers(pkg)
+        evr = functions.evrSplit(version)
+        result = { }
+        for (f, v, tevr, prog, script, pkg) in self.hash.get(name, ()):
+            if version == "" or v == "" or \
+                   functions.rangeCompare(flag, evr, f, tevr):
+                result.setdefault(pkg, [ ]).append((name, f, v, prog, script))
+        return result
+
+    def numPkgs(self, name):
+        """Return the number of installed packages named name."""
+
+        count = self.counts.get(name)
+        if count is None:
+            count = len(self.db.getPkgsByName(name))
+            self.counts[name] = count
+        return count
+
+    def __addTriggers(self, pkg):
+        # Like the RpmDB triggername index, only the first trigger of pkg on
+        # each name is used
+        names = { }
+        for (name, flag, version, evr, prog, script) in \
+                self.getPkgTriggers(pkg):
+            if name in names:
+                continue
+            names[name] = None
+            self.hash.setdefault(name, [ ]).append((flag, version, evr, prog,
+                                                    script, pkg))
+
+# Tags searched by RpmDatabase.search() with the weight of a match
+searchtags = (("name", 8), ("summary", 4), ("description", 2),
+              ("rpm_packager", 1), ("group", 1), ("url", 1))
+
+def getSearchTexts(pkg):
+    """Return [(weight, lower case text)] for the searchtags of RpmPackage
+    pkg."""
+
+    texts = [ ]
+    for (tag, weight) in searchtags:
+        value = pkg[tag]
+        if isinstance(value, (list, tuple)):
+            value = value and value[0]
+        if value:
+            texts.append((weight, value.lower()))
+    return texts
+
+def searchScore(texts, words):
+    """Return the rank of [(weight, lower case text)] texts for lower case
+    words: the sum of the weight of the best text containing each word, 0 if
+    no word matches."""
+
+    score = 0
+    for word in words:
+        for (weight, text) in texts:
+            if word in text:
+                score += weight
+                break
+    return score
+
+def scoreSearch(pkgs, words):
+    """Return [(rank, RpmPackage)] for the RpmPackages from pkgs containing
+    any of words in their searchtags, ignoring case."""
+
+    words = [ word.lower() for word in words ]
+    result = [ ]
+    for pkg in pkgs:
+        score = searchScore(getSearchTexts(pkg), words)
+        if score:
+            result.append((score, pkg))
+    return result
+
+def rankSearch(scores):
+    """Return the RpmPackages from [(rank, RpmPackage)] scores, best matches
+    first, then by name, equal entries in their order in scores."""
+
+    result = [ (-scores[i][0], scores[i][1]["name"], i, scores[i][1])
+               for i in xrange(len(scores)) ]
+    result.sort()
+    return [ r[-1] for r in result ]
+
+class TextList:
+    """An index of the lower case alphanumeric words in the searchtags of
+    RpmPackages, and of the words by their trigrams (substrings of three
+    characters), so the words containing a part of a search word are found
+    without looking at the other words.
+
+    search() returns candidates for scoreSearch(): every package containing
+    one of the words, and maybe others."""
+
+    _splitre = re.compile("[^a-z0-9]+")
+
+    def __init__(self):
+        self.hash = { }                 # word => [key]
+        self.trigrams = { }             # trigram => {word: None}
+
+    def clear(self):
+        self.hash.clear()
+        self.trigrams.clear()
+
+    def _key(self, pkg):
+        # What is stored for pkg
+        return pkg
+
+    def _words(self, pkg):
+        words = { }
+        for (weight, text) in getSearchTexts(pkg):
+            for word in self._splitre.split(text):
+                if word:
+                    words[word] = None
+        return words.keys()
+
+    def addPkg(self, pkg):
+        key = self._key(pkg)
+        for word in self._words(pkg):
+            l = self.hash.get(word)
+            if l is not None:
+                l.append(key)
+                continue
+            self.hash[word] = [key]
+            for i in xrange(len(word) - 2):
+                self.trigrams.setdefault(word[i:i+3], { })[word] = None
+
+    def removePkg(self, pkg):
+        key = self._key(pkg)
+        for word in self._words(pkg):
+            l = self.hash.get(word)
+            if not l or key not in l:
+                continue
+            l.remove(key)
+            if l:
+                continue
+            del self.hash[word]
+            for i in xrange(len(word) - 2):
+                words = self.trigrams.get(word[i:i+3])
+                if words is not None:
+                    words.pop(word, None)
+                    if not words:
+                        del self.trigrams[word[i:i+3]]
+
+    def search(self, words):
+        """Return a list of the keys of packages that may contain any of
+        words, or None if a word has no part of at least three letters or
+        digits and all packages have to be checked."""
+
+        result = { }
+        for word in words:
+            keys = None
+            # Each alphanumeric part of word is inside one indexed word
+            for part in self._splitre.split(word.lower()):
+                if len(part) < 3:
+                    continue
+                found = { }
+                for indexed in self.__wordsContaining(part):
+                    for key in self.hash[indexed]:
+                        found[key] = None
+                if keys is not None:
+                    for key in keys.keys():
+                        if not found.has_key(key):
+                            del keys[key]
+                else:
+                    keys = found
+            if keys is None:
+                return None
+            result.update(keys)
+        return result.keys()
+
+    def __wordsContaining(self, part):
+        """Return the indexed words containing part, which has at least three
+        characters."""
+
+        smallest = None
+        for i in xrange(len(part) - 2):
+            words = self.trigrams.get(part[i:i+3])
+            if not words:
+                return [ ]
+            if smallest is None or len(words) < len(smallest):
+                smallest = words
+        return [ word for word in smallest if part in word ]
+
 class NevraList:
 
     def __init__(self):
         self.hash = { }
+        self.sorted = None              # sorted self.hash keys, or None
 
     def clear(self):
         self.hash.clear()
+        self.sorted = None
 
 
     def addPkg(self, pkg):
         for name in pkg.getAllNames():
             self.hash.setdefault(name, []).append(pkg)
+        self.sorted = None
 
     def removePkg(self, pkg):
         for name in pkg.getAllNames():
             self.hash[name].remove(pkg)
             if not self.hash[name]:
                 del self.hash[name]
+        self.sorted = None
 
     _fnmatchre = re.compile(".*[\*\[\]\{\}\?].*")
 
@@ -254,9 +535,11 @@ class NevraList:
             if hash.has_key(pkgname):
                 result.extend(hash[pkgname])
             if self._fnmatchre.match(pkgname):
-                restring = fnmatch.translate(pkgname)
-                regex = re.compile(restring)
-                for item in hash.keys():
+                regex = compileGlob(pkgname)
+                if self.sorted is None:
+                    self.sorted = hash.keys()
+                    self.sorted.sort()
+                for item in prefixRange(self.sorted, globPrefix(pkgname)):
                     if regex.match(item):
                         result.extend(hash[item])
         functions.normalizeList(result)
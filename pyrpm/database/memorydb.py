@@ -31,6 +31,7 @@ class RpmMemoryDB(db.RpmDatabase):
         self.__len__ = self.pkgs.__len__
         self.__getitem__ = self.pkgs.__getitem__
         self._lists = [] # is going to contain self.*_list
+        self._searches = 0 # search() calls, the second one builds text_list
         RpmMemoryDB.clear(self)
 
     list_classes = {
@@ -41,6 +42,7 @@ class RpmMemoryDB(db.RpmDatabase):
         "obsoletes_list" : lists.ObsoletesList,
         "triggers_list" : lists.TriggersList,
         "nevra_list" : lists.NevraList,
+        "text_list" : lists.TextList,
         }
 
     def __getattr__(self, name):
@@ -95,6 +97,7 @@ class RpmMemoryDB(db.RpmDatabase):
         self.names.setdefault(name, [ ]).append(pkg)
         for l in self._lists:
             l.addPkg(pkg)
+        self._changedDependencies(pkg)
 
         return self.OK
 
@@ -109,6 +112,7 @@ class RpmMemoryDB(db.RpmDatabase):
             del self.names[name]
         for l in self._lists:
             l.removePkg(pkg)
+        self._changedDependencies(pkg)
 
         return self.OK
 
@@ -157,6 +161,7 @@ class RpmMemoryDB(db.RpmDatabase):
         for l in self._lists:
             delattr(self, l.name)
         self._lists[:] = []
+        self._changedDependencies()
 
     def searchProvides(self, name, flag, version):
         return self.provides_list.search(name, flag, version)
@@ -179,6 +184,18 @@ class RpmMemoryDB(db.RpmDatabase):
     def searchPkgs(self, names):
         return self.nevra_list.search(names)
 
+    def searchScores(self, words):
+        if not words:
+            return []
+        pkgs = None
+        # A single search is faster without building the index
+        if self._searches or self.__dict__.has_key("text_list"):
+            pkgs = self.text_list.search(words)
+        self._searches += 1
+        if pkgs is None:
+            pkgs = self.pkgs
+        return lists.scoreSearch(pkgs, words)
+
     def _getDBPath(self):
         """Return a physical path to the database."""
 
@@ -24,6 +24,7 @@ from pyrpm.base import *
 from pyrpm.cache import NetworkCache
 from comps import RpmCompsXML
 import pyrpm.functions as functions
+import pyrpm.createrepo as createrepo
 import pyrpm.package as package
 import pyrpm.openpgp as openpgp
 from pyrpm.logger import log
@@ -63,12 +64,18 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
                 RPMSENSE_EQUAL | RPMSENSE_LESS: "LE",
                 RPMSENSE_EQUAL | RPMSENSE_GREATER: "GE"}
 
+    # Number of paths collected in memory while writing the filelists index
+    _FILEINDEX_BATCH = 200000
+
     def __init__(self, config, source, buildroot='', reponame="default", nc=None):
         """Exclude packages matching whitespace-separated excludes.  Use
         reponame for cache subdirectory name and pkg["yumreponame"].
 
         Load PGP keys from URLs in key_urls."""
 
+        # On-disk filelists index, see importFilelist()
+        self._fileindex = None
+        self._fileindexpkgs = None
         memorydb.RpmMemoryDB.__init__(self, config, source, buildroot)
         self.reponame = reponame
         self.excludes = self.config.excludes[:]
@@ -248,12 +255,20 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
             return 0
         return memorydb.RpmMemoryDB.addPkg(self, pkg)
 
+    def clear(self):
+        memorydb.RpmMemoryDB.clear(self)
+        self.__closeFileIndex()
+
     def isFilelistImported(self):
         return self.filelist_imported
 
     def importFilelist(self):
         """Parse filelists.xml.gz if it was not parsed before.
 
+        With config.filelistindex only build (on first use) and open an
+        on-disk index of filelists.xml.gz; the complete file list of a
+        package is loaded when searchFilenames() finds one of its files.
+
         Return 1 on success, 0 on failure."""
 
         # We need to have successfully read a repo from one source before we
@@ -277,6 +292,13 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
                 filename = self.nc.cache(filelists, 1)
             if not filename:
                 return 0
+            if self.config.filelistindex and \
+                   self.repomd["filelists"].has_key("checksum") and \
+                   self.__openFileIndex(filename,
+                                        self.repomd["filelists"]["checksum"]):
+                self._changedDependencies()
+                self.filelist_imported = 1
+                return 1
             try:
                 fd = PyGZIP(filename)
                 ip = iterparse(fd, events=("start","end"))
@@ -285,16 +307,166 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
                 log.error("Couldn't parse filelists.xml")
                 return 0
             self._parse(ip)
+            self._changedDependencies()
             self.filelist_imported = 1
         return 1
 
-    def createRepo(self):
-        """Create repodata metadata for self.source.
+    def searchFilenames(self, filename):
+        ret = memorydb.RpmMemoryDB.searchFilenames(self, filename)
+        if self._fileindex is None:
+            return ret
+        try:
+            nevras = self._fileindex[filename]
+        except KeyError:
+            return ret
+        ret = ret[:]
+        for nevra in nevras.split("\n"):
+            # Packages are removed from _fileindexpkgs once their complete
+            # file list is loaded, after that filenames_list finds them.
+            pkgs = self._fileindexpkgs.pop(nevra, None)
+            if pkgs is None:
+                continue
+            for pkg in pkgs:
+                self.__loadIndexedFiles(pkg, nevra)
+                if pkg in self and pkg not in ret:
+                    ret.append(pkg)
+        return ret
+
+    def __openFileIndex(self, filename, csum):
+        """Open the on-disk index of filelists.xml.gz in filename with
+        checksum csum, create it if it does not exist yet.
+
+        Return 1 on success, 0 on failure."""
+
+        try:
+            import bsddb
+        except ImportError:
+            log.warning("bsddb not available, importing complete filelist")
+            return 0
+        indexname = os.path.join(self.config.cachedir, self.reponame,
+                                 "filelists.%s.db" % csum)
+        if not os.path.exists(indexname):
+            log.info2("Creating filelist index for repository %s",
+                      self.reponame)
+            if not self.__createFileIndex(bsddb, filename, indexname):
+                return 0
+        try:
+            self._fileindex = bsddb.hashopen(indexname, "r")
+        except bsddb.error, e:
+            log.error("Couldn't open filelist index %s: %s", indexname, e)
+            return 0
+        self._fileindexpkgs = { }
+        for pkg in self.pkgs:
+            nevra = "%s-%s:%s-%s.%s" % (pkg["name"], pkg.getEpoch(),
+                                        pkg["version"], pkg["release"],
+                                        pkg["arch"])
+            self._fileindexpkgs.setdefault(nevra, [ ]).append(pkg)
+        return 1
+
+    def __writeFileIndexPaths(self, db, paths):
+        """Append the NEVRAs in dict path => [NEVRA] paths to the entries of
+        the paths in file index db and clear paths."""
+
+        for (f, nevras) in paths.iteritems():
+            value = "\n".join(nevras)
+            if db.has_key(f):
+                value = db[f] + "\n" + value
+            db[f] = value
+        paths.clear()
+
+    def __createFileIndex(self, bsddb, filename, indexname):
+        """Write an index of filelists.xml.gz in filename to indexname.
+
+        The index maps each path to the newline-separated NEVRAs of the
+        packages containing it, and "\\0" + NEVRA to the newline-separated
+        file list and file type list of that package, separated by "\\0".
+
+        Return 1 on success, 0 on failure."""
+
+        dirname = os.path.dirname(indexname)
+        try:
+            functions.makeDirs(indexname)
+            (fd, tmpname) = functions.mkstemp_file(dirname, functions.tmpprefix)
+            os.close(fd)
+        except (IOError, OSError), e:
+            log.error("Couldn't create filelist index %s: %s", indexname, e)
+            return 0
+        try:
+            db = bsddb.hashopen(tmpname, "n")
+            paths = { }                 # path => [NEVRA], not yet in db
+            ip = iter(iterparse(PyGZIP(filename), events=("start","end")))
+            for event, elem in ip:
+                if event != "start" or not elem.tag.endswith("}package"):
+                    continue
+                props = elem.attrib
+                (name, arch) = (props.get("name"), props.get("arch"))
+                if name is None or arch is None:
+                    continue
+                try:
+                    (epoch, version, release, filelist, typelist) = \
+                            self.__readFilelist(ip)
+                except ValueError, e:
+                    log.warning("%s: %s", name, e)
+                    continue
+                nevra = "%s-%s:%s-%s.%s" % (name, epoch, version, release,
+                                            arch)
+                filelist = [f.encode("utf-8") for f in filelist]
+                for f in filelist:
+                    if f in paths:
+                        paths[f].append(nevra)
+                    else:
+                        paths[f] = [nevra]
+                db["\0" + nevra] = "\n".join(filelist) + "\0" + \
+                                   "\n".join(typelist)
+                elem.clear()
+                if len(paths) >= self._FILEINDEX_BATCH:
+                    self.__writeFileIndexPaths(db, paths)
+            self.__writeFileIndexPaths(db, paths)
+            db.close()
+            # Indexes of older filelists are of no use anymore
+            for name in os.listdir(dirname):
+                if name.startswith("filelists.") and name.endswith(".db"):
+                    functions._unlink(os.path.join(dirname, name))
+            os.rename(tmpname, indexname)
+        except (IOError, OSError, SyntaxError, bsddb.error), e:
+            log.error("Couldn't create filelist index %s: %s", indexname, e)
+            functions._unlink(tmpname)
+            return 0
+        return 1
+
+    def __loadIndexedFiles(self, pkg, nevra):
+        """Set the complete file list of RpmPackage pkg with NEVRA nevra
+        from the filelist index."""
+
+        (files, types) = self._fileindex["\0" + nevra].split("\0")
+        if files:
+            (files, types) = (files.split("\n"), types.split("\n"))
+        else:
+            (files, types) = ([ ], [ ])
+        # filenames_list has to forget the files from primary.xml first
+        haslist = self.__dict__.has_key("filenames_list")
+        if haslist:
+            self.filenames_list.removePkg(pkg)
+        self._setPkgFiles(pkg, files, types)
+        if haslist:
+            self.filenames_list.addPkg(pkg)
+
+    def __closeFileIndex(self):
+        if self._fileindex is not None:
+            self._fileindex.close()
+            self._fileindex = None
+            self._fileindexpkgs = None
+            self.filelist_imported = 0
+
+    def createRepo(self, sumtype=None):
+        """Create repodata metadata for self.source with sumtype ("md5" or
+        "sha", default config.checksum) checksums.
 
         Return 1 on success, 0 on failure.  Assumes self.source is a local file
         system path without schema prefix."""
 
-        import gzip, libxml2
+        if sumtype is None:
+            sumtype = self.config.checksum
         log.info1("Pass 1: Parsing package headers for file requires.")
         self.__readDir(self.source, "")
         filename = functions._uriToFilename(self.source)
@@ -305,81 +477,71 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
             except OSError, e:
                 log.error("%s: Couldn't create repodata: %s", filename, e)
                 return 0
+        files = [ ]
         try:
-            pfd = gzip.GzipFile(os.path.join(datapath, "primary.xml.gz"), "wb")
-        except IOError:
-            return 0
-        try:
-            ffd = gzip.GzipFile(os.path.join(datapath, "filelists.xml.gz"),
-                                "wb")
-        except IOError:
+            for (ftype, root, ns) in \
+                    (("primary", "metadata",
+                      'xmlns="http://linux.duke.edu/metadata/common" '
+                      'xmlns:rpm="http://linux.duke.edu/metadata/rpm"'),
+                     ("filelists", "filelists",
+                      'xmlns="http://linux.duke.edu/metadata/filelists"'),
+                     ("other", "otherdata",
+                      'xmlns="http://linux.duke.edu/metadata/other"')):
+                fd = createrepo.MetadataFile(os.path.join(datapath,
+                                                          ftype + ".xml.gz"),
+                                             sumtype)
+                fd.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+                fd.write('<%s %s packages="%d">\n' % (root, ns,
+                                                      len(self.getPkgs())))
+                files.append((ftype, root, fd))
+        except IOError, e:
+            log.error("%s: Couldn't create repodata: %s", datapath, e)
             return 0
+        (pfd, ffd, ofd) = [fd for (ftype, root, fd) in files]
+        log.info1("Pass 2: Writing repodata information.")
         try:
-            rfd = open(os.path.join(datapath, "repomd.xml"))
-        except IOError:
+            for pkg in self.getPkgs():
+                log.info2("Processing complete data of package %s.",
+                          pkg.getNEVRA())
+                pkg.header_read = 0
+                try:
+                    pkg.open()
+                    pkg.read()
+                except (IOError, ValueError), e:
+                    log.warning("%s: %s", pkg.getNEVRA(), e)
+                    continue
+                try:
+                    checksum = self.__getChecksum(pkg, sumtype)
+                except (IOError, NotImplementedError), e:
+                    log.warning("%s: %s", pkg.getNEVRA(), e)
+                    continue
+                pkg["yumchecksum"] = checksum
+                pfd.write(createrepo.metadataPrimaryXML(pkg, checksum, sumtype,
+                    pkg["yumlocation"].lstrip("/"), None,
+                    os.stat(pkg.source)) + "\n")
+                ffd.write(createrepo.metadataFilelistsXML(pkg, checksum) +
+                          "\n")
+                ofd.write(createrepo.metadataOtherXML(pkg, checksum) + "\n")
+                try:
+                    pkg.close()
+                except IOError:
+                    pass # Should not happen when opening for reading anyway
+                pkg.clear()
+            data = [ ]
+            for (ftype, root, fd) in files:
+                fd.write("</%s>\n" % root)
+                fd.close()
+                data.append({"type": ftype,
+                             "href": "repodata/%s.xml.gz" % ftype,
+                             "sumtype": sumtype, "checksum": fd.checksum,
+                             "timestamp": fd.timestamp,
+                             "open-checksum": fd.openchecksum})
+            rfd = open(os.path.join(datapath, "repomd.xml"), "w")
+            rfd.write(createrepo.metadataRepomdXML(data))
+            rfd.close()
+        except (IOError, OSError), e:
+            log.error("%s: Couldn't write repodata: %s", datapath, e)
             return 0
-        #try:
-        #    ofd = gzip.GzipFile(os.path.join(datapath, "other.xml.gz"), "wb")
-        #except IOError:
-        #    return 0
-        pdoc = libxml2.newDoc("1.0")
-        proot = pdoc.newChild(None, "metadata", None)
-        fdoc = libxml2.newDoc("1.0")
-        froot = fdoc.newChild(None, "filelists", None)
-        #odoc = libxml2.newDoc("1.0")
-        #oroot = odoc.newChild(None, "filelists", None)
-        log.info1("Pass 2: Writing repodata information.")
-        pfd.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        pfd.write('<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">\n' % len(self.getPkgs()))
-        ffd.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        ffd.write('<filelists xmlns:rpm="http://linux.duke.edu/filelists" packages="%d">\n' % len(self.getPkgs()))
-        for pkg in self.getPkgs():
-            log.info2("Processing complete data of package %s.",
-                      pkg.getNEVRA())
-            pkg.header_read = 0
-            try:
-                pkg.open()
-                pkg.read()
-            except (IOError, ValueError), e:
-                log.warning("%s: %s", pkg.getNEVRA(), e)
-                continue
-            # If it is a source rpm change the arch to "src". Only valid
-            # for createRepo, never do this anywhere else. ;)
-            if pkg.isSourceRPM():
-                pkg["arch"] = "src"
-            try:
-                checksum = self.__getChecksum(pkg)
-            except (IOError, NotImplementedError), e:
-                log.warning("%s: %s", pkg.getNEVRA(), e)
-                continue
-            pkg["yumchecksum"] = checksum
-            self.__writePrimary(pfd, proot, pkg)
-            self.__writeFilelists(ffd, froot, pkg)
-#            self.__writeOther(ofd, oroot, pkg)
-            try:
-                pkg.close()
-            except IOError:
-                pass # Should not happen when opening for reading anyway
-            pkg.clear()
-        pfd.write('</metadata>\n')
-        ffd.write('</filelists>\n')
-        pfd.close()
-        ffd.close()
-        # Write repomd.xml
-        rfd.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        rfd.write('<repomd xmlns="http://linux.duke.edu/metadata/repo">\n')
-        rfd.write('  <data type="primary">\n')
-        rfd.write('    <location href="repodata/primary.xml.gz"/>\n')
-        rfd.write('  </data>\n')
-        rfd.write('  <data type="filelists">\n')
-        rfd.write('    <location href="repodata/filelists.xml.gz"/>\n')
-        rfd.write('  </data>\n')
-# how do we know that there is a comps file?
-#        rfd.write('  <data type="group">\n')
-#        rfd.write('    <location href="repodata/comps.xml"/>\n')
-#        rfd.write('  </data>\n')
-        rfd.write('</repomd>\n')
-        rfd.close()
         return 1
 
     def _matchesFile(self, fname):
@@ -441,35 +603,6 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
         result = index.search(self.excludes)
         return bool(result)
 
-    def __escape(self, s):
-        """Return escaped string converted to UTF-8"""
-
-        if s == None:
-            return ''
-        s = s.replace("&", "&amp;")
-        if isinstance(s, unicode):
-            return s
-        try:
-            x = unicode(s, 'ascii')
-            return s
-        except UnicodeError:
-            encodings = ['utf-8', 'iso-8859-1', 'iso-8859-15', 'iso-8859-2']
-            for enc in encodings:
-                try:
-                    x = unicode(s, enc)
-                except UnicodeError:
-                    pass
-                else:
-                    if x.encode(enc) == s:
-                        return x.encode('utf-8')
-        newstring = ''
-        for char in s:
-            if ord(char) > 127:
-                newstring = newstring + '?'
-            else:
-                newstring = newstring + char
-        return re.sub("\n$", '', newstring) # FIXME: not done in other returns
-
     def __parseRepomd(self, ip):
         """Parse repomd.xml for SHA1 checks of the files.
         Returns a hash of the form:
@@ -618,6 +751,17 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
 
         Raise ValueError on invalid data."""
 
+        (epoch, version, release, filelist, typelist) = \
+                self.__readFilelist(ip)
+        self._addFilesToPkg(pname, epoch, version, release, arch,
+                           filelist, typelist)
+
+    def __readFilelist(self, ip):
+        """Read the file list from the current <package> tag.
+
+        Return (epoch, version, release, file list, file type list).  Raise
+        ValueError on invalid data."""
+
         filelist = []
         typelist = []
         version, release, epoch = None, None, None
@@ -639,8 +783,7 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
             elem.clear()
         if version is None or release is None or epoch is None:
             raise ValueError, "Missing version information"
-        self._addFilesToPkg(pname, epoch, version, release, arch,
-                           filelist, typelist)
+        return (epoch, version, release, filelist, typelist)
 
     def __parseFormat(self, ip, pkg):
         """Parse data from current <format> tag to RpmPackage pkg.
@@ -735,41 +878,46 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
                       filelist, filetypelist):
         nevra = "%s-%s:%s-%s.%s" % (pname, epoch, version, release, arch)
         pkgs = self.getPkgsByName(pname)
-        dhash = {}
         for pkg in pkgs:
             if pkg.getNEVRA() == nevra:
-                if len(dhash) == 0:
-                    (didx, dnameold) = (-1, None)
-                    (dnames, dindexes, bnames) = ([], [], [])
-                    for f in filelist:
-                        idx = f.rindex("/")
-                        if idx < 0:
-                            raise ValueError, "Couldn't find '/' in filename from filelist"
-                        dname = f[:idx+1]
-                        fname = f[idx+1:]
-                        dhash.setdefault(dname, []).append(fname)
-                        bnames.append(fname)
-                        if dnameold == dname:
-                            dindexes.append(didx)
-                        else:
-                            dnames.append(dname)
-                            didx += 1
-                            dindexes.append(didx)
-                            dnameold = dname
-                pkg["dirnames"] = dnames
-                pkg["dirindexes"] = dindexes
-                pkg["basenames"] = bnames
-                if pkg.has_key("oldfilenames"):
-                    del pkg["oldfilenames"]
-                pkg.filetypelist = filetypelist
-                # get rid of old dirnames, dirindexes and basenames
-                #if pkg.has_key("dirnames"):
-                #    del pkg["dirnames"]
-                #if pkg.has_key("dirindexes"):
-                #    del pkg["dirindexes"]
-                #if pkg.has_key("basenames"):
-                #    del pkg["basenames"]
-                #pkg["oldfilenames"] = filelist
+                self._setPkgFiles(pkg, filelist, filetypelist)
+
+    def _setPkgFiles(self, pkg, filelist, filetypelist):
+        """Replace the file list of RpmPackage pkg by filelist with file
+        types filetypelist.
+
+        Raise ValueError on invalid data."""
+
+        (didx, dnameold) = (-1, None)
+        (dnames, dindexes, bnames) = ([], [], [])
+        for f in filelist:
+            idx = f.rindex("/")
+            if idx < 0:
+                raise ValueError, "Couldn't find '/' in filename from filelist"
+            dname = f[:idx+1]
+            fname = f[idx+1:]
+            bnames.append(fname)
+            if dnameold == dname:
+                dindexes.append(didx)
+            else:
+                dnames.append(dname)
+                didx += 1
+                dindexes.append(didx)
+                dnameold = dname
+        pkg["dirnames"] = dnames
+        pkg["dirindexes"] = dindexes
+        pkg["basenames"] = bnames
+        if pkg.has_key("oldfilenames"):
+            del pkg["oldfilenames"]
+        pkg.filetypelist = filetypelist
+        # get rid of old dirnames, dirindexes and basenames
+        #if pkg.has_key("dirnames"):
+        #    del pkg["dirnames"]
+        #if pkg.has_key("dirindexes"):
+        #    del pkg["dirindexes"]
+        #if pkg.has_key("basenames"):
+        #    del pkg["basenames"]
+        #pkg["oldfilenames"] = filelist
 
     def __readDir(self, dir, location):
         """Look for non-excluded *.rpm files under dir and add them to
@@ -795,71 +943,14 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
             pkg["yumlocation"] = location+pkg.source[len(dir):]
             self.addPkg(pkg)
 
-    def __writePrimary(self, fd, parent, pkg):
-        """Write primary.xml data about RpmPackage pkg to fd."""
-        pkg_node = parent.newChild(None, "package", None)
-        pkg_node.newProp('type', 'rpm')
-        pkg_node.newChild(None, 'name', pkg['name'])
-        pkg_node.newChild(None, 'arch', pkg['arch'])
-        tnode = pkg_node.newChild(None, 'version', None)
-        if pkg.has_key('epoch'):
-            tnode.newProp('epoch', str(pkg['epoch'][0]))
-        else:
-            tnode.newProp('epoch', '0')
-        tnode.newProp('ver', pkg['version'])
-        tnode.newProp('rel', pkg['release'])
-        tnode = pkg_node.newChild(None, 'checksum', pkg["yumchecksum"])
-        tnode.newProp('type', self.config.checksum)
-        tnode.newProp('pkgid', 'YES')
-        pkg_node.newChild(None, 'summary', self.__escape(pkg['summary'][0]))
-        pkg_node.newChild(None, 'description', self.__escape(pkg['description'][0]))
-        pkg_node.newChild(None, 'packager', self.__escape(pkg['packager']))
-        pkg_node.newChild(None, 'url', self.__escape(pkg['url']))
-        tnode = pkg_node.newChild(None, 'time', None)
-        tnode.newProp('file', str(pkg['buildtime'][0]))
-        tnode.newProp('build', str(pkg['buildtime'][0]))
-        tnode = pkg_node.newChild(None, 'size', None)
-        tnode.newProp('package', str(pkg['signature']['size_in_sig'][0]+pkg.range_signature[0]+pkg.range_signature[1]))
-        tnode.newProp('installed', str(pkg['size'][0]))
-        tnode.newProp('archive', str(pkg['signature']['payloadsize'][0]))
-        tnode = pkg_node.newChild(None, 'location', None)
-        tnode.newProp('href', pkg["yumlocation"])
-        fnode = pkg_node.newChild(None, 'format', None)
-        self.__generateFormat(fnode, pkg)
-        output = pkg_node.serialize('UTF-8', self.config.pretty)
-        fd.write(output+"\n")
-        pkg_node.unlinkNode()
-        pkg_node.freeNode()
-        del pkg_node
-
-    def __writeFilelists(self, fd, parent, pkg):
-        """Write primary.xml data about RpmPackage pkg to fd."""
-        pkg_node = parent.newChild(None, "package", None)
-        pkg_node.newProp('pkgid', pkg["yumchecksum"])
-        pkg_node.newProp('name', pkg["name"])
-        pkg_node.newProp('arch', pkg["arch"])
-        tnode = pkg_node.newChild(None, 'version', None)
-        if pkg.has_key('epoch'):
-            tnode.newProp('epoch', str(pkg['epoch'][0]))
-        else:
-            tnode.newProp('epoch', '0')
-        tnode.newProp('ver', pkg['version'])
-        tnode.newProp('rel', pkg['release'])
-        self.__generateFilelist(pkg_node, pkg, 0)
-        output = pkg_node.serialize('UTF-8', self.config.pretty)
-        fd.write(output+"\n")
-        pkg_node.unlinkNode()
-        pkg_node.freeNode()
-        del pkg_node
-
-    def __getChecksum(self, pkg):
-        """Return checksum of package source of RpmPackage pkg.
+    def __getChecksum(self, pkg, sumtype):
+        """Return sumtype checksum of package source of RpmPackage pkg.
 
         Raise IOError, NotImplementedError."""
 
         from pyrpm.io import getRpmIOFactory
         io = getRpmIOFactory(pkg.source)
-        if self.config.checksum == "md5":
+        if sumtype == "md5":
             import md5
             s = md5.new()
         else:
@@ -868,93 +959,4 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
         io.updateDigestFromRange(s, 0, None)
         return s.hexdigest()
 
-    def __generateFormat(self, node, pkg):
-        """Add RPM-specific tags for RpmPackage pkg."""
-
-        node.newChild(None, 'rpm:license', self.__escape(pkg['license']))
-        node.newChild(None, 'rpm:vendor', self.__escape(pkg['vendor']))
-        node.newChild(None, 'rpm:group', self.__escape(pkg['group'][0]))
-        node.newChild(None, 'rpm:buildhost', self.__escape(pkg['buildhost']))
-        node.newChild(None, 'rpm:sourcerpm', self.__escape(pkg['sourcerpm']))
-        tnode = node.newChild(None, 'rpm:header-range', None)
-        tnode.newProp('start', str(pkg.range_signature[0] + pkg.range_signature[1]))
-        tnode.newProp('end', str(pkg.range_payload[0]))
-        if len(pkg["provides"]) > 0:
-            self.__generateDeps(node, pkg, "provides")
-        if len(pkg["requires"]) > 0:
-            self.__generateDeps(node, pkg, "requires")
-        if len(pkg["conflicts"]) > 0:
-            self.__generateDeps(node, pkg, "conflicts")
-        if len(pkg["obsoletes"]) > 0:
-            self.__generateDeps(node, pkg, "obsoletes")
-        self.__generateFilelist(node, pkg)
-
-    def __generateDeps(self, node, pkg, name):
-        """Add RPM-specific dependency info for
-        RpmPackage pkg dependencies "name"."""
-
-        dnode = node.newChild(None, 'rpm:%s' % name, None)
-        deps = self.__filterDuplicateDeps(pkg[name])
-        for dep in deps:
-            enode = dnode.newChild(None, 'rpm:entry', None)
-            enode.newProp('name', dep[0])
-            if dep[1] != "":
-                if (dep[1] & RPMSENSE_SENSEMASK) != 0:
-                    enode.newProp('flags', self.flagmap[dep[1] & RPMSENSE_SENSEMASK])
-                if isLegacyPreReq(dep[1]) or isInstallPreReq(dep[1]):
-                    enode.newProp('pre', '1')
-            if dep[2] != "":
-                e,v,r = functions.evrSplit(dep[2])
-                enode.newProp('epoch', e)
-                enode.newProp('ver', v)
-                if r != "":
-                    enode.newProp('rel', r)
-
-    def __generateFilelist(self, node, pkg, filter=1):
-        """Add RPM-specific file list for RpmPackage pkg.
-
-        Restrict the output to _dirrc/_filerc or known file requires if
-        filter."""
-
-        files = pkg['filenames']
-        fileflags = pkg['fileflags']
-        filemodes = pkg['filemodes']
-        if files == None or fileflags == None or filemodes == None:
-            return
-        (writefile, writedir, writeghost) = ([], [], [])
-        for (fname, mode, flag) in zip(files, filemodes, fileflags):
-            if stat.S_ISDIR(mode):
-                if not filter or \
-                   self._dirrc.match(fname):
-                    writedir.append(fname)
-            elif not filter or \
-                 self._filerc.match(fname):
-                if flag & RPMFILE_GHOST:
-                    writeghost.append(fname)
-                else:
-                    writefile.append(fname)
-        writefile.sort()
-        for f in writefile:
-            tnode = node.newChild(None, "file", self.__escape(f))
-        writedir.sort()
-        for f in writedir:
-            tnode = node.newChild(None, "file", self.__escape(f))
-            tnode.newProp("type", "dir")
-        writeghost.sort()
-        for f in writeghost:
-            tnode = node.newChild(None, "file", self.__escape(f))
-            tnode.newProp("type", "ghost")
-
-    def __filterDuplicateDeps(self, deps):
-        """Return the list of (name, flags, release) dependencies deps with
-        duplicates (when output by __generateDeps ()) removed."""
-
-        fdeps = []
-        for (name, flags, version) in deps:
-            flags &= RPMSENSE_SENSEMASK | RPMSENSE_PREREQ
-            if (name, flags, version) not in fdeps:
-                fdeps.append((name, flags, version))
-        fdeps.sort()
-        return fdeps
-
 # vim:ts=4:sw=4:showmatch:expandtab
@@ -18,7 +18,7 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
-import time, struct, os, bsddb, re, fnmatch
+import time, struct, os, bsddb, re, fnmatch, weakref
 (pack, unpack) = (struct.pack, struct.unpack)
 from binascii import a2b_hex
 from pyrpm.base import *
@@ -28,6 +28,7 @@ import pyrpm.package as package
 import db
 import pyrpm.openpgp as openpgp
 import lists
+from lrucache import LRUCache
 from pyrpm.logger import log
 
 class RpmDBPackage(package.RpmPackage):
@@ -76,6 +77,93 @@ class RpmDBPackage(package.RpmPackage):
             self[key] = value
             return value
 
+class RpmDBPackageCache:
+    """Package objects read from the rpmdb, by package id.
+
+    Unpinned packages are dropped in least recently used order when their
+    estimated size exceeds maxsize bytes (0: unlimited).  Dropped packages
+    still referenced elsewhere are found through a weak reference, so a
+    package id never maps to two different objects at the same time.
+    Pinned packages are never dropped."""
+
+    def __init__(self, maxsize=0):
+        self._lru = LRUCache(maxsize=0, maxweight=maxsize,
+                             weigh=self._pkgSize, name="rpmdb packages")
+        self._weak = weakref.WeakValueDictionary()
+        self._pinned = { }              # id => pkg
+
+    def has_key(self, id):
+        return self.get(id) is not None
+
+    def get(self, id, default=None):
+        pkg = self._pinned.get(id)
+        if pkg is not None:
+            return pkg
+        pkg = self._lru.get(id)
+        if pkg is not None:
+            return pkg
+        pkg = self._weak.get(id)
+        if pkg is None:
+            return default
+        self._lru[id] = pkg
+        return pkg
+
+    def __getitem__(self, id):
+        pkg = self.get(id)
+        if pkg is None:
+            raise KeyError, id
+        return pkg
+
+    def __setitem__(self, id, pkg):
+        self._weak[id] = pkg
+        if self._pinned.has_key(id):
+            self._pinned[id] = pkg
+        else:
+            self._lru[id] = pkg
+
+    def pop(self, id, default=None):
+        pkg = self.get(id, default)
+        self._lru.pop(id, None)
+        self._pinned.pop(id, None)
+        if self._weak.has_key(id):
+            del self._weak[id]
+        return pkg
+
+    def clear(self):
+        self._lru.clear()
+        self._weak = weakref.WeakValueDictionary()
+        self._pinned.clear()
+
+    def pin(self, id, pkg):
+        """Keep pkg cached until unpin(id) or clear()."""
+        self._weak[id] = pkg
+        self._pinned[id] = pkg
+        self._lru.pop(id, None)
+
+    def unpin(self, id):
+        """Let the package with id be dropped again."""
+        pkg = self._pinned.pop(id, None)
+        if pkg is not None:
+            self._lru[id] = pkg
+
+    def _pkgSize(self, pkg):
+        # Rough number of bytes used by the package object once all tags
+        # are read (RpmDBPackage reads most of them on demand): one Python
+        # object per header entry value plus the dict overhead.
+        size = 1024
+        for idx in getattr(pkg, "indexdata", {}).itervalues():
+            size += 64 + 48 * idx[3]
+        return size
+
+
+class RpmDBTextList(lists.TextList):
+    """TextList of package ids, so indexed packages can still be dropped
+    from the package cache."""
+
+    def _key(self, pkg):
+        return pkg.key
+
+
 class RpmDB(db.RpmDatabase):
 
     zero = pack("I", 0)
@@ -86,11 +174,13 @@ class RpmDB(db.RpmDatabase):
         self.config.tscolor = self.__getInstallColor()
         self.netsharedpath = self.__getNetSharedPath()
         self.reponame = "installed"
-        self._pkgs = { }
+        self._pkgs = RpmDBPackageCache(self.config.rpmdbcache * 1024 * 1024)
         self.basenames_cache = {}
         self.clear()
         self.dbopen = 0
         self.obsoletes_list = None
+        self.text_list = None
+        self._searches = 0              # search() calls, see searchScores()
 
         self.path = self._getDBPath()
 
@@ -119,8 +209,10 @@ class RpmDB(db.RpmDatabase):
     # clear all structures
     def clear(self):
         self.obsoletes_list = None
+        self.text_list = None
         self.basenames_cache.clear()
         self._pkgs.clear()
+        self._changedDependencies()
 
     def setBuildroot(self, buildroot):
         """Set database chroot to buildroot."""
@@ -328,11 +420,14 @@ class RpmDB(db.RpmDatabase):
         return 1
 
     def addPkg(self, pkg):
-        self.basenames_cache.clear()
+        self._changedBasenames(pkg)
+        self._changedDependencies(pkg)
         result = self._addPkg(pkg)
         if result and pkg["obsoletes"] and self.obsoletes_list is not None:
             p = self.getPkgById(result)
             self.obsoletes_list.addPkg(p)
+        if result and self.text_list is not None:
+            self.text_list.addPkg(self.getPkgById(result))
         return bool(result)
 
     def _addPkg(self, pkg):
@@ -405,18 +500,27 @@ class RpmDB(db.RpmDatabase):
         return pkgid
 
     def removePkg(self, pkg):
-        self.basenames_cache.clear()
         if (not hasattr(pkg, 'key') or
             not hasattr(pkg, 'db') or
             pkg.db is not self):
             return 0
 
+        self._changedBasenames(pkg)
+        self._changedDependencies(pkg)
         result = self._removePkg(pkg)
         self._pkgs.pop(pkg.key, None)
         if self.obsoletes_list and result:
             self.obsoletes_list.removePkg(pkg)
+        if self.text_list is not None and result:
+            self.text_list.removePkg(pkg)
         return result
 
+    def _changedBasenames(self, pkg):
+        """Drop the numFileDuplicates() results for the basenames of
+        RpmPackage pkg."""
+        for basename in pkg["basenames"] or ():
+            self.basenames_cache.pop(basename, None)
+
     def _removePkg(self, pkg):
         pkgid = pkg.key
 
@@ -651,13 +755,12 @@ class RpmDB(db.RpmDatabase):
             return []
 
     def getPkgById(self, id):
-        if self._pkgs.has_key(id):
-            return self._pkgs[id]
-        else:
+        pkg = self._pkgs.get(id)
+        if pkg is None:
             pkg = self.readRpm(id, self.packages_db, self.tags)
             if pkg is not None:
                 self._pkgs[id] = pkg
-            return pkg
+        return pkg
 
     def searchName(self, name):
         data = self.name_db.get(name, '')
@@ -752,6 +855,7 @@ class RpmDB(db.RpmDatabase):
 
     def reloadDependencies(self):
         self.obsoletes_list = None
+        self._changedDependencies()
 
     def _search(self, db, attr, name, flag, version):
         data = db.get(name, '')
@@ -819,9 +923,29 @@ class RpmDB(db.RpmDatabase):
 
 
 
-    # Use precompiled regex for faster checks
-    __fnmatchre__ = re.compile(".*[\*\[\]\?].*")
-    __splitre__ = re.compile(r"([:*?\-.]|\[[^]]+\])")
+    def _getTextList(self, build=True):
+        """Return the RpmDBTextList of the packages, None if it doesn't exist
+        and not build."""
+        if self.text_list is None and build:
+            self.text_list = RpmDBTextList()
+            for pkg in self.getPkgs():
+                self.text_list.addPkg(pkg)
+        return self.text_list
+
+    def searchScores(self, words):
+        if not words:
+            return []
+        keys = None
+        # A single search is faster without building the index
+        text_list = self._getTextList(self._searches > 0)
+        self._searches += 1
+        if text_list is not None:
+            keys = text_list.search(words)
+        if keys is None:
+            pkgs = self.getPkgs()
+        else:
+            pkgs = filter(None, [self.getPkgById(key) for key in keys])
+        return lists.scoreSearch(pkgs, words)
 
     def searchPkgs(self, names):
         """Return a list of RpmPackage's from pkgs matching pkgnames.
@@ -830,30 +954,7 @@ class RpmDB(db.RpmDatabase):
         interpreted as a glob pattern. The resulting list contains all matches
         in arbitrary order, and it may contain a single package more than
         once."""
-        result = []
-        pkgnames = None
-        for name in names:
-            parts = self.__splitre__.split(name)
-            if self.__fnmatchre__.match(name):
-                regex = re.compile(fnmatch.translate(name))
-                if pkgnames is None:
-                    pkgnames = self.getNames()
-                for pkgname in pkgnames:
-                    if pkgname.startswith(parts[0]):
-                        pkgs = self.getPkgsByName(pkgname)
-                        for pkg in pkgs:
-                            for n in pkg.getAllNames():
-                                if regex.match(n):
-                                    result.append(pkg)
-                                    break
-            else:
-                for idx in xrange(1, len(parts)+1, 2):
-                    pkgs = self.getPkgsByName(''.join(parts[:idx]))
-                    for pkg in pkgs:
-                        for n in pkg.getAllNames():
-                            if n == name:
-                                result.append(pkg)
-                                break
+        result = self._searchPkgsByName(names)
         functions.normalizeList(result)
         return result
 
@@ -32,6 +32,10 @@ class RpmExternalSearchDB(RpmMemoryDB):
         self.filecache.clear()
         RpmMemoryDB.reloadDependencies(self)
 
+    def _getDependencyGeneration(self, name):
+        return RpmMemoryDB._getDependencyGeneration(self, name) + \
+               self.externaldb._getDependencyGeneration(name)
+
     def searchFilenames(self, filename):
         if not self.filecache.has_key(filename):
             self.filecache[filename] = self.externaldb.searchFilenames(
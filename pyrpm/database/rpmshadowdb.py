@@ -34,16 +34,25 @@ class RpmDiskShadowDB(rpmdb.RpmDB):
         self.triggername_db    = rpmdb.triggername_db
 
         self.obsoletes_list = rpmdb.obsoletes_list
+        self._searches = 0
 
         self.deleted = {}
 
         self.path = rpmdb.path
         self.tags = rpmdb.tags
 
+        self._initDependencyCache()
+        self._initNameIndex()
+
     def __contains__(self, pkg):
         return hasattr(pkg, "db") and (pkg.db is self.rpmdb) and \
                hasattr(pkg, "key") and (self.getPkgById(pkg.key) is pkg)
 
+    def _getDependencyGeneration(self, name):
+        # Packages are shared with self.rpmdb
+        return rpmdb.RpmDB._getDependencyGeneration(self, name) + \
+               self.rpmdb._getDependencyGeneration(name)
+
     def getPkgById(self, id):
         pkg = self.rpmdb.getPkgById(id)
         if pkg in self.deleted:
@@ -53,28 +62,37 @@ class RpmDiskShadowDB(rpmdb.RpmDB):
 
     def addPkg(self, pkg):
         if (hasattr(pkg, 'key') and
-            self._pkgs.has_key(pkg.key) and
-            self._pkgs[pkg.key] is pkg):
+            self._pkgs.get(pkg.key) is pkg):
             if pkg not in self.deleted:
                 return self.ALREADY_INSTALLED
             else:
-                self.deleted[pkg] = None
+                del self.deleted[pkg]
+                self._pkgs.unpin(pkg.key)
+                self._changedDependencies(pkg)
                 return self.OK
         else:
             return NOT_DELETED
 
     def removePkg(self, pkg):
         if (hasattr(pkg, 'key') and
-            self._pkgs.has_key(pkg.key) and
-            self._pkgs[pkg.key] is pkg):
+            self._pkgs.get(pkg.key) is pkg):
             if pkg not in self.deleted:
                 self.deleted[pkg] = None
+                # Erased in the transaction, keep it cached until then
+                self._pkgs.pin(pkg.key, pkg)
+                self._changedDependencies(pkg)
                 return self.OK
             else:
                 return self.NOT_INSTALLED
         else:
             return self.NOT_INSTALLED
 
+    def _getTextList(self, build=True):
+        return self.rpmdb._getTextList(build) # shared instance
+
+    def _getSortedNames(self):
+        return self.rpmdb._getSortedNames() # same names
+
     def _readObsoletes(self):
         self.rpmdb._readObsoletes()
         self.obsoletes_list = self.rpmdb.obsoletes_list # shared instance
@@ -121,5 +139,6 @@ class RpmShadowDB(jointdb.JointDB):
         if len(self.dbs) == 1: return
         self.memorydb.addPkgs(self.diskdb.getPkgs())
         del self.dbs[1]
+        self._changedDependencies()
 
 # vim:ts=4:sw=4:showmatch:expandtab
@@ -23,6 +23,8 @@ if sqlite:
         # We currently require utf8 enconding for sqlite2 python
         if not kwargs.has_key('client_encoding'):
             kwargs['client_encoding'] = 'utf8'
+        # sqlite2 python does not check threads at all
+        kwargs.pop('check_same_thread', None)
         return Connection(*args, **kwargs)
 
     class Connection(sqlite.Connection):
@@ -16,7 +16,7 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
-import os, re, bz2, shutil
+import os, re, shutil, threading
 try:
     # python-2.5 layout:
     from xml.etree.cElementTree import iterparse
@@ -33,7 +33,7 @@ except ImportError:
 
 from pyrpm import *
 import pyrpm.base
-import repodb
+import repodb, lists
 from pyrpm.logger import log
 
 # This version refers to the internal structure of the sqlite cache files
@@ -63,14 +63,14 @@ USEYUM = False # disable yum metadata parser for now
                # as it messes up pre requirements
 
 import sqlitecompat as sqlite3
-from lrucache import SmallLRUCache
+from lrucache import LRUCache
 
 class SqliteRpmPackage(package.RpmPackage):
 
     CACHE = {
-        'requires' : SmallLRUCache(maxsize=100),
-        'provides' : SmallLRUCache(maxsize=100),
-        'conflicts' : SmallLRUCache(maxsize=100),
+        'requires' : LRUCache(maxsize=100, name="sqlite package requires"),
+        'provides' : LRUCache(maxsize=100, name="sqlite package provides"),
+        'conflicts' : LRUCache(maxsize=100, name="sqlite package conflicts"),
         }
 
     def __init__(self, config, source, verify=None, hdronly=None, db=None):
@@ -93,8 +93,9 @@ class SqliteRpmPackage(package.RpmPackage):
         if dict.has_key(self, name):
             return dict.get(self, name)
         if name in self.CACHE:
-            if self.CACHE[name].has_key(self):
-                return self.CACHE[name][self]
+            deps = self.CACHE[name].get(self)
+            if deps is not None:
+                return deps
             deps = self.yumrepo.getDependencies(name, self.pkgKey)
             self.CACHE[name][self] = deps
             return deps
@@ -200,13 +201,12 @@ class SqliteRepoDB(repodb.RpmRepoDB):
         self._primarydb = None
         self._filelistsdb = None
         self._othersdb = None
+        self._unpackers = { }
         self._pkgs = { }
-        self.search_cache = {
-            "provides" : SmallLRUCache(maxsize=1000),
-            "requires" : SmallLRUCache(maxsize=1000),
-            "obsoletes" : SmallLRUCache(maxsize=1000),
-            "conflicts" : SmallLRUCache(maxsize=1000),
-            }
+        self.search_cache = { }
+        for tag in ("provides", "requires", "obsoletes", "conflicts"):
+            self.search_cache[tag] = LRUCache(
+                maxsize=1000, name="%s %s search" % (self.reponame, tag))
 
     def isIdentitySave(self):
         """return if package objects that are added are in the db afterwards
@@ -217,6 +217,7 @@ class SqliteRepoDB(repodb.RpmRepoDB):
     def clear(self):
         self.close()
         self._pkgs.clear()
+        self._changedDependencies()
 
     def clearPkgs(self, tags=None, ntags=None):
         for pkg in self._pkgs.itervalues():
@@ -237,22 +238,15 @@ class SqliteRepoDB(repodb.RpmRepoDB):
         # this fails
         try:
             f = open(filename, 'w')
-            db = sqlite3.connect(filename)
+            db = sqlite3.connect(filename, check_same_thread=False)
         except IOError:
             log.warning("Could not create sqlite cache file, using in memory "
                         "cache instead")
-            db = sqlite3.connect(":memory:")
+            db = sqlite3.connect(":memory:", check_same_thread=False)
         db.row_factory = sqlite3.Row
         db.text_factory = str
         return db
 
-    def createDbInfo(self, cur):
-        # Create the db_info table, this contains sqlite cache metadata
-        cur.execute("""CREATE TABLE db_info (
-            dbversion TEXT,
-            checksum TEXT)
-        """)
-
     def setInfo(self, db, dbversion, checksum):
         cur = db.cursor()
         data = {'dbversion' : dbversion,
@@ -281,7 +275,9 @@ class SqliteRepoDB(repodb.RpmRepoDB):
     def loadCache(self, filename):
         """Load cache from filename, check if it is valid and that dbversion
         matches the required dbversion"""
-        db = sqlite3.connect(filename)
+        # Repositories are read in worker threads of RpmYum.addRepos() and
+        # used from the main thread afterwards.
+        db = sqlite3.connect(filename, check_same_thread=False)
         db.row_factory = sqlite3.Row
         db.text_factory = str
         cur = db.cursor()
@@ -307,88 +303,24 @@ class SqliteRepoDB(repodb.RpmRepoDB):
         """Create the required tables for filelists metadata in the sqlite
            database"""
         cur = self._filelistsdb.cursor()
-        self.createDbInfo(cur)
-        # This table is needed to match pkgKeys to pkgIds
-        cur.execute("""CREATE TABLE packages(
-            pkgKey INTEGER PRIMARY KEY,
-            pkgId TEXT)
-        """)
-        cur.execute("""CREATE TABLE filelist(
-            pkgKey INTEGER,
-            dirname TEXT,
-            filenames TEXT,
-            filetypes TEXT)
-        """)
-        cur.execute("CREATE INDEX keyfile ON filelist (pkgKey)")
-        cur.execute("CREATE INDEX pkgId ON packages (pkgId)")
-        cur.execute("CREATE INDEX dirnames ON filelist (dirname)")
+        createTables(cur, "filelists")
+        createIndexes(cur, "filelists")
         self._filelistsdb.commit()
 
     def createOthersTables(self):
         """Create the required tables for other.xml.gz metadata in the sqlite
            database"""
         cur = self._othersdb.cursor()
-        self.createDbInfo(cur)
-        # This table is needed to match pkgKeys to pkgIds
-        cur.execute("""CREATE TABLE packages(
-            pkgKey INTEGER PRIMARY KEY,
-            pkgId TEXT)
-        """)
-        cur.execute("""CREATE TABLE changelog(
-            pkgKey INTEGER,
-            author TEXT,
-            date TEXT,
-            changelog TEXT)
-        """)
-        cur.execute("CREATE INDEX keychange ON changelog (pkgKey)")
-        cur.execute("CREATE INDEX pkgId ON packages (pkgId)")
+        createTables(cur, "other")
+        createIndexes(cur, "other")
         self._othersdb.commit()
 
     def createPrimaryTables(self):
         """Create the required tables for primary metadata in the sqlite
            database"""
         cur = self._primarydb_cursor
-        self.createDbInfo(cur)
-        # The packages table contains most of the information in primary.xml.gz
-
-        q = 'CREATE TABLE packages(\n' \
-            'pkgKey INTEGER PRIMARY KEY,\n'
-        cols = []
-        for col in self.COLUMNS:
-            cols.append('%s TEXT' % col)
-        q += ',\n'.join(cols) + ')'
-        cur.execute(q)
-
-        # Create requires, provides, conflicts and obsoletes tables
-        # to store prco data
-        for t in ('requires','provides','conflicts','obsoletes'):
-            extraCol = ""
-            if t == 'requires':
-                extraCol= ", pre BOOL DEFAULT FALSE"
-            cur.execute("""CREATE TABLE %s (
-              name TEXT,
-              flags TEXT,
-              epoch TEXT,
-              version TEXT,
-              release TEXT,
-              pkgKey TEXT %s)
-            """ % (t, extraCol))
-        # Create the files table to hold all the file information
-        cur.execute("""CREATE TABLE files (
-            name TEXT,
-            type TEXT,
-            pkgKey TEXT)
-        """)
-        # Create indexes for faster searching
-        cur.execute("CREATE INDEX packagename ON packages (name)")
-        cur.execute("CREATE INDEX providesname ON provides (name)")
-        cur.execute("CREATE INDEX pkgprovides ON provides (pkgKey)")
-        cur.execute("CREATE INDEX requiresname ON requires (name)")
-        cur.execute("CREATE INDEX pkgrequires ON requires (pkgKey)")
-        cur.execute("CREATE INDEX pkgconflicts ON conflicts (pkgKey)")
-        cur.execute("CREATE INDEX pkgobsoletes ON obsoletes (pkgKey)")
-        cur.execute("CREATE INDEX packageId ON packages (pkgId)")
-        cur.execute("CREATE INDEX filenames ON files (name)")
+        createTables(cur, "primary")
+        createIndexes(cur, "primary")
         self._primarydb.commit()
 
     def open(self):
@@ -397,6 +329,9 @@ class SqliteRepoDB(repodb.RpmRepoDB):
 
     def close(self):
         """If the database keeps a connection, close it."""
+        for thread in self._unpackers.values():
+            thread.join()
+        self._unpackers.clear()
         for db in (self._primarydb, self._filelistsdb, self._othersdb):
             if db is not None:
                 db.close()
@@ -405,29 +340,99 @@ class SqliteRepoDB(repodb.RpmRepoDB):
         self._othersdb = None
         return 1
 
-    def getDbFile(self, dbtype):
-        if dbtype != "primary":
-            log.info2("Loading %s for %s...", dbtype, self.reponame)
+    # Database files which are unpacked in the background while primary is
+    # loaded, other.xml.gz is never used by pyrpm
+    prefetch_dbtypes = ("filelists",)
 
-        cachebase = os.path.join(self.config.cachedir, self.reponame)
-        cachepath = os.path.join(self.config.cachedir, self.reponame, "sqlite")
+    def _getDbFilename(self, dbtype):
+        """Return the name of the sqlite cache file for dbtype, create the
+        cache directory if needed."""
 
-        if not os.path.isdir(cachebase):
-            os.makedirs(cachebase)
+        cachepath = os.path.join(self.config.cachedir, self.reponame, "sqlite")
         if not os.path.isdir(cachepath):
             os.makedirs(cachepath)
+        return os.path.join(cachepath, "%s.xml.gz.sqlite" % dbtype)
+
+    def _isValidCache(self, dbtype, csum):
+        return self.repomd.has_key(dbtype) and \
+               self.repomd[dbtype].has_key("checksum") and \
+               csum == self.repomd[dbtype]["checksum"]
+
+    def _unpackDbFile(self, dbtype, filenamebz2, dbfilename):
+        """Unpack filenamebz2 to dbfilename, verify the uncompressed data
+        against the open-checksum of the %s_db entry in repomd.xml if there
+        is one.
+
+        Return 1 on success, 0 on error."""
+
+        import sha
+        checksum = self.repomd.get("%s_db" % dbtype, {}).get("open-checksum")
+        try:
+            functions.unpackBz2File(filenamebz2, dbfilename, sha.new(),
+                                    checksum)
+        except (IOError, OSError, EOFError), e:
+            log.warning("Couldn't unpack %s: %s", filenamebz2, e)
+            return 0
+        return 1
+
+    def _prefetchDbFile(self, dbtype, filenamebz2, dbfilename):
+        """Thread body: unpack filenamebz2 unless dbfilename is already a
+        valid cache for dbtype."""
+
+        if os.path.exists(dbfilename):
+            try:
+                (csum, db) = self.loadCache(dbfilename)
+                db.close()
+                if self._isValidCache(dbtype, csum):
+                    return
+            except sqlite3.Error:
+                pass
+        self._unpackDbFile(dbtype, filenamebz2, dbfilename)
+
+    def prefetchDbFiles(self, dbtypes):
+        """Start unpacking %dbtype.xml.gz.sqlite.bz2 for all dbtypes in
+        background threads.
+
+        Only files available without network access are used, everything else
+        is left to getDbFile()."""
+
+        for dbtype in dbtypes:
+            if self._unpackers.has_key(dbtype) or \
+                   getattr(self, "_%sdb" % dbtype, None) is not None:
+                continue
+            uri = "repodata/%s.xml.gz.sqlite.bz2" % dbtype
+            if self.nc.isCached(uri):
+                filenamebz2 = self.nc.getCachedFilename(uri)
+            elif getattr(self.nc, "is_local", {}).get(self.reponame):
+                filenamebz2 = self.nc.cache(uri)
+            else:
+                filenamebz2 = None
+            if not filenamebz2:
+                continue
+            thread = threading.Thread(target=self._prefetchDbFile,
+                                      args=(dbtype, filenamebz2,
+                                            self._getDbFilename(dbtype)))
+            thread.setDaemon(True)
+            self._unpackers[dbtype] = thread
+            thread.start()
+
+    def getDbFile(self, dbtype):
+        if dbtype != "primary":
+            log.info2("Loading %s for %s...", dbtype, self.reponame)
+
+        # wait for a background unpack of this file to finish
+        if self._unpackers.has_key(dbtype):
+            self._unpackers.pop(dbtype).join()
 
         # check existing sqlite db
-        dbfilename = os.path.join(cachepath, "%s.xml.gz.sqlite" % dbtype)
+        dbfilename = self._getDbFilename(dbtype)
         if os.path.exists(dbfilename):
             try:
                 csum, db = self.loadCache(dbfilename)
             except sqlite3.Error, e:
                 log.error(e)
                 csum = None
-            if self.repomd.has_key(dbtype) and \
-                   self.repomd[dbtype].has_key("checksum") and \
-                   csum == self.repomd[dbtype]["checksum"]:
+            if self._isValidCache(dbtype, csum):
                 setattr(self, "_%sdb" % dbtype, db)
                 setattr(self, "_%sdb_cursor" % dbtype, db.cursor())
                 return 1
@@ -439,25 +444,15 @@ class SqliteRepoDB(repodb.RpmRepoDB):
             if not filenamebz2:
                 break
 
-            try:
-                f = bz2.BZ2File(filenamebz2)
-                o = open(dbfilename, "w")
-
-                o.write(f.read())
-                o.close()
-                f.close()
-            except (IOError, EOFError):
+            if not self._unpackDbFile(dbtype, filenamebz2, dbfilename):
                 continue
 
-
             try:
                 csum, db = self.loadCache(dbfilename)
             except sqlite3.Error, e:
                 csum = None
 
-            if self.repomd.has_key(dbtype) and \
-                   self.repomd[dbtype].has_key("checksum") and \
-                   csum == self.repomd[dbtype]["checksum"]:
+            if self._isValidCache(dbtype, csum):
                 setattr(self, "_%sdb" % dbtype, db)
                 setattr(self, "_%sdb_cursor" % dbtype, db.cursor())
                 return 1
@@ -526,6 +521,7 @@ class SqliteRepoDB(repodb.RpmRepoDB):
         return 0
 
     def readPrimary(self):
+        self.prefetchDbFiles(self.prefetch_dbtypes)
         result = self.getDbFile("primary")
         #self.readRpms()
         return result
@@ -579,6 +575,7 @@ class SqliteRepoDB(repodb.RpmRepoDB):
                 if pkg is not None:
                     pkg.clearFilelist()
             self.filelist_imported = True
+            self._changedDependencies()
             return 1
         return 0
 
@@ -694,6 +691,7 @@ class SqliteRepoDB(repodb.RpmRepoDB):
 
     # add package
     def addPkg(self, pkg):
+        self._changedDependencies(pkg)
         cur = self._primarydb_cursor
         data = {}
         for tag in self.COLUMNS:
@@ -840,53 +838,38 @@ class SqliteRepoDB(repodb.RpmRepoDB):
         raise NotImplementedError # XXX StopIteration?
 
     def reloadDependencies(self):
-        pass
-
-    # Use precompiled regex for faster checks
-    __fnmatchre__ = re.compile(".*[\*\[\]\?].*")
-    __splitre__ = re.compile(r"([:*?\-.]|\[[^]]+\])")
+        self._changedDependencies()
 
     def searchPkgs(self, names):
-        result = []
-        pkgnames = None
-        for name in names:
-            parts = self.__splitre__.split(name)
-            if self.__fnmatchre__.match(name):
-                regex = re.compile(fnmatch.translate(name))
-                if pkgnames is None:
-                    pkgnames = self.getNames()
-                for pkgname in pkgnames:
-                    if pkgname.startswith(parts[0]):
-                        pkgs = self.getPkgsByName(pkgname)
-                        for pkg in pkgs:
-                            for n in pkg.getAllNames():
-                                if regex.match(n):
-                                    result.append(pkg)
-                                    break
-            else:
-                for idx in xrange(1, len(parts)+1, 2):
-                    pkgs = self.getPkgsByName(''.join(parts[:idx]))
-                    for pkg in pkgs:
-                        for n in pkg.getAllNames():
-                            if n == name:
-                                result.append(pkg)
-                                break
+        result = self._searchPkgsByName(names)
         #normalizeList(result)
         return result
 
-    def search(self, words):
-        result = []
+    def searchScores(self, words):
+        if not words:
+            return []
+        # One scan for all words, ranked like lists.scoreSearch() from the
+        # selected columns; LIKE ignores case
+        columns = ("name", "summary", "description", "rpm_packager",
+                   "rpm_group", "url")
+        weights = [ weight for (tag, weight) in lists.searchtags ]
+        condition = " OR ".join(["(%s LIKE ?)" % column
+                                 for column in columns])
         cur = self._primarydb_cursor
-        for word in words:
-            word = '%' + word + '%'
-            cur.execute('SELECT pkgKey FROM packages WHERE '
-                        '(name LIKE ?) OR (description LIKE ?) OR '
-                        '(summary LIKE ?) OR (rpm_packager LIKE ?) OR '
-                        '(rpm_group LIKE ?) OR (url LIKE ?)',
-                        (word, ) * 6)
-            result.extend((self.getPkgByKey(res['pkgKey']) for res in cur))
-        result = filter(None, result)
-        normalizeList(result)
+        cur.execute('SELECT pkgKey, %s FROM packages WHERE %s' %
+                    (", ".join(columns), " OR ".join([condition] * len(words))),
+                    [ '%' + word + '%' for word in words
+                      for column in columns ])
+        lwords = [ word.lower() for word in words ]
+        result = [ ]
+        for res in cur.fetchall():
+            texts = [ (weights[i], res[columns[i]].lower())
+                      for i in xrange(len(columns)) if res[columns[i]] ]
+            pkg = self.getPkgByKey(res['pkgKey'])
+            if pkg is not None:
+                score = lists.searchScore(texts, lwords)
+                if score:
+                    result.append((score, pkg))
         return result
 
     def _search(self, attr_table, name, flag, version):
@@ -897,8 +880,9 @@ class SqliteRepoDB(repodb.RpmRepoDB):
         if self.search_cache.has_key(attr_table):
             cache = self.search_cache[attr_table]
             query = (name, flag, version)
-            if query in cache:
-                return cache[query]
+            cached = cache.get(query)
+            if cached is not None:
+                return cached
         cur = self._primarydb_cursor
         cur.execute('SELECT * FROM %s WHERE name = ?' %
                     attr_table, (name,))
@@ -983,6 +967,95 @@ class SqliteRepoDB(repodb.RpmRepoDB):
                 result.append(pkg)
         return result
 
+def createTables(cur, dbtype):
+    """Create the tables of a dbtype ("primary", "filelists" or "other")
+    sqlite database using cursor cur, without indexes."""
+
+    # Create the db_info table, this contains sqlite cache metadata
+    cur.execute("""CREATE TABLE db_info (
+        dbversion TEXT,
+        checksum TEXT)
+    """)
+    if dbtype == "primary":
+        # The packages table contains most of the information in
+        # primary.xml.gz
+        q = 'CREATE TABLE packages(\n' \
+            'pkgKey INTEGER PRIMARY KEY,\n'
+        cols = []
+        for col in SqliteRepoDB.COLUMNS:
+            cols.append('%s TEXT' % col)
+        q += ',\n'.join(cols) + ')'
+        cur.execute(q)
+
+        # Create requires, provides, conflicts and obsoletes tables
+        # to store prco data
+        for t in ('requires','provides','conflicts','obsoletes'):
+            extraCol = ""
+            if t == 'requires':
+                extraCol= ", pre BOOL DEFAULT FALSE"
+            cur.execute("""CREATE TABLE %s (
+              name TEXT,
+              flags TEXT,
+              epoch TEXT,
+              version TEXT,
+              release TEXT,
+              pkgKey TEXT %s)
+            """ % (t, extraCol))
+        # Create the files table to hold all the file information
+        cur.execute("""CREATE TABLE files (
+            name TEXT,
+            type TEXT,
+            pkgKey TEXT)
+        """)
+        return
+
+    # This table is needed to match pkgKeys to pkgIds
+    cur.execute("""CREATE TABLE packages(
+        pkgKey INTEGER PRIMARY KEY,
+        pkgId TEXT)
+    """)
+    if dbtype == "filelists":
+        cur.execute("""CREATE TABLE filelist(
+            pkgKey INTEGER,
+            dirname TEXT,
+            filenames TEXT,
+            filetypes TEXT)
+        """)
+    else:
+        cur.execute("""CREATE TABLE changelog(
+            pkgKey INTEGER,
+            author TEXT,
+            date TEXT,
+            changelog TEXT)
+        """)
+
+# dbtype => [(index name, table, column)]
+_indexes = {
+    "primary": [("packagename", "packages", "name"),
+                ("providesname", "provides", "name"),
+                ("pkgprovides", "provides", "pkgKey"),
+                ("requiresname", "requires", "name"),
+                ("pkgrequires", "requires", "pkgKey"),
+                ("pkgconflicts", "conflicts", "pkgKey"),
+                ("pkgobsoletes", "obsoletes", "pkgKey"),
+                ("packageId", "packages", "pkgId"),
+                ("filenames", "files", "name")],
+    "filelists": [("keyfile", "filelist", "pkgKey"),
+                  ("pkgId", "packages", "pkgId"),
+                  ("dirnames", "filelist", "dirname")],
+    "other": [("keychange", "changelog", "pkgKey"),
+              ("pkgId", "packages", "pkgId")],
+    }
+
+def createIndexes(cur, dbtype):
+    """Create the indexes of a dbtype sqlite database using cursor cur.
+
+    Creating them after the tables are filled is faster than updating them
+    for each row."""
+
+    for (name, table, column) in _indexes[dbtype]:
+        cur.execute("CREATE INDEX %s ON %s (%s)" % (name, table, column))
+
 # fall back to RpmRepoDB if sqlite is not installed
 if not sqlite3.ok:
     SqliteRepoDB = repodb.RpmRepoDB
@@ -0,0 +1,681 @@
+#
+# Copyright (C) 2007 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as published by
+# the Free Software Foundation; version 2 only
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Delta RPMs: rebuild a package from an older version and a small delta.
+
+A delta contains the lead, signature and header of the target package
+verbatim and describes its uncompressed payload as literal data and ranges
+copied from files of the source package; changed files are stored as a
+binary diff against the source file with the same path or basename.  The
+payload is compressed again with the zlib settings that reproduce the
+original compressed data, so the rebuilt package is bit-identical to the
+target, which applyDelta() verifies with the SHA-1 of the whole package.
+
+Delta file format, integers in network byte order:
+
+    magic "\\xed\\xab\\xf0\\x00", version (4B), release (4B),
+    compression (2B, always DELTA_BZIP2)
+    strings (4B length + data): source NEVRA, source sha1header,
+    target NEVRA, target sha1header
+    a bzip2 compressed stream of
+      strings: SHA-1 of the target package, data before the payload,
+      gzip header of the payload, data after the deflate stream
+      compression level (1B)
+      operations, each starting with an opcode (1B):
+        _OP_END
+        _OP_ADD: string - literal payload data
+        _OP_FILE: path, md5 (strings), size (8B) - define the next source
+                  file index, starting at 0
+        _OP_COPY: index (4B), offset (8B), length (4B) - data from a
+                  source file
+"""
+
+import os, os.path, stat, struct, tempfile, zlib, bz2, md5, sha
+import base, functions, package
+
+DELTA_MAGIC = "\xed\xab\xf0\x00"
+DELTA_VERSION = 2
+DELTA_RELEASE = 0
+DELTA_BZIP2 = 0x0002
+
+(_OP_END, _OP_ADD, _OP_FILE, _OP_COPY) = range(4)
+
+# Block size of the binary diff; shorter matches are stored literally
+_BLOCKSIZE = 32
+# Compression levels tried to reproduce a payload, most likely first
+_LEVELS = (9, 6, 8, 7, 5, 4, 3, 2, 1)
+_CHUNK = 65536
+
+
+def deltaFilename(source, target):
+    """Return the file name of a delta from RpmPackage source to RpmPackage
+    target."""
+
+    return "%s-%s-%s_%s-%s.%s.drpm" % (target["name"], source["version"],
+                                       source["release"], target["version"],
+                                       target["release"], target["arch"])
+
+
+def readDeltaInfo(filename):
+    """Return a dict with "source_nevra", "source_sha1header",
+    "target_nevra" and "target_sha1header" from delta file filename.
+
+    Raise ValueError on invalid data, IOError."""
+
+    fd = open(filename, "rb")
+    try:
+        return _readInfo(fd)
+    finally:
+        fd.close()
+
+
+def createDelta(config, source, target, filename):
+    """Write a delta from rpm file source to rpm file target to filename.
+
+    Raise ValueError if the target payload can't be reproduced or on
+    invalid packages, IOError, OSError."""
+
+    spkg = _readHeader(config, source)
+    tpkg = _readHeader(config, target)
+    if spkg["name"] != tpkg["name"]:
+        raise ValueError, "%s is not a version of %s" % (source, target)
+    spayload = _Payload(source, spkg.range_payload[0])
+    tpayload = _Payload(target, tpkg.range_payload[0])
+    try:
+        level = tpayload.findLevel()
+        if level is None:
+            raise ValueError, "can't reproduce the payload compression " \
+                  "of %s" % target
+        sfiles = _SourceFiles(spkg, spayload)
+        fd = open(filename, "wb")
+        try:
+            _writeInfo(fd, spkg, tpkg)
+            writer = _DeltaWriter(fd)
+            writer.string(tpayload.digest)
+            writer.string(tpayload.lead)
+            writer.string(tpayload.gzipheader)
+            writer.string(tpayload.trailer)
+            writer.write(struct.pack("!B", level))
+            _diffPayload(writer, sfiles, tpayload)
+            writer.close()
+        finally:
+            fd.close()
+    except:
+        spayload.close()
+        tpayload.close()
+        if os.path.exists(filename):
+            os.unlink(filename)
+        raise
+    spayload.close()
+    tpayload.close()
+
+
+def applyDelta(config, filename, source, target):
+    """Rebuild the target package of delta filename to file target.
+
+    source is either the RpmPackage of the installed source package, whose
+    files are read below config.buildroot, or the file name of the source
+    rpm.  Raise ValueError if the delta does not match source, a source file
+    is modified or the result is not bit-identical to the target package,
+    IOError, OSError."""
+
+    fd = open(filename, "rb")
+    try:
+        info = _readInfo(fd)
+        if isinstance(source, str):
+            source = _readHeader(config, source)
+            sha1header = source["signature"].get("sha1header")
+            files = _PackageFiles(source.source, source.range_payload[0])
+        else:
+            sha1header = source.get("install_sha1header")
+            if sha1header is None:
+                sha1header = source["signature"].get("sha1header")
+            files = _InstalledFiles(config.buildroot)
+        if source.getNEVRA() != info["source_nevra"] or \
+               (sha1header and info["source_sha1header"] and
+                sha1header != info["source_sha1header"]):
+            files.close()
+            raise ValueError, "%s is not the source of %s" % \
+                  (source.getNEVRA(), filename)
+        try:
+            _applyDelta(_DeltaReader(fd), files, target)
+        finally:
+            files.close()
+    finally:
+        fd.close()
+
+
+def _readHeader(config, filename):
+    """Return the RpmPackage header of rpm file filename.
+
+    Raise ValueError, IOError."""
+
+    pkg = package.RpmPackage(config, filename, hdronly=True)
+    pkg.read()
+    pkg.close()
+    if pkg["payloadcompressor"] not in (None, "gzip"):
+        raise ValueError, "%s: unsupported payload compressor %s" % \
+              (filename, pkg["payloadcompressor"])
+    return pkg
+
+
+def _writeString(fd, data):
+    fd.write(struct.pack("!I", len(data)))
+    fd.write(data)
+
+
+def _readString(fd):
+    (size,) = struct.unpack("!I", functions.readExact(fd, 4))
+    return functions.readExact(fd, size)
+
+
+def _writeInfo(fd, spkg, tpkg):
+    fd.write(DELTA_MAGIC)
+    fd.write(struct.pack("!IIH", DELTA_VERSION, DELTA_RELEASE, DELTA_BZIP2))
+    for value in (spkg.getNEVRA(), spkg["signature"].get("sha1header", ""),
+                  tpkg.getNEVRA(), tpkg["signature"].get("sha1header", "")):
+        _writeString(fd, value)
+
+
+def _readInfo(fd):
+    data = functions.readExact(fd, 14)
+    (magic, version, release, compression) = struct.unpack("!4sIIH", data)
+    if magic != DELTA_MAGIC:
+        raise ValueError, "not a delta rpm"
+    if version != DELTA_VERSION or release != DELTA_RELEASE:
+        raise ValueError, "unsupported delta version %d.%d" % (version,
+                                                               release)
+    if compression != DELTA_BZIP2:
+        raise ValueError, "unsupported delta compression %d" % compression
+    info = { }
+    for key in ("source_nevra", "source_sha1header", "target_nevra",
+                "target_sha1header"):
+        info[key] = _readString(fd)
+    return info
+
+
+class _DeltaWriter:
+    """Write the compressed part of a delta, merging adjacent literal
+    data."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.compressor = bz2.BZ2Compressor(9)
+        self.literal = [ ]
+        self.literalsize = 0
+
+    def write(self, data):
+        self.fd.write(self.compressor.compress(data))
+
+    def string(self, data):
+        self.write(struct.pack("!I", len(data)))
+        self.write(data)
+
+    def add(self, data):
+        if data:
+            self.literal.append(data)
+            self.literalsize += len(data)
+            if self.literalsize >= _CHUNK:
+                self.flush()
+
+    def flush(self):
+        if self.literal:
+            self.write(struct.pack("!B", _OP_ADD))
+            self.string("".join(self.literal))
+            self.literal = [ ]
+            self.literalsize = 0
+
+    def defineFile(self, path, md5sum, size):
+        self.flush()
+        self.write(struct.pack("!B", _OP_FILE))
+        self.string(path)
+        self.string(md5sum)
+        self.write(struct.pack("!Q", size))
+
+    def copy(self, index, offset, length):
+        self.flush()
+        self.write(struct.pack("!BIQI", _OP_COPY, index, offset, length))
+
+    def close(self):
+        self.flush()
+        self.write(struct.pack("!B", _OP_END))
+        self.fd.write(self.compressor.flush())
+
+
+class _DeltaReader:
+    """Read the compressed part of a delta."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.decompressor = bz2.BZ2Decompressor()
+        self.buf = ""
+        self.pos = 0
+
+    def read(self, size):
+        while len(self.buf) - self.pos < size:
+            data = self.fd.read(_CHUNK)
+            if not data:
+                raise ValueError, "truncated delta"
+            self.buf = self.buf[self.pos:] + self.decompressor.decompress(data)
+            self.pos = 0
+        data = self.buf[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def string(self):
+        (size,) = struct.unpack("!I", self.read(4))
+        return self.read(size)
+
+
+class _Payload:
+    """The gzip compressed payload of rpm file filename starting at offset,
+    unpacked to a temporary file."""
+
+    def __init__(self, filename, offset):
+        self.fd = open(filename, "rb")
+        digest = sha.new()
+        self.lead = functions.readExact(self.fd, offset)
+        digest.update(self.lead)
+        self.gzipheader = _readGzipHeader(self.fd)
+        digest.update(self.gzipheader)
+        self.start = self.fd.tell()
+        self.data = tempfile.TemporaryFile()
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        rest = ""
+        while True:
+            data = self.fd.read(_CHUNK)
+            if not data:
+                break
+            digest.update(data)
+            if rest or decompressor.unused_data:
+                rest += data
+                continue
+            self.data.write(decompressor.decompress(data))
+            if decompressor.unused_data:
+                rest = decompressor.unused_data
+        self.data.write(decompressor.flush())
+        if len(rest) < 8:
+            raise ValueError, "%s: truncated payload" % filename
+        self.trailer = rest
+        self.end = os.fstat(self.fd.fileno()).st_size - len(rest)
+        self.digest = digest.hexdigest()
+        self.data.seek(0)
+
+    def close(self):
+        self.fd.close()
+        self.data.close()
+
+    def findLevel(self):
+        """Return the zlib compression level that reproduces the payload, or
+        None if there is none."""
+
+        for level in _LEVELS:
+            self.data.seek(0)
+            self.fd.seek(self.start)
+            remaining = self.end - self.start
+            compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                          -zlib.MAX_WBITS, 8, 0)
+            same = True
+            while same:
+                data = self.data.read(_CHUNK)
+                if data:
+                    compressed = compressor.compress(data)
+                else:
+                    compressed = compressor.flush()
+                if len(compressed) > remaining or \
+                       self.fd.read(len(compressed)) != compressed:
+                    same = False
+                remaining -= len(compressed)
+                if not data:
+                    break
+            if same and remaining == 0:
+                self.data.seek(0)
+                return level
+        self.data.seek(0)
+        return None
+
+
+def _readGzipHeader(fd):
+    """Return the gzip header read from fd.
+
+    Raise ValueError on invalid data, IOError."""
+
+    header = functions.readExact(fd, 10)
+    if header[:3] != "\x1f\x8b\x08":
+        raise ValueError, "payload is not gzip compressed"
+    flags = ord(header[3])
+    if flags & 4:                       # FEXTRA
+        data = functions.readExact(fd, 2)
+        header += data + functions.readExact(fd, struct.unpack("<H",
+                                                               data)[0])
+    for flag in (8, 16):                # FNAME, FCOMMENT
+        if flags & flag:
+            while True:
+                c = functions.readExact(fd, 1)
+                header += c
+                if c == "\0":
+                    break
+    if flags & 2:                       # FHCRC
+        header += functions.readExact(fd, 2)
+    return header
+
+
+def _cpioEntries(fd):
+    """Yield (header data, file name, mode, file size) of the entries of
+    uncompressed cpio archive fd up to and including the trailer.
+
+    fd is positioned at the file data after each yield; the file data and
+    its padding must be read before continuing.  Raise ValueError on invalid
+    data, IOError."""
+
+    while True:
+        header = functions.readExact(fd, 110)
+        if header[0:6] not in ("070701", "070702"):
+            raise ValueError, "bad magic reading CPIO headers %s" % \
+                  header[0:6]
+        namesize = int(header[94:102], 16)
+        header += functions.readExact(fd, namesize +
+                                      (4 - ((110 + namesize) % 4)) % 4)
+        filename = header[110:110 + namesize].rstrip("\0")
+        yield (header, filename, int(header[14:22], 16),
+               int(header[54:62], 16))
+        if filename == "TRAILER!!!":
+            break
+
+
+def _cpioFilename(filename):
+    """Return cpio entry name filename as stored in the rpm header."""
+
+    if filename[:2] == "./":
+        filename = filename[1:]
+    if filename[:1] != "/":
+        filename = "/" + filename
+    return filename
+
+
+class _SourceFiles:
+    """Regular files of a source package that can be copied into the
+    target payload: not %config, %ghost or empty."""
+
+    def __init__(self, pkg, payload):
+        self.payload = payload
+        self.files = { }                # path => (md5, size, offset)
+        self.md5s = { }                 # md5 => path
+        self.basenames = { }            # basename => [path]
+        self.indexes = { }              # path => index in the delta
+        usable = { }
+        for (path, mode, md5sum, flags) in zip(pkg.iterFilenames(),
+                                               pkg["filemodes"] or [ ],
+                                               pkg["filemd5s"] or [ ],
+                                               pkg["fileflags"] or [ ]):
+            if stat.S_ISREG(mode) and md5sum and \
+                   not flags & (base.RPMFILE_CONFIG | base.RPMFILE_GHOST):
+                usable[path] = md5sum
+        fd = payload.data
+        for (header, filename, mode, size) in _cpioEntries(fd):
+            path = _cpioFilename(filename)
+            if size > 0 and usable.has_key(path):
+                self.files[path] = (usable[path], size, fd.tell())
+                self.md5s.setdefault(usable[path], path)
+                self.basenames.setdefault(os.path.basename(path),
+                                          [ ]).append(path)
+            fd.seek(size + (4 - size % 4) % 4, 1)
+
+    def read(self, path):
+        (md5sum, size, offset) = self.files[path]
+        self.payload.data.seek(offset)
+        return functions.readExact(self.payload.data, size)
+
+    def index(self, writer, path):
+        """Return the index of path in the delta written by writer, defining
+        it if necessary."""
+
+        index = self.indexes.get(path)
+        if index is None:
+            index = len(self.indexes)
+            self.indexes[path] = index
+            (md5sum, size, offset) = self.files[path]
+            writer.defineFile(path, md5sum, size)
+        return index
+
+    def similar(self, path):
+        """Return the path of a source file to diff path against, or
+        None."""
+
+        if self.files.has_key(path):
+            return path
+        paths = self.basenames.get(os.path.basename(path), [ ])
+        if len(paths) == 1:
+            return paths[0]
+        return None
+
+
+def _diffPayload(writer, sfiles, tpayload):
+    """Write the operations rebuilding the uncompressed payload of
+    tpayload."""
+
+    fd = tpayload.data
+    for (header, filename, mode, size) in _cpioEntries(fd):
+        writer.add(header)
+        if size == 0:
+            continue
+        data = functions.readExact(fd, size)
+        padding = functions.readExact(fd, (4 - size % 4) % 4)
+        path = sfiles.md5s.get(md5.new(data).hexdigest())
+        if path is not None and sfiles.files[path][1] == size:
+            writer.copy(sfiles.index(writer, path), 0, size)
+        else:
+            path = None
+            if stat.S_ISREG(mode):
+                path = sfiles.similar(_cpioFilename(filename))
+            if path is None:
+                writer.add(data)
+            else:
+                index = None
+                for op in _diff(sfiles.read(path), data):
+                    if isinstance(op, str):
+                        writer.add(op)
+                    else:
+                        if index is None:
+                            index = sfiles.index(writer, path)
+                        writer.copy(index, op[0], op[1])
+        writer.add(padding)
+    # Anything after the trailer
+    writer.add(fd.read())
+
+
+def _matchLength(a, aoff, b, boff):
+    """Return the length of the common prefix of a[aoff:] and b[boff:]."""
+
+    limit = min(len(a) - aoff, len(b) - boff)
+    n = 0
+    step = 4096
+    while step:
+        while n + step <= limit and \
+                  a[aoff + n:aoff + n + step] == b[boff + n:boff + n + step]:
+            n += step
+        step >>= 2
+    return n
+
+
+def _diff(source, target):
+    """Return a list of literal strings and (offset, length) ranges of
+    source that concatenate to target."""
+
+    index = { }
+    for offset in xrange(len(source) - _BLOCKSIZE, -1, -_BLOCKSIZE):
+        index[source[offset:offset + _BLOCKSIZE]] = offset
+    ops = [ ]
+    literal = 0                         # Start of pending literal data
+    i = 0
+    end = len(target) - _BLOCKSIZE
+    while i <= end:
+        offset = index.get(target[i:i + _BLOCKSIZE])
+        if offset is None:
+            i += 1
+            continue
+        # Extend the match backwards into the literal data
+        while offset > 0 and i > literal and \
+                  source[offset - 1] == target[i - 1]:
+            offset -= 1
+            i -= 1
+        length = _matchLength(source, offset, target, i)
+        if literal < i:
+            ops.append(target[literal:i])
+        ops.append((offset, length))
+        i += length
+        literal = i
+    if literal < len(target):
+        ops.append(target[literal:])
+    return ops
+
+
+class _InstalledFiles:
+    """Source files read from the installed package below buildroot."""
+
+    def __init__(self, buildroot):
+        self.buildroot = buildroot
+        self.files = [ ]
+        self.fd = None
+        self.fdindex = None
+
+    def define(self, path, md5sum, size):
+        """Make path with md5sum and size available as the next index.
+
+        Raise ValueError if the file is different, IOError."""
+
+        filename = self.buildroot + path
+        fd = open(filename, "rb")
+        try:
+            digest = md5.new()
+            functions.updateDigestFromFile(digest, fd)
+            if digest.hexdigest() != md5sum or fd.tell() != size:
+                raise ValueError, "%s is modified" % filename
+        finally:
+            fd.close()
+        self.files.append(filename)
+
+    def read(self, index, offset, length):
+        if self.fdindex != index:
+            if self.fd is not None:
+                self.fd.close()
+            self.fd = open(self.files[index], "rb")
+            self.fdindex = index
+        self.fd.seek(offset)
+        return functions.readExact(self.fd, length)
+
+    def close(self):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+
+class _PackageFiles:
+    """Source files read from the payload of a source rpm file."""
+
+    def __init__(self, filename, offset):
+        self.payload = _Payload(filename, offset)
+        self.offsets = { }              # path => (size, offset)
+        self.files = [ ]
+        fd = self.payload.data
+        for (header, filename, mode, size) in _cpioEntries(fd):
+            if size > 0:
+                self.offsets[_cpioFilename(filename)] = (size, fd.tell())
+            fd.seek(size + (4 - size % 4) % 4, 1)
+
+    def define(self, path, md5sum, size):
+        if self.offsets.get(path, (None,))[0] != size:
+            raise ValueError, "%s is not in the source package" % path
+        offset = self.offsets[path][1]
+        self.payload.data.seek(offset)
+        digest = md5.new()
+        remaining = size
+        while remaining > 0:
+            data = functions.readExact(self.payload.data,
+                                       min(remaining, _CHUNK))
+            digest.update(data)
+            remaining -= len(data)
+        if digest.hexdigest() != md5sum:
+            raise ValueError, "%s differs in the source package" % path
+        self.files.append(offset)
+
+    def read(self, index, offset, length):
+        self.payload.data.seek(self.files[index] + offset)
+        return functions.readExact(self.payload.data, length)
+
+    def close(self):
+        self.payload.close()
+
+
+def _applyDelta(reader, files, target):
+    """Write the target package described by _DeltaReader reader using
+    source files to file target."""
+
+    digest = reader.string()
+    lead = reader.string()
+    gzipheader = reader.string()
+    trailer = reader.string()
+    (level,) = struct.unpack("!B", reader.read(1))
+    fd = open(target, "wb")
+    try:
+        sha1 = sha.new()
+        for data in (lead, gzipheader):
+            sha1.update(data)
+            fd.write(data)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      8, 0)
+        (crc, size) = (0, 0)
+        while True:
+            (op,) = struct.unpack("!B", reader.read(1))
+            if op == _OP_END:
+                break
+            elif op == _OP_ADD:
+                data = reader.string()
+            elif op == _OP_FILE:
+                path = reader.string()
+                md5sum = reader.string()
+                (filesize,) = struct.unpack("!Q", reader.read(8))
+                files.define(path, md5sum, filesize)
+                continue
+            elif op == _OP_COPY:
+                (index, offset, length) = struct.unpack("!IQI",
+                                                        reader.read(16))
+                data = files.read(index, offset, length)
+            else:
+                raise ValueError, "invalid delta operation %d" % op
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            data = compressor.compress(data)
+            sha1.update(data)
+            fd.write(data)
+        data = compressor.flush()
+        sha1.update(data)
+        fd.write(data)
+        if struct.pack("<II", crc & 0xffffffffL, size & 0xffffffffL) != \
+               trailer[:8]:
+            raise ValueError, "rebuilt payload of %s is different" % target
+        sha1.update(trailer)
+        fd.write(trailer)
+        fd.close()
+        if sha1.hexdigest() != digest:
+            raise ValueError, "rebuilt %s is different" % target
+    except:
+        fd.close()
+        os.unlink(target)
+        raise
+
+# vim:ts=4:sw=4:showmatch:expandtab
@@ -0,0 +1,143 @@
+#
+# Copyright (C) 2007 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as published by
+# the Free Software Foundation; version 2 only
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Extract package payloads in worker processes.
+
+ExtractorPool forks its workers once, so they share the state of the main
+process at that time, and then only passes them keys of the work to do over
+a pipe.  Each worker does one job at a time."""
+
+import fcntl, marshal, os, select
+
+
+class ExtractorPool:
+    """A pool of num worker processes calling extract(key) for the keys
+    passed to start()."""
+
+    def __init__(self, num, extract):
+        self.workers = [ ]              # [(pid, request file, result file)]
+        self.idle = [ ]                 # Indexes into self.workers
+        self.pending = { }              # key => worker index
+        self.results = { }              # key => error message or None
+        parentfds = [ ]
+        for i in xrange(num):
+            (reqrfd, reqwfd) = os.pipe()
+            (resrfd, reswfd) = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    for fd in parentfds + [reqwfd, resrfd]:
+                        os.close(fd)
+                    _work(reqrfd, reswfd, extract)
+                finally:
+                    os._exit(0)
+            os.close(reqrfd)
+            os.close(reswfd)
+            # Scripts must not keep the pipes open
+            for fd in (reqwfd, resrfd):
+                fcntl.fcntl(fd, fcntl.F_SETFD,
+                            fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+            parentfds.extend([reqwfd, resrfd])
+            self.workers.append((pid, os.fdopen(reqwfd, "wb"),
+                                 os.fdopen(resrfd, "rb")))
+            self.idle.append(i)
+
+    def isIdle(self):
+        """Return True if a worker is waiting for work."""
+
+        return len(self.idle) > 0
+
+    def start(self, key):
+        """Pass key to an idle worker.
+
+        Raise IOError."""
+
+        i = self.idle.pop()
+        output = self.workers[i][1]
+        marshal.dump(key, output)
+        output.flush()
+        self.pending[key] = i
+
+    def wait(self, key):
+        """Wait until the worker has finished key.
+
+        Return None on success, an error message on failure.  Raise KeyError
+        if key was not started."""
+
+        while key not in self.results:
+            if key not in self.pending:
+                raise KeyError, key
+            rmap = { }
+            for (k, i) in self.pending.iteritems():
+                rmap[self.workers[i][2].fileno()] = (k, i)
+            (ready, w, x) = select.select(rmap.keys(), [ ], [ ])
+            for fd in ready:
+                (k, i) = rmap[fd]
+                try:
+                    (k, error) = marshal.load(self.workers[i][2])
+                except (EOFError, ValueError, TypeError), e:
+                    # Don't use this worker again
+                    error = "extractor worker failed: %s" % e
+                else:
+                    self.idle.append(i)
+                del self.pending[k]
+                self.results[k] = error
+        return self.results.pop(key)
+
+    def close(self):
+        """Wait for the pending work and stop the workers."""
+
+        for key in self.pending.keys():
+            self.wait(key)
+        self.results.clear()
+        for (pid, output, input) in self.workers:
+            try:
+                output.close()
+            except IOError:
+                pass
+            input.close()
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.workers = [ ]
+        self.idle = [ ]
+
+
+def _work(rfd, wfd, extract):
+    """Call extract(key) for the keys read from rfd, write (key, error
+    message or None) to wfd."""
+
+    input = os.fdopen(rfd, "rb")
+    output = os.fdopen(wfd, "wb")
+    while True:
+        try:
+            key = marshal.load(input)
+        except EOFError:
+            break
+        try:
+            extract(key)
+            error = None
+        except (IOError, OSError, ValueError), e:
+            error = str(e)
+        except Exception, e:
+            # Report bugs too, and keep the worker
+            error = "%s: %s" % (e.__class__.__name__, e)
+        marshal.dump((key, error), output)
+        output.flush()
+
+# vim:ts=4:sw=4:showmatch:expandtab
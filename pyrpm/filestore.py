@@ -0,0 +1,212 @@
+#
+# Copyright (C) 2007 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as published by
+# the Free Software Foundation; version 2 only
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Content-addressed store of the regular files of installed packages.
+
+Every regular file installed from a package payload is also stored as
+DIRECTORY/md/5sum, keyed by its MD5 digest from the "filemd5s" tag, after
+verifying the data against the digest.  Later installs of a file with the
+same digest clone the stored file (a reflink on file systems that support
+it, a copy otherwise) instead of writing the data from the payload, and a
+package whose files are all stored is installed without reading its payload
+at all.
+
+With config.filestorelinks, files are hard linked to a stored copy with the
+owner, group, mode and mtime of the file, DIRECTORY/md/5sum-uid-gid-mode-mtime,
+so identical buildroots share the data.  Modifying such a file in place
+modifies it in all buildroots, so config files and files with SELinux
+contexts are always cloned."""
+
+import errno, fcntl, os, os.path
+from stat import S_ISREG, S_IMODE
+from base import RPMFILE_CONFIG, RPMFILE_GHOST
+import functions
+from pyrpm.logger import log
+from pyrpm.profiling import profiler
+
+# ioctl(dest, FICLONE, src) from linux/fs.h
+_FICLONE = 0x40049409
+
+# directory name => FileStore
+_stores = { }
+
+def getFileStore(config):
+    """Return the FileStore configured in RpmConfig config, or None."""
+
+    if not config.filestore:
+        return None
+    store = _stores.get(config.filestore)
+    if store is None:
+        store = FileStore(config.filestore)
+        _stores[config.filestore] = store
+    store.links = config.filestorelinks
+    return store
+
+
+class FileStore:
+    def __init__(self, directory, links=False):
+        self.directory = directory
+        self.links = links              # Hard link files to stored copies
+        self.hits = 0
+        self.misses = 0
+
+    def isStorable(self, rfi):
+        """Return True if the file described by RpmFileInfo rfi is a regular
+        file with data that can be stored."""
+
+        return (S_ISREG(rfi.mode) and rfi.filesize > 0 and
+                rfi.flags & RPMFILE_GHOST == 0 and rfi.md5sum is not None and
+                len(rfi.md5sum) == 32)
+
+    def has(self, rfi):
+        """Return True if the data of RpmFileInfo rfi is stored."""
+
+        return self.isStorable(rfi) and os.path.isfile(self.__path(rfi))
+
+    def hasAll(self, rfis):
+        """Return True if the data of all regular files in list of
+        RpmFileInfo rfis is stored."""
+
+        for rfi in rfis:
+            if rfi.flags & RPMFILE_GHOST or not S_ISREG(rfi.mode) or \
+                   rfi.filesize == 0:
+                continue
+            if not self.has(rfi):
+                return False
+        return True
+
+    def add(self, rfi, filename, digest):
+        """Store file filename with data of RpmFileInfo rfi and MD5 hex
+        digest digest.
+
+        Files that don't match rfi are not stored.  Return True if the data
+        is stored."""
+
+        if not self.isStorable(rfi) or digest != rfi.md5sum:
+            return False
+        path = self.__path(rfi)
+        if os.path.exists(path):
+            return True
+        tmpfilename = None
+        try:
+            functions.makeDirs(path)
+            (fd, tmpfilename) = functions.mkstemp_file(os.path.dirname(path),
+                                                       functions.tmpprefix)
+            try:
+                _clone(filename, fd)
+            finally:
+                os.close(fd)
+            os.chmod(tmpfilename, 0444)
+            os.rename(tmpfilename, path)
+        except (IOError, OSError), e:
+            log.warning("Can't store %s in %s: %s", rfi.filename,
+                        self.directory, e)
+            if tmpfilename is not None and os.path.exists(tmpfilename):
+                os.unlink(tmpfilename)
+            return False
+        return True
+
+    def copy(self, rfi, fd):
+        """Write the stored data of RpmFileInfo rfi to file descriptor fd.
+
+        Return True if the data was stored.  Raise IOError, OSError."""
+
+        if not self.has(rfi):
+            self.misses += 1
+            if profiler.enabled:
+                profiler.count("filestore.misses")
+            return False
+        _clone(self.__path(rfi), fd)
+        self.hits += 1
+        if profiler.enabled:
+            profiler.count("filestore.hits")
+        return True
+
+    def link(self, rfi, filename):
+        """Install the file of RpmFileInfo rfi as filename by a hard link to
+        a stored copy with the attributes of rfi, if self.links.
+
+        Return True if the file was linked, False if it has to be copied.
+        Raise IOError, OSError."""
+
+        if not self.links or rfi.flags & RPMFILE_CONFIG or \
+               None in (rfi.uid, rfi.gid, rfi.mtime) or not self.has(rfi):
+            return False
+        path = "%s-%d-%d-%o-%d" % (self.__path(rfi), rfi.uid, rfi.gid,
+                                   S_IMODE(rfi.mode), rfi.mtime)
+        if not os.path.exists(path):
+            tmpfilename = None
+            try:
+                (fd, tmpfilename) = functions.mkstemp_file(
+                    os.path.dirname(path), functions.tmpprefix)
+                try:
+                    _clone(self.__path(rfi), fd)
+                finally:
+                    os.close(fd)
+                os.chown(tmpfilename, rfi.uid, rfi.gid)
+                os.chmod(tmpfilename, S_IMODE(rfi.mode))
+                os.utime(tmpfilename, (rfi.mtime, rfi.mtime))
+                os.rename(tmpfilename, path)
+            except (IOError, OSError), e:
+                # E.g. chown() as non-root, copy the file instead
+                log.warning("Can't link %s to %s: %s", rfi.filename,
+                            self.directory, e)
+                if tmpfilename is not None and os.path.exists(tmpfilename):
+                    os.unlink(tmpfilename)
+                return False
+        functions.makeDirs(filename)
+        try:
+            tmpfilename = functions.mkstemp_link(os.path.dirname(filename),
+                                                 functions.tmpprefix, path)
+        except OSError, e:
+            if e.errno != errno.EMLINK:
+                raise
+            tmpfilename = None
+        if tmpfilename is None:
+            return False
+        os.rename(tmpfilename, filename)
+        self.hits += 1
+        if profiler.enabled:
+            profiler.count("filestore.links")
+        return True
+
+    def __path(self, rfi):
+        return os.path.join(self.directory, rfi.md5sum[:2], rfi.md5sum[2:])
+
+
+def _clone(src, fd):
+    """Write the data of file src to the empty file descriptor fd, sharing
+    the data blocks if the file system supports it.
+
+    Raise IOError, OSError."""
+
+    srcfd = os.open(src, os.O_RDONLY)
+    try:
+        try:
+            fcntl.ioctl(fd, _FICLONE, srcfd)
+            return
+        except IOError:
+            pass
+        while True:
+            data = os.read(srcfd, 65536)
+            if not data:
+                break
+            os.write(fd, data)
+    finally:
+        os.close(srcfd)
+
+# vim:ts=4:sw=4:showmatch:expandtab
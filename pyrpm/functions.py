@@ -17,7 +17,8 @@
 #
 
 
-import fcntl, os, os.path, sys, resource, getopt, errno, signal, shutil
+import fcntl, os, os.path, sys, resource, getopt, errno, signal, shutil, md5
+import re, atexit
 from types import TupleType
 from stat import S_ISREG, S_ISLNK, S_ISDIR, S_ISFIFO, S_ISCHR, S_ISBLK, S_IMODE, S_ISSOCK
 try:
@@ -27,11 +28,14 @@ except ImportError:
 
 import se_linux
 import package
+from scriptexec import ScriptExecutor
+from installfs import InstallFS
 
 from config import rpmconfig
 from base import *
 from pyrpm import __version__
 from pyrpm.logger import log
+from pyrpm.profiling import profiler
 
 # Number of bytes to read from file at once when computing digests
 DIGEST_CHUNK = 65536
@@ -174,6 +178,23 @@ def runScript(prog=None, script=None, otherargs=[], force=False, rusage=False,
         args = prog
     else:
         args = [prog]
+    if not force and args == ["/bin/sh"] and script != None and \
+           rpmconfig.deferscripts and rpmconfig.deferring:
+        commands = parseDeferrableScript(script, rpmconfig.deferrules)
+        if commands == [("/sbin/ldconfig", False)] or \
+               commands == [("/sbin/ldconfig", True)]:
+            (args, script) = (["/sbin/ldconfig"], None)
+        elif commands is not None:
+            rpmconfig.deferred += 1
+            for (command, quiet) in commands:
+                for entry in rpmconfig.deferredscripts:
+                    if entry[0] == chroot and entry[1] == command:
+                        # Errors are reported if one script reported them
+                        entry[2] = entry[2] and quiet
+                        break
+                else:
+                    rpmconfig.deferredscripts.append([chroot, command, quiet])
+            return (0, None, "")
     if not force and args == ["/sbin/ldconfig"] and script == None:
         if rpmconfig.delayldconfig == 1:
             rpmconfig.ldconfig += 1
@@ -193,6 +214,28 @@ def runScript(prog=None, script=None, otherargs=[], force=False, rusage=False,
         fd = None
         args.append(tmpfilename[len(chroot):])
         args += otherargs
+    if rpmconfig.scriptexecutor and \
+           not (rpmconfig.selinux_enabled and se_linux.is_selinux_enabled()):
+        try:
+            executor = getScriptExecutor(chroot)
+            executor.send(args, _scriptEnv(prefixes), rusage)
+        except (IOError, OSError, ValueError), e:
+            # The script did not run, fork it instead
+            log.warning("Script executor for %s failed, forking scripts: %s",
+                        chroot or "/", e)
+            stopScriptExecutors()
+            rpmconfig.scriptexecutor = 0
+        else:
+            try:
+                try:
+                    return executor.receive()
+                except IOError:
+                    # The script may have run, don't run it again
+                    stopScriptExecutors()
+                    raise
+            finally:
+                if script != None:
+                    os.unlink(tmpfilename)
     (rfd, wfd) = os.pipe()
 
     if rusage:
@@ -217,16 +260,7 @@ def runScript(prog=None, script=None, otherargs=[], force=False, rusage=False,
                 os.close(wfd)
             os.dup2(1, 2)
             os.chdir("/")
-            # FIXME: what about PATH=%{_install_script_path}?
-            e = {"HOME": "/", "USER": "root", "LOGNAME": "root",
-                 "PATH": "/sbin:/bin:/usr/sbin:/usr/bin:/usr/X11R6/bin",
-                 "PYRPM_VERSION" : __version__}
-            if prefixes:
-                e["RPM_INSTALL_PREFIX"] = prefixes[0]
-                idx = 1
-                for prefix in prefixes:
-                    e["RPM_INSTALL_PREFIX%d" % idx] = prefix
-                    idx += 1
+            e = _scriptEnv(prefixes)
             if rpmconfig.selinux_enabled and se_linux.is_selinux_enabled():
                 _env = [ "%s=%s" % (key, e[key]) for key in e.keys() ]
                 se_linux.rpm_execcon(0, args[0], args, _env)
@@ -256,6 +290,145 @@ def runScript(prog=None, script=None, otherargs=[], force=False, rusage=False,
 
     return (status, rusage_val, cret)
 
+def _scriptEnv(prefixes):
+    """Return the environment dict for scripts of a package with list of
+    prefixes."""
+
+    # FIXME: what about PATH=%{_install_script_path}?
+    e = {"HOME": "/", "USER": "root", "LOGNAME": "root",
+         "PATH": "/sbin:/bin:/usr/sbin:/usr/bin:/usr/X11R6/bin",
+         "PYRPM_VERSION" : __version__}
+    if prefixes:
+        e["RPM_INSTALL_PREFIX"] = prefixes[0]
+        idx = 1
+        for prefix in prefixes:
+            e["RPM_INSTALL_PREFIX%d" % idx] = prefix
+            idx += 1
+    return e
+
+# chroot => ScriptExecutor
+_executors = { }
+
+def getScriptExecutor(chroot=''):
+    """Return the ScriptExecutor for chroot, starting it if necessary.
+
+    Raise OSError."""
+
+    executor = _executors.get(chroot)
+    if executor is None:
+        executor = ScriptExecutor(chroot)
+        _executors[chroot] = executor
+        if profiler.enabled:
+            profiler.count("scriptexecutor.started")
+    return executor
+
+def stopScriptExecutors():
+    """Stop all ScriptExecutor processes, e.g. before unmounting their
+    chroot."""
+
+    for executor in _executors.values():
+        executor.close()
+    _executors.clear()
+
+atexit.register(stopScriptExecutors)
+
+# A test whether a file exists, kept with the command it guards
+_script_test = r"(?:\[ -[xfe] /[^\s\]]+ \]|test -[xfe] /\S+)"
+_script_if = re.compile(r"if (%s)(?:; then)?$" % _script_test)
+_script_guard = re.compile(r"(?:(%s) && (.*)|if (%s); then (.*); fi)$" %
+                           (_script_test, _script_test))
+_script_ldconfig = re.compile(r"(\[ -x|test -x) /(usr/)?sbin/ldconfig( \])?$")
+# Shell syntax after a command that only ignores its output and errors
+_script_tail = re.compile(r"( *(>|>>|2>|&>|>&) */dev/null| 2>&1| *\|\| *"
+                          r"(:|true|exit 0))+;?$")
+
+def parseDeferrableScript(script, rules):
+    """Return a list of (command, errors ignored) for the commands in shell
+    script if all of them match an entry of list of (program name, arguments
+    regexp) rules, None otherwise.
+
+    The commands can be guarded by a test whether a file exists and can have
+    their output and errors ignored.  Commands are returned without the
+    redirections and "|| :" that do this, with all whitespace normalized to
+    single spaces, a guarded command as "if TEST; then COMMAND; fi", for the
+    ldconfig program just as "/sbin/ldconfig"."""
+
+    commands = [ ]
+    guard = None                        # Test of the enclosing "if"
+    for line in script.replace("\\\n", " ").splitlines():
+        line = " ".join(line.split())
+        if not line or line[0] == "#" or line == "then":
+            continue
+        if line == "fi":
+            if guard is None:
+                return None
+            guard = None
+            continue
+        m = _script_if.match(line)
+        if m:
+            if guard is not None:
+                return None
+            guard = m.group(1)
+            continue
+        lineguard = guard
+        m = _script_guard.match(line)
+        if m:
+            if guard is not None:
+                return None
+            (lineguard, line) = (m.group(1) or m.group(3),
+                                 m.group(2) or m.group(4))
+        command = _script_tail.sub("", line)
+        if not command:
+            return None
+        quiet = "||" in line[len(command):]
+        for c in "$`;&|<>(){}\"'*?[]~\\":
+            if c in command:
+                return None
+        words = command.split(" ", 1)
+        name = os.path.basename(words[0])
+        if name == "ldconfig" and len(words) == 1:
+            if lineguard is not None and \
+                   not _script_ldconfig.match(lineguard):
+                return None
+            commands.append(("/sbin/ldconfig", quiet))
+            continue
+        if len(words) == 1:
+            words.append("")
+        for (rname, rargs) in rules:
+            if rname == name and re.match("(%s)$" % rargs, words[1]):
+                break
+        else:
+            return None
+        if lineguard is not None:
+            command = "if %s; then %s; fi" % (lineguard, command)
+        commands.append((command, quiet))
+    if not commands or guard is not None:
+        return None
+    if len(commands) > 1 and "/sbin/ldconfig" in [c[0] for c in commands]:
+        # ldconfig has to run before the next script, see runScript()
+        return None
+    return commands
+
+def runDeferredScripts():
+    """Run the commands of the scripts deferred by runScript() once, each in
+    the chroot of its script.
+
+    Return the number of script runs saved.  Raise IOError, OSError."""
+
+    saved = rpmconfig.deferred - len(rpmconfig.deferredscripts)
+    commands = rpmconfig.deferredscripts[:]
+    rpmconfig.deferredscripts[:] = [ ]
+    rpmconfig.deferred = 0
+    for (chroot, command, quiet) in commands:
+        (status, rusage, output) = runScript("/bin/sh", command + "\n",
+                                             force=1, chroot=chroot)
+        if status != 0 and not quiet:
+            log.warning("Error running deferred script command %s",
+                        command)
+            if output:
+                log.warning(output, nofmt=1)
+    return saved
+
 __symlinkhash__ = {}
 def brRealPath(prefix, filename):
     # In case we aren't in a buildroot just return the realpath() of filename
@@ -288,85 +461,114 @@ def brRealPath(prefix, filename):
     return prefix + filename
             
 def installFile(rfi, infd, size, useAttrs=True, pathPrefix=None,
-                useSEcontext=True):
+                useSEcontext=True, store=None, fs=None):
     """Install a file described by RpmFileInfo rfi, with input of given size
     from CPIOFile infd.
 
-    infd can be None if size == 0.  Ignore file attributes in rfi if useAttrs
-    is False.  Prefix filenames by pathPrefix if defined.  Raise ValueError on
-    invalid mode, IOError, OSError."""
+    infd can be None if size == 0 or if the data of a regular file is in
+    FileStore store.  Regular files are taken from and added to store if it
+    is not None.  Ignore file attributes in rfi if useAttrs is False.  Prefix
+    filenames by pathPrefix if defined.  Use InstallFS fs for the file
+    system operations if it is not None.  Raise ValueError on invalid mode,
+    IOError, OSError."""
 
+    if fs is None:
+        fs = InstallFS()
     filename = rfi.filename
     if pathPrefix is not None:
         filename = brRealPath(pathPrefix, filename)
     mode = rfi.mode
     if S_ISREG(mode):
-        makeDirs(filename)
-        (fd, tmpfilename) = mkstemp_file(os.path.dirname(filename), tmpprefix)
+        fs.makeDirs(filename)
+        if store is not None and useAttrs and not useSEcontext and \
+               store.link(rfi, filename):
+            return
+        (fd, tmpfilename) = fs.createFile(filename, tmpprefix)
         try:
             try:
+                if store is not None and size > 0 and store.copy(rfi, fd):
+                    size = 0
+                    digest = None
+                elif store is not None and size > 0:
+                    digest = md5.new()
+                else:
+                    digest = None
                 data = "1"
                 while size > 0 and data:
                     data = infd.read(65536)
                     if data:
                         size -= len(data)
-                        os.write(fd, data)
+                        fs.write(fd, data)
+                        if digest is not None:
+                            digest.update(data)
+                if digest is not None:
+                    store.add(rfi, tmpfilename, digest.hexdigest())
+                if useAttrs:
+                    fs.setNewFileAttrs(fd, tmpfilename, rfi)
             finally:
                 os.close(fd)
-            if useAttrs:
-                _setFileAttrs(tmpfilename, rfi)
             if useSEcontext:
-                _setSEcontext(tmpfilename, rfi)
+                _setSEcontext(tmpfilename, rfi, fs)
         except (IOError, OSError):
             os.unlink(tmpfilename)
             raise
-        os.rename(tmpfilename, filename)
+        fs.rename(tmpfilename, filename)
     elif S_ISDIR(mode):
-        if not os.path.isdir(filename):
-            os.makedirs(filename)
+        st = fs.makeDir(filename)
         if useAttrs:
-            _setFileAttrs(filename, rfi)
+            fs.setFileAttrs(filename, rfi, st)
+            fs.setDirMode(filename, rfi.mode)
         if useSEcontext:
-            _setSEcontext(filename, rfi)
+            _setSEcontext(filename, rfi, fs)
     elif S_ISLNK(mode):
         global __symlinkhash__
         data1 = rfi.linkto
-        data2 = infd.read(size)
-        data2 = data2.rstrip("\x00")
+        if infd is not None:
+            data2 = infd.read(size)
+            data2 = data2.rstrip("\x00")
+        else:
+            data2 = data1
         symlinkfile = data1
         if data1 != data2:
             log.waring("Warning: Symlink information differs between rpm "
                        "header and cpio for %s -> %s", rfi.filename, data1)
-        if os.path.islink(filename) and os.readlink(filename) == symlinkfile:
-            return
-        makeDirs(filename)
+        fs.count("readlink")
+        try:
+            if os.readlink(filename) == symlinkfile:
+                return
+        except OSError:
+            pass
+        fs.makeDirs(filename)
+        fs.count("symlink")
         tmpfilename = mkstemp_symlink(os.path.dirname(filename), tmpprefix,
                                       symlinkfile)
         try:
             if useAttrs:
-                os.lchown(tmpfilename, rfi.uid, rfi.gid)
+                fs.setLinkOwner(tmpfilename, rfi)
             if useSEcontext:
-                _setSEcontext(tmpfilename, rfi)
+                _setSEcontext(tmpfilename, rfi, fs)
         except OSError:
             os.unlink(tmpfilename)
             raise
-        os.rename(tmpfilename, filename)
+        fs.rename(tmpfilename, filename)
         if __symlinkhash__.has_key(rfi.filename):
             del __symlinkhash__[rfi.filename]
     elif S_ISFIFO(mode):
-        makeDirs(filename)
+        fs.makeDirs(filename)
+        fs.count("mkfifo")
         tmpfilename = mkstemp_mkfifo(os.path.dirname(filename), tmpprefix)
         try:
             if useAttrs:
-                _setFileAttrs(tmpfilename, rfi)
+                fs.setFileAttrs(tmpfilename, rfi)
             if useSEcontext:
-                _setSEcontext(tmpfilename, rfi)
+                _setSEcontext(tmpfilename, rfi, fs)
         except OSError:
             os.unlink(tmpfilename)
             raise
-        os.rename(tmpfilename, filename)
+        fs.rename(tmpfilename, filename)
     elif S_ISCHR(mode) or S_ISBLK(mode):
-        makeDirs(filename)
+        fs.makeDirs(filename)
+        fs.count("mknod")
         try:
             tmpfilename = mkstemp_mknod(os.path.dirname(filename),
                                         tmpprefix, mode, rfi.rdev)
@@ -374,50 +576,44 @@ def installFile(rfi, infd, size, useAttrs=True, pathPrefix=None,
             return # FIXME: why?
         try:
             if useAttrs:
-                _setFileAttrs(tmpfilename, rfi)
+                fs.setFileAttrs(tmpfilename, rfi)
             if useSEcontext:
-                _setSEcontext(tmpfilename, rfi)
+                _setSEcontext(tmpfilename, rfi, fs)
         except OSError:
             os.unlink(filename)
             raise
-        os.rename(tmpfilename, filename)
+        fs.rename(tmpfilename, filename)
     elif S_ISSOCK(mode):
         # Sockets are useful only when bound, but what do we care...
         # Note that creating sockets using mknod is not SUSv3-mandated, quite
         # likely Linux-specific.
         # Also, only 1 know package has a socket packaged, and that was dev in
         # RH-5.2.
-        makeDirs(filename)
+        fs.makeDirs(filename)
+        fs.count("mknod")
         tmpfilename = mkstemp_mknod(os.path.dirname(filename), tmpprefix,
                                     mode, 0)
         try:
             if useAttrs:
-                _setFileAttrs(tmpfilename, rfi)
+                fs.setFileAttrs(tmpfilename, rfi)
             if useSEcontext:
-                _setSEcontext(tmpfilename, rfi)
+                _setSEcontext(tmpfilename, rfi, fs)
         except OSError:
             os.unlink(filename)
             raise
-        os.rename(tmpfilename, filename)
+        fs.rename(tmpfilename, filename)
     else:
         raise ValueError, "%s: not a valid filetype" % (oct(mode))
 
-def _setFileAttrs(filename, rfi):
-    """Set owner, group, mode and mtime of filename data from RpmFileInfo rfi.
-
-    Raise OSError."""
-
-    os.chown(filename, rfi.uid, rfi.gid)
-    os.chmod(filename, S_IMODE(rfi.mode))
-    os.utime(filename, (rfi.mtime, rfi.mtime))
-
-def _setSEcontext(filename, rfi):
-    """Set SELinux context of filename data from RpmFileInfo rfi.
+def _setSEcontext(filename, rfi, fs):
+    """Set SELinux context of filename data from RpmFileInfo rfi, counting
+    the call in InstallFS fs.
 
     Raise OSError."""
 
     if se_linux.is_selinux_enabled() >= 0:
         context = se_linux.matchpathcon(rfi.filename, rfi.mode)
+        fs.count("lsetfilecon")
         se_linux.lsetfilecon(filename, context[1])
     else:
         raise ImportError, "selinux module is not available"
@@ -429,7 +625,19 @@ def makeDirs(fullname):
 
     dirname = os.path.dirname(fullname)
     if len(dirname) > 1 and not os.path.exists(dirname):
+        _makedirs(dirname)
+
+def _makedirs(dirname):
+    """Create directory dirname and its parents, which may be created by
+    another process at the same time.
+
+    Raise OSError."""
+
+    try:
         os.makedirs(dirname)
+    except OSError, e:
+        if e.errno != errno.EEXIST or not os.path.isdir(dirname):
+            raise
 
 def createLink(src, dst):
     """Create a link from src to dst.
@@ -566,6 +774,62 @@ def updateDigestFromFile(digest, fd, bytes=None):
             bytes -= len(data)
     return res
 
+def unpackBz2File(source, dest, digest=None, checksum=None):
+    """Uncompress the bzip2 file source to dest in DIGEST_CHUNK sized pieces.
+
+    The data is written to a temporary file next to dest which is renamed to
+    dest only after the whole file has been written.  If digest is given it is
+    updated with the uncompressed data, if checksum is given as well it has to
+    match digest.hexdigest() or dest is left untouched.
+
+    Return the number of uncompressed bytes.  Raise EOFError if source is
+    truncated, IOError, OSError."""
+
+    import bz2
+    decompressor = bz2.BZ2Decompressor()
+    (fd, tmpfilename) = mkstemp_file(os.path.dirname(dest), tmpprefix)
+    res = 0
+    eof = False                         # End of the bzip2 stream seen
+    try:
+        try:
+            infd = open(source, "rb")
+            try:
+                while True:
+                    data = infd.read(DIGEST_CHUNK)
+                    if not data:
+                        break
+                    try:
+                        data = decompressor.decompress(data)
+                    except EOFError:
+                        eof = True
+                        break # trailing garbage after end of stream
+                    if not data:
+                        continue
+                    if digest is not None:
+                        digest.update(data)
+                    res += len(data)
+                    while data:
+                        data = data[os.write(fd, data):]
+                if not eof:
+                    # Raises EOFError only after the end of the stream
+                    try:
+                        decompressor.decompress("")
+                    except EOFError:
+                        eof = True
+            finally:
+                infd.close()
+        finally:
+            os.close(fd)
+        if not eof:
+            raise EOFError, "%s: unexpected end of file" % source
+        if checksum is not None and digest.hexdigest() != checksum:
+            raise IOError, "%s: checksum mismatch" % source
+        os.rename(tmpfilename, dest)
+    except:
+        _unlink(tmpfilename)
+        raise
+    return res
+
 def _shellQuoteString(s):
     """Returns its argument properly quoted for parsing by a POSIX shell."""
 
@@ -796,7 +1060,10 @@ def parseYumOptions(argv, yum):
          "installpkgs=", "arch=", "archlist=", "checkinstalled", "rusage",
          "srpmdir=", "enablerepo=", "disablerepo=", "nocache", "cachedir=",
          "exclude=", "obsoletes", "noplugins", "diff", "verifyallconfig",
-         "languages=", "releaseversion=", "disablerhn"])
+         "languages=", "releaseversion=", "disablerhn", "repothreads=",
+         "profile=", "rpmdbcache=", "deltas", "deltadir=",
+         "filestore=", "filestorelinks", "nodeferscripts",
+         "noscriptexecutor", "parallel="])
     except getopt.error, e:
         # FIXME: all to stderr
         log.error("Error parsing command-line arguments: %s", e)
@@ -909,6 +1176,25 @@ def parseYumOptions(argv, yum):
             rpmconfig.nocache = 1
         elif opt == "--cachedir":
             rpmconfig.cachedir = val
+        elif opt == "--deltas":
+            rpmconfig.deltas = 1
+        elif opt == "--deltadir":
+            rpmconfig.deltas = 1
+            rpmconfig.deltadirs.append(val)
+        elif opt == "--filestore":
+            rpmconfig.filestore = val
+        elif opt == "--filestorelinks":
+            rpmconfig.filestorelinks = 1
+        elif opt == "--nodeferscripts":
+            rpmconfig.deferscripts = 0
+        elif opt == "--noscriptexecutor":
+            rpmconfig.scriptexecutor = 0
+        elif opt == "--parallel":
+            try:
+                rpmconfig.parallel = int(val)
+            except ValueError:
+                print "Invalid number of extractor processes"
+                return None
         elif opt == "--exclude":
             rpmconfig.excludes.append(val)
         elif opt == "--obsoletes":
@@ -927,6 +1213,20 @@ def parseYumOptions(argv, yum):
             rpmconfig.relver = val
         elif opt == "--disablerhn":
             yum.rhnenabled = False
+        elif opt == "--repothreads":
+            try:
+                rpmconfig.repothreads = int(val)
+            except ValueError:
+                print "Invalid number of repository threads"
+                return None
+        elif opt == "--profile":
+            profiler.enable(val)
+        elif opt == "--rpmdbcache":
+            try:
+                rpmconfig.rpmdbcache = int(val)
+            except ValueError:
+                print "Invalid rpmdb cache size"
+                return None
 
     log.setInfoLogLevel(verbose)
 
@@ -0,0 +1,635 @@
+#
+# Copyright (C) 2007 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as published by
+# the Free Software Foundation; version 2 only
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""
+The RpmGraph
+------------
+
+A dependency graph of all packages of a database for analysis and export.
+
+Unlike RpmRelations, which the orderer builds for the changes of one
+transaction, the RpmGraph covers a complete repository and uses integers as
+nodes: node i is graph.pkgs[i], and the edges of a node are kept in an
+array of the nodes providing its requirements.  The graph can be written to
+and read from a cache file, keyed by the checksum of the repository, so
+repeated runs don't need to resolve the requirements again.
+
+Strongly connected components, transitive closures and reverse dependency
+counts are computed for all nodes at once on the graph of strongly
+connected components, with closures as bit sets (long integers with bit j
+set if node j is included).
+
+RpmClosures answers closure, install set and leaf queries for packages of a
+database from its RpmGraph, and caches the results until the packages of
+the database change.
+"""
+
+import os, array, marshal, sha
+from base import OP_INSTALL
+from functions import pkgCompare, makeDirs, mkstemp_file, tmpprefix
+from orderer import operationFlag
+from database.lrucache import LRUCache
+from logger import log
+from profiling import profiler, toJSON
+
+# Format version of the cache files written by RpmGraph.save()
+_GRAPH_CACHE_VERSION = 1
+
+# hex digit => number of bits set
+_hexbits = { }
+for _i in xrange(16):
+    _hexbits["%x" % _i] = (_i & 1) + (_i >> 1 & 1) + (_i >> 2 & 1) + \
+                          (_i >> 3 & 1)
+del _i
+
+def bitCount(bits):
+    """Return the number of nodes in bit set bits."""
+
+    count = 0
+    for c in "%x" % bits:
+        count += _hexbits[c]
+    return count
+
+def bitNodes(bits):
+    """Return a sorted list of the nodes in bit set bits."""
+
+    nodes = [ ]
+    digits = "%x" % bits
+    base = (len(digits) - 1) * 4
+    for c in digits:
+        if c != "0":
+            value = int(c, 16)
+            for j in (0, 1, 2, 3):
+                if value & (1 << j):
+                    nodes.append(base + j)
+        base -= 4
+    nodes.sort()
+    return nodes
+
+def graphChecksum(db):
+    """Return a checksum identifying the packages in RpmDatabase db and their
+    requirements.
+
+    This is a SHA1 of the sorted NEVRAs of the packages, which changes with
+    excludes and the architectures of the packages read, of whether the file
+    lists are imported, and for repositories of the checksum of primary.xml
+    from repomd.xml, prefixed by the repository name."""
+
+    nevras = [pkg.getNEVRA() for pkg in db.getPkgs()]
+    nevras.sort()
+    digest = sha.new("\n".join(nevras))
+    digest.update("\0filelists=%d" % bool(db.isFilelistImported()))
+    repomd = getattr(db, "repomd", None)
+    if repomd and repomd.get("primary", { }).has_key("checksum"):
+        digest.update("\0primary=%s" % repomd["primary"]["checksum"])
+        return "%s-%s" % (db.reponame, digest.hexdigest())
+    return digest.hexdigest()
+
+def getGraph(config, db, cache=True):
+    """Return the RpmGraph of the packages in RpmDatabase db.
+
+    If cache, read the graph from config.cachedir if it was written for the
+    same graphChecksum(db) before, and write it there otherwise."""
+
+    if not cache:
+        graph = RpmGraph(config)
+        graph.build(db)
+        return graph
+    filename = os.path.join(config.cachedir, "graph",
+                            "%s.graph" % graphChecksum(db))
+    graph = RpmGraph(config)
+    if os.path.exists(filename) and graph.load(filename, db):
+        return graph
+    graph.build(db)
+    graph.save(filename)
+    return graph
+
+class RpmGraph:
+    """Requirements between the packages of a database as an integer graph.
+
+    Node i is the RpmPackage self.pkgs[i].  self.succ[i] is an array of the
+    nodes providing requirements of node i, self.hard[i] the subset which is
+    required before installation (prerequisites).  self.requires[i] lists
+    the providing nodes of each requirement, preferred provider first, and
+    self.unresolved maps nodes to lists of unresolved requirements.
+    Requirements a package provides itself, rpmlib() and config()
+    requirements are ignored."""
+
+    def __init__(self, config):
+        self.config = config
+        self.clear()
+
+    def clear(self):
+        self.pkgs = [ ]
+        self.index = { }                # RpmPackage => node
+        self.names = { }                # name => [node]
+        self.succ = [ ]
+        self.hard = [ ]
+        self.requires = [ ]
+        self.unresolved = { }
+        self._pred = None
+        self._sccs = None
+        self._closures = { }            # reverse => list of bit sets
+
+    def __len__(self):
+        return len(self.pkgs)
+
+    def __setPkgs(self, pkgs):
+        self.clear()
+        self.pkgs = pkgs
+        for i in xrange(len(pkgs)):
+            self.index[pkgs[i]] = i
+            self.names.setdefault(pkgs[i]["name"], [ ]).append(i)
+
+    def build(self, db):
+        """Build the graph of all packages in RpmDatabase db."""
+
+        if profiler.enabled:
+            ptime = profiler.start()
+        pkgs = db.getPkgs()[:]
+        pkgs.sort(lambda a, b: cmp(a.getNEVRA(), b.getNEVRA()))
+        self.__setPkgs(pkgs)
+        index = self.index
+        for i in xrange(len(pkgs)):
+            pkg = pkgs[i]
+            succ = { }
+            hard = { }
+            requires = [ ]
+            for (name, flag, version) in pkg["requires"] or ():
+                if name[:7] == "rpmlib(" or name[:7] == "config(":
+                    continue
+                s = db.searchDependency(name, flag, version)
+                if not s:
+                    self.unresolved.setdefault(i, [ ]).append(
+                        (name, flag, version))
+                    continue
+                if pkg in s:
+                    continue
+                nodes = [index[p] for p in s if index.has_key(p)]
+                if not nodes:
+                    continue
+                nodes.sort(self.__providerCompare(name))
+                requires.append(tuple(nodes))
+                ishard = operationFlag(flag, OP_INSTALL)
+                for j in nodes:
+                    succ[j] = None
+                    if ishard:
+                        hard[j] = None
+            self.succ.append(self.__array(succ.keys()))
+            self.hard.append(self.__array(hard.keys()))
+            self.requires.append(requires)
+        if profiler.enabled:
+            profiler.stop("graph.build", ptime)
+        log.info2("Dependency graph: %d packages, %d edges",
+                  len(self.pkgs), sum([len(s) for s in self.succ]))
+
+    def __providerCompare(self, name):
+        """Return a cmp function ordering providers of name by preference:
+        packages named name, newer packages, lower nodes first."""
+
+        pkgs = self.pkgs
+        def compare(a, b):
+            return cmp(pkgs[a]["name"] != name, pkgs[b]["name"] != name) or \
+                   (pkgs[a]["name"] == pkgs[b]["name"] and
+                    -pkgCompare(pkgs[a], pkgs[b])) or cmp(a, b)
+        return compare
+
+    def __array(self, nodes):
+        nodes.sort()
+        return array.array("i", nodes)
+
+    def save(self, filename):
+        """Write the graph to filename.
+
+        Return 1 on success, 0 on failure (after warning the user)."""
+
+        try:
+            makeDirs(filename)
+            (fd, tmpname) = mkstemp_file(os.path.dirname(filename), tmpprefix)
+        except (IOError, OSError), e:
+            log.warning("Couldn't write dependency graph %s: %s", filename, e)
+            return 0
+        data = (_GRAPH_CACHE_VERSION,
+                [pkg.getNEVRA() for pkg in self.pkgs],
+                [s.tolist() for s in self.succ],
+                [h.tolist() for h in self.hard],
+                self.requires, self.unresolved)
+        try:
+            try:
+                os.write(fd, marshal.dumps(data))
+            finally:
+                os.close(fd)
+            os.rename(tmpname, filename)
+        except (IOError, OSError), e:
+            log.warning("Couldn't write dependency graph %s: %s", filename, e)
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+            return 0
+        return 1
+
+    def load(self, filename, db):
+        """Read the graph of the packages in RpmDatabase db from filename.
+
+        Return 1 on success, 0 if filename doesn't contain a graph of the
+        packages in db."""
+
+        try:
+            fd = open(filename, "rb")
+            try:
+                data = marshal.load(fd)
+            finally:
+                fd.close()
+        except (IOError, EOFError, ValueError, TypeError), e:
+            log.warning("Couldn't read dependency graph %s: %s", filename, e)
+            return 0
+        if not isinstance(data, tuple) or len(data) != 6 or \
+               data[0] != _GRAPH_CACHE_VERSION:
+            return 0
+        (version, nevras, succ, hard, requires, unresolved) = data
+        pkgs = db.getPkgs()
+        if len(pkgs) != len(nevras):
+            return 0
+        bynevra = { }
+        for pkg in pkgs:
+            bynevra[pkg.getNEVRA()] = pkg
+        try:
+            pkgs = [bynevra[nevra] for nevra in nevras]
+        except KeyError:
+            return 0
+        self.__setPkgs(pkgs)
+        self.succ = [array.array("i", s) for s in succ]
+        self.hard = [array.array("i", h) for h in hard]
+        self.requires = requires
+        self.unresolved = unresolved
+        log.info2("Read dependency graph from %s", filename)
+        return 1
+
+    # ----
+
+    def getNode(self, pkg):
+        """Return the node of RpmPackage pkg."""
+
+        return self.index[pkg]
+
+    def getPkgs(self, nodes):
+        """Return the RpmPackages of nodes."""
+
+        return [self.pkgs[i] for i in nodes]
+
+    def getPredecessors(self):
+        """Return a list of arrays of the nodes requiring each node."""
+
+        if self._pred is None:
+            pred = [[ ] for i in xrange(len(self.pkgs))]
+            for i in xrange(len(self.pkgs)):
+                for j in self.succ[i]:
+                    pred[j].append(i)
+            self._pred = [array.array("i", p) for p in pred]
+        return self._pred
+
+    def stronglyConnectedComponents(self):
+        """Return the strongly connected components as sorted lists of nodes.
+
+        Every component comes after all components it requires."""
+
+        if self._sccs is not None:
+            return self._sccs
+        n = len(self.pkgs)
+        succ = self.succ
+        order = [-1] * n                # visit number
+        low = [0] * n
+        onstack = [0] * n
+        stack = [ ]
+        sccs = [ ]
+        counter = 0
+        # Tarjan's algorithm with an explicit stack of (node, next edge)
+        for root in xrange(n):
+            if order[root] != -1:
+                continue
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            onstack[root] = 1
+            work = [[root, 0]]
+            while work:
+                top = work[-1]
+                v = top[0]
+                if top[1] < len(succ[v]):
+                    w = succ[v][top[1]]
+                    top[1] += 1
+                    if order[w] == -1:
+                        order[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        onstack[w] = 1
+                        work.append([w, 0])
+                    elif onstack[w] and order[w] < low[v]:
+                        low[v] = order[w]
+                    continue
+                work.pop()
+                if work and low[v] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[v]
+                if low[v] == order[v]:
+                    component = [ ]
+                    while 1:
+                        w = stack.pop()
+                        onstack[w] = 0
+                        component.append(w)
+                        if w == v:
+                            break
+                    component.sort()
+                    sccs.append(component)
+        self._sccs = sccs
+        return sccs
+
+    def closures(self, reverse=False):
+        """Return a list of the transitive closures of all nodes as bit sets.
+
+        The closure of a node contains the node and all nodes it requires
+        directly or indirectly, or all nodes requiring it if reverse."""
+
+        if self._closures.has_key(reverse):
+            return self._closures[reverse]
+        if profiler.enabled:
+            ptime = profiler.start()
+        sccs = self.stronglyConnectedComponents()
+        component = [0] * len(self.pkgs)
+        for c in xrange(len(sccs)):
+            for v in sccs[c]:
+                component[v] = c
+        if reverse:
+            edges = self.getPredecessors()
+            corder = xrange(len(sccs) - 1, -1, -1)
+        else:
+            edges = self.succ
+            corder = xrange(len(sccs))
+        cbits = [0L] * len(sccs)
+        for c in corder:
+            bits = 0L
+            for v in sccs[c]:
+                bits |= 1L << v
+            for v in sccs[c]:
+                for w in edges[v]:
+                    d = component[w]
+                    if d != c:
+                        bits |= cbits[d]
+            cbits[c] = bits
+        result = [cbits[component[v]] for v in xrange(len(self.pkgs))]
+        self._closures[reverse] = result
+        if profiler.enabled:
+            profiler.stop("graph.closures", ptime)
+        return result
+
+    def closure(self, nodes, reverse=False):
+        """Return a sorted list of nodes and all nodes they require, or all
+        nodes requiring them if reverse."""
+
+        if reverse:
+            edges = self.getPredecessors()
+        else:
+            edges = self.succ
+        result = dict.fromkeys(nodes)
+        queue = list(nodes)
+        while queue:
+            for w in edges[queue.pop()]:
+                if not result.has_key(w):
+                    result[w] = None
+                    queue.append(w)
+        result = result.keys()
+        result.sort()
+        return result
+
+    def reverseDependencyCounts(self):
+        """Return a list of the number of nodes requiring each node directly
+        or indirectly."""
+
+        return [bitCount(bits) - 1 for bits in self.closures(reverse=True)]
+
+    def installSet(self, nodes):
+        """Return a sorted list of nodes and the nodes needed to satisfy
+        their requirements, recursively.
+
+        A requirement already satisfied by a collected node doesn't add
+        another provider, otherwise its preferred provider is added.  The
+        result is small, but not necessarily the smallest possible set."""
+
+        requires = self.requires
+        result = dict.fromkeys(nodes)
+        queue = list(nodes)
+        queue.reverse()
+        while queue:
+            v = queue.pop()
+            for providers in requires[v]:
+                for w in providers:
+                    if result.has_key(w):
+                        break
+                else:
+                    w = providers[0]
+                    result[w] = None
+                    queue.append(w)
+        result = result.keys()
+        result.sort()
+        return result
+
+    def installSets(self, queries):
+        """Return a list of installSet(nodes) for each list of nodes in
+        queries."""
+
+        if profiler.enabled:
+            ptime = profiler.start()
+        result = [self.installSet(nodes) for nodes in queries]
+        if profiler.enabled:
+            profiler.stop("graph.installSets", ptime)
+        return result
+
+    # ----
+
+    def __nodeList(self, nodes):
+        if nodes is None:
+            return xrange(len(self.pkgs))
+        nodes = list(nodes)
+        nodes.sort()
+        return nodes
+
+    def writeDot(self, fd, nodes=None):
+        """Write the graph, or the subgraph of nodes, to file fd in dot
+        format, prerequisites in bold."""
+
+        nodes = self.__nodeList(nodes)
+        included = dict.fromkeys(nodes)
+        fd.write('digraph rpmgraph {\n')
+        for i in nodes:
+            fd.write('n%d [label="%s"];\n' % (i, self.pkgs[i]["name"]))
+        for i in nodes:
+            hard = self.hard[i]
+            for j in self.succ[i]:
+                if not included.has_key(j):
+                    continue
+                if j in hard:
+                    fd.write('n%d -> n%d [style="bold"];\n' % (i, j))
+                else:
+                    fd.write('n%d -> n%d;\n' % (i, j))
+        fd.write('}\n')
+
+    def writeGraphML(self, fd, nodes=None):
+        """Write the graph, or the subgraph of nodes, to file fd in GraphML
+        format."""
+
+        nodes = self.__nodeList(nodes)
+        included = dict.fromkeys(nodes)
+        fd.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                 '  <key id="name" for="node" attr.name="name" '
+                 'attr.type="string"/>\n'
+                 '  <key id="nevra" for="node" attr.name="nevra" '
+                 'attr.type="string"/>\n'
+                 '  <key id="prereq" for="edge" attr.name="prereq" '
+                 'attr.type="boolean"/>\n'
+                 '  <graph id="rpmgraph" edgedefault="directed">\n')
+        for i in nodes:
+            pkg = self.pkgs[i]
+            fd.write('    <node id="n%d"><data key="name">%s</data>'
+                     '<data key="nevra">%s</data></node>\n'
+                     % (i, _xmlEscape(pkg["name"]),
+                        _xmlEscape(pkg.getNEVRA())))
+        for i in nodes:
+            hard = self.hard[i]
+            for j in self.succ[i]:
+                if included.has_key(j):
+                    fd.write('    <edge source="n%d" target="n%d">'
+                             '<data key="prereq">%s</data></edge>\n'
+                             % (i, j, ("false", "true")[j in hard]))
+        fd.write('  </graph>\n</graphml>\n')
+
+    def writeJSON(self, fd, nodes=None):
+        """Write the graph, or the subgraph of nodes, to file fd as JSON:
+        a list of nodes with their requirements and prerequisites."""
+
+        nodes = self.__nodeList(nodes)
+        included = dict.fromkeys(nodes)
+        fd.write('{\n  "nodes": [')
+        sep = "\n"
+        for i in nodes:
+            pkg = self.pkgs[i]
+            succ = [str(j) for j in self.succ[i] if included.has_key(j)]
+            hard = [str(j) for j in self.hard[i] if included.has_key(j)]
+            fd.write('%s    {"id": %d, "name": %s, "nevra": %s, '
+                     '"requires": [%s], "prereqs": [%s]}'
+                     % (sep, i, toJSON(pkg["name"]),
+                        toJSON(pkg.getNEVRA()), ", ".join(succ),
+                        ", ".join(hard)))
+            sep = ",\n"
+        fd.write('\n  ]\n}\n')
+
+class RpmClosures:
+    """Dependency closures, install sets and leaves of the packages in a
+    RpmDatabase.
+
+    All queries use the RpmGraph of the database (from getGraph(), cached
+    on disk if cache).  The graph and the query results are dropped when
+    packages are added to or removed from the database."""
+
+    def __init__(self, config, db, cache=True, maxresults=10000):
+        self.config = config
+        self.db = db
+        self.cache = cache
+        self.graph = None
+        self.generation = None
+        # (query type, sorted nodes) => sorted nodes
+        self.results = LRUCache(maxsize=maxresults, name="closure queries")
+
+    def getGraph(self):
+        """Return the RpmGraph of the current packages of the database."""
+
+        # Every added or removed package changes the generation of files
+        generation = self.db._getDependencyGeneration("/")
+        if self.graph is None or generation != self.generation:
+            self.graph = getGraph(self.config, self.db, self.cache)
+            self.generation = generation
+            self.results.clear()
+        return self.graph
+
+    def __query(self, kind, pkgs):
+        graph = self.getGraph()
+        nodes = [graph.getNode(pkg) for pkg in pkgs]
+        nodes.sort()
+        key = (kind, tuple(nodes))
+        result = self.results.get(key)
+        if result is None:
+            if kind == "install":
+                result = graph.installSet(nodes)
+            else:
+                closures = graph.closures(kind == "reverse")
+                bits = 0L
+                for i in nodes:
+                    bits |= closures[i]
+                result = bitNodes(bits)
+            self.results[key] = result
+        return graph.getPkgs(result)
+
+    def closure(self, pkgs):
+        """Return RpmPackages pkgs and all packages they require directly
+        or indirectly."""
+
+        return self.__query("forward", pkgs)
+
+    def reverseClosure(self, pkgs):
+        """Return RpmPackages pkgs and all packages requiring them directly
+        or indirectly."""
+
+        return self.__query("reverse", pkgs)
+
+    def installSet(self, pkgs):
+        """Return RpmPackages pkgs and the packages pulled in to satisfy
+        their requirements, see RpmGraph.installSet()."""
+
+        return self.__query("install", pkgs)
+
+    def closures(self, queries):
+        """Return a list of closure(pkgs) for each list pkgs in queries."""
+
+        return [self.closure(pkgs) for pkgs in queries]
+
+    def reverseClosures(self, queries):
+        """Return a list of reverseClosure(pkgs) for each list pkgs in
+        queries."""
+
+        return [self.reverseClosure(pkgs) for pkgs in queries]
+
+    def installSets(self, queries):
+        """Return a list of installSet(pkgs) for each list pkgs in queries."""
+
+        if profiler.enabled:
+            ptime = profiler.start()
+        result = [self.installSet(pkgs) for pkgs in queries]
+        if profiler.enabled:
+            profiler.stop("closures.installSets", ptime)
+        return result
+
+    def leaves(self):
+        """Return the packages no other package requires."""
+
+        graph = self.getGraph()
+        pred = graph.getPredecessors()
+        return graph.getPkgs([i for i in xrange(len(graph)) if not pred[i]])
+
+def _xmlEscape(s):
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+# vim:ts=4:sw=4:showmatch:expandtab
@@ -17,7 +17,8 @@
 #
 
 import os, os.path, stat, signal, string, time, resource, struct
-from pyrpm.functions import normalizeList, runScript, labelCompare, evrSplit
+from pyrpm.functions import normalizeList, runScript, labelCompare, evrSplit, \
+     stopScriptExecutors
 from pyrpm.database import getRpmDB
 from config import log, flog, rpmconfig
 import pyrpm.se_linux as se_linux
@@ -424,6 +425,8 @@ def fuser(what):
 
 def umount_all(dir):
     # umount target dir and included mount points
+    # script helper processes may have their root in dir
+    stopScriptExecutors()
     mounted = [ ]
     fstype = { }
     fd = None
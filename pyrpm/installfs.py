@@ -0,0 +1,213 @@
+#
+# Copyright (C) 2007 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as published by
+# the Free Software Foundation; version 2 only
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""File system operations for installing the files of a package.
+
+Packages with many small files spend most of their install time in system
+calls.  An InstallFS is used for the files of one package: it remembers the
+directories known to exist, sets the owner and mode of new regular files
+through their open file descriptor, skips chown() and chmod() calls that
+would not change anything and counts the system calls it makes."""
+
+import errno, os, os.path
+from stat import S_IMODE, S_ISDIR, S_ISGID
+from tempfile import _get_candidate_names, TMP_MAX
+
+# Flags for new regular files.  They are closed before any script runs, so
+# FD_CLOEXEC is not needed.
+_O_CREATE = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_NOFOLLOW", 0)
+
+
+class InstallFS:
+    def __init__(self):
+        self.dirs = { }                 # Existing directory => its S_ISGID bit
+        self.counts = { }               # System call name => number of calls
+        self.uid = os.geteuid()         # Owner of new files
+        self.gid = os.getegid()         # Group of new files, unless S_ISGID
+
+    def count(self, name, value=1):
+        """Add value to the number of name system calls."""
+
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def report(self):
+        """Return a string with the numbers of system calls."""
+
+        names = self.counts.keys()
+        names.sort()
+        return "%d system calls (%s)" % \
+               (sum(self.counts.values()),
+                ", ".join(["%s %d" % (name, self.counts[name])
+                           for name in names]))
+
+    def makeDirs(self, filename):
+        """Create the parent directory of filename if it does not already
+        exist.
+
+        Raise OSError."""
+
+        dirname = os.path.dirname(filename)
+        if len(dirname) > 1 and dirname not in self.dirs:
+            self.__lookupDir(dirname)
+
+    def makeDir(self, dirname):
+        """Create directory dirname and its parents if they do not already
+        exist.
+
+        Return the os.stat() result of dirname if it existed, None if it was
+        created.  Raise OSError."""
+
+        self.count("stat")
+        try:
+            st = os.stat(dirname)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.__lookupDir(dirname)
+            return None
+        if not S_ISDIR(st.st_mode):
+            raise OSError, (errno.EEXIST, os.strerror(errno.EEXIST), dirname)
+        self.dirs[dirname] = st.st_mode & S_ISGID
+        return st
+
+    def setDirMode(self, dirname, mode):
+        """Remember that directory dirname has mode mode."""
+
+        self.dirs[dirname] = mode & S_ISGID
+
+    def createFile(self, filename, prefix):
+        """Create a new empty regular file with mode 0600 in the directory of
+        filename, with a name starting with prefix.
+
+        Return (file descriptor, path name).  Raise IOError if no file name is
+        available, OSError."""
+
+        self.makeDirs(filename)
+        dirname = os.path.dirname(filename)
+        names = _get_candidate_names()
+        for _ in xrange(TMP_MAX):
+            tmpfilename = os.path.join(dirname, prefix + names.next())
+            self.count("open")
+            try:
+                fd = os.open(tmpfilename, _O_CREATE, 0600)
+            except OSError, e:
+                if e.errno == errno.EEXIST:
+                    continue # try again
+                raise
+            return (fd, tmpfilename)
+        raise IOError, (errno.EEXIST, "No usable temporary file name found")
+
+    def write(self, fd, data):
+        """Write data to file descriptor fd.
+
+        Raise OSError."""
+
+        self.count("write")
+        os.write(fd, data)
+
+    def setNewFileAttrs(self, fd, filename, rfi):
+        """Set owner, group, mode and mtime of filename, open as fd and
+        created by createFile(), from RpmFileInfo rfi.
+
+        Raise OSError."""
+
+        if self.__needsChown(filename, rfi):
+            self.count("fchown")
+            os.fchown(fd, rfi.uid, rfi.gid)
+        if S_IMODE(rfi.mode) != 0600:
+            self.count("fchmod")
+            os.fchmod(fd, S_IMODE(rfi.mode))
+        self.count("utime")
+        os.utime(filename, (rfi.mtime, rfi.mtime))
+
+    def setFileAttrs(self, filename, rfi, st=None):
+        """Set owner, group, mode and mtime of filename from RpmFileInfo rfi.
+
+        st is the os.stat() result of filename if it is known; the attributes
+        that already match are not set.  Raise OSError."""
+
+        chowned = False
+        if st is None or st.st_uid != rfi.uid or st.st_gid != rfi.gid:
+            self.count("chown")
+            os.chown(filename, rfi.uid, rfi.gid)
+            chowned = True
+        # chown() may clear S_ISUID and S_ISGID
+        if chowned or S_IMODE(st.st_mode) != S_IMODE(rfi.mode):
+            self.count("chmod")
+            os.chmod(filename, S_IMODE(rfi.mode))
+        if st is None or st.st_mtime != rfi.mtime:
+            self.count("utime")
+            os.utime(filename, (rfi.mtime, rfi.mtime))
+
+    def setLinkOwner(self, filename, rfi):
+        """Set owner and group of the new symlink filename from RpmFileInfo
+        rfi.
+
+        Raise OSError."""
+
+        if self.__needsChown(filename, rfi):
+            self.count("lchown")
+            os.lchown(filename, rfi.uid, rfi.gid)
+
+    def rename(self, src, dst):
+        """Rename src to dst.
+
+        Raise OSError."""
+
+        self.count("rename")
+        os.rename(src, dst)
+
+    def __needsChown(self, filename, rfi):
+        """Return True if a file filename created by this process needs a
+        chown() to get the owner and group of RpmFileInfo rfi."""
+
+        # Unknown directories may have S_ISGID
+        setgid = self.dirs.get(os.path.dirname(filename), S_ISGID)
+        return rfi.uid != self.uid or rfi.gid != self.gid or setgid
+
+    def __lookupDir(self, dirname):
+        """Create directory dirname and its parents if they do not exist.
+
+        Return its S_ISGID bit.  Raise OSError."""
+
+        setgid = self.dirs.get(dirname)
+        if setgid is not None:
+            return setgid
+        self.count("stat")
+        try:
+            setgid = os.stat(dirname).st_mode & S_ISGID
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            parent = os.path.dirname(dirname)
+            setgid = 0
+            if len(parent) > 1:
+                # New directories inherit S_ISGID
+                setgid = self.__lookupDir(parent)
+            self.count("mkdir")
+            try:
+                os.mkdir(dirname)
+            except OSError, e:
+                # Created by another process at the same time?
+                if e.errno != errno.EEXIST:
+                    raise
+                self.count("stat")
+                setgid = os.stat(dirname).st_mode & S_ISGID
+        self.dirs[dirname] = setgid
+        return setgid
+
+# vim:ts=4:sw=4:showmatch:expandtab
@@ -232,6 +232,9 @@ class Logger:
         self._debug_logging = { }
         self._domains = { }
         self._debug_domains = { }
+        self._enabled = { }
+        self._debug_enabled = { }
+        self._code_classes = { }
 
         # INFO1 is required for standard log level
         if info_max < 1:
@@ -253,18 +256,14 @@ class Logger:
             setattr(self, "INFO%d" % _level, _level)
             self.setInfoLogLabel(_level, "")
             setattr(self, "info%d" % (_level),
-                    (lambda self, x:
-                     lambda message, *args, **kwargs:
-                     self.info(x, message, *args, **kwargs))(self, _level))
+                    self._genLogFunction(_level, is_debug=0))
 
         # generate debug levels and debugx functions
         for _level in xrange(1, self.DEBUG_MAX+1):
             setattr(self, "DEBUG%d" % _level, _level)
             self.setDebugLogLabel(_level, "DEBUG%d: " % _level)
             setattr(self, "debug%d" % (_level),
-                    (lambda self, x:
-                     lambda message, *args, **kwargs:
-                     self.debug(x, message, *args, **kwargs))(self, _level))
+                    self._genLogFunction(_level, is_debug=1))
 
         # set initial log levels, formats and targets
         self.setInfoLogLevel(self.INFO1)
@@ -307,6 +306,7 @@ class Logger:
         if level > self.INFO_MAX:
             level = self.INFO_MAX
         self._level[domain] = level
+        self._genEnabled(is_debug=0)
 
     def getDebugLogLevel(self, domain="*"):
         """ Get debug log level. """
@@ -323,6 +323,7 @@ class Logger:
         if level > self.DEBUG_MAX:
             level = self.DEBUG_MAX
         self._debug_level[domain] = level - self.NO_DEBUG
+        self._genEnabled(is_debug=1)
 
     def getFormat(self):
         return self._format
@@ -423,6 +424,8 @@ class Logger:
         There are additional infox functions according to info_max from
         __init__"""
         self._checkLogLevel(level, min=1, max=self.INFO_MAX)
+        if not self._enabled.has_key(level+self.NO_INFO):
+            return
         self._checkKWargs(kwargs)
         kwargs["is_debug"] = 0
         self._log(level+self.NO_INFO, format, *args, **kwargs)
@@ -432,6 +435,8 @@ class Logger:
         There are additional debugx functions according to debug_max
         from __init__"""
         self._checkLogLevel(level, min=1, max=self.DEBUG_MAX)
+        if not self._debug_enabled.has_key(level):
+            return
         self._checkKWargs(kwargs)
         kwargs["is_debug"] = 1
         self._log(level, format, *args, **kwargs)
@@ -476,6 +481,23 @@ class Logger:
                 levels = [ i for i in xrange(self.FATAL, self.INFO_MAX) ]
         return levels
 
+    def _genLogFunction(self, level, is_debug=0):
+        """ Generate infox or debugx function for level. The function
+        returns at once if there is no logging for level at all. """
+        if is_debug:
+            _enabled = self._debug_enabled
+            _log = self.debug
+            _key = level
+        else:
+            _enabled = self._enabled
+            _log = self.info
+            _key = level + self.NO_INFO
+
+        def _logfunc(message, *args, **kwargs):
+            if _enabled.has_key(_key):
+                _log(level, message, *args, **kwargs)
+        return _logfunc
+
     def _getTargets(self, target):
         """ Generate target array. """
         if isinstance(target, types.ListType) or \
@@ -510,6 +532,27 @@ class Logger:
             for (domain, target, _format) in _logging[level]:
                 if domain not in _domains:
                     _domains.setdefault(level, [ ]).append(domain)
+        self._genEnabled(is_debug)
+
+    def _genEnabled(self, is_debug=0):
+        # private method for self._enabled creation, lets the log functions
+        # return without any frame inspection for disabled levels
+        """ Generate dict of levels with logging for any domain. """
+        if is_debug:
+            _enabled = self._debug_enabled
+            _dict = self._debug_level
+            _domains = self._debug_domains
+        else:
+            _enabled = self._enabled
+            _dict = self._level
+            _domains = self._domains
+
+        _enabled.clear()
+        for level in _domains:
+            for domain in _dict:
+                if _dict[domain] >= level:
+                    _enabled[level] = True
+                    break
 
     def _setLogging(self, domain, target, level=ALL, fmt=None, is_debug=0):
         self._checkDomain(domain)
@@ -567,6 +610,13 @@ class Logger:
         self._genDomains(is_debug)
 
     def _isLoggingHere(self, level, is_debug=0):
+        if is_debug:
+            _enabled = self._debug_enabled
+        else:
+            _enabled = self._enabled
+        if not _enabled.has_key(level):
+            return False
+
         dict = self._genDict(level, is_debug)
         if not dict:
             return False
@@ -618,6 +668,18 @@ class Logger:
         # nothing found
         return None
 
+    def _getClassName(self, frame):
+        """ Get name of calling class, empty if there is none. The result
+        is cached by code object. """
+        code = frame.f_code
+        if not self._code_classes.has_key(code):
+            obj = self._getClass(frame)
+            if obj:
+                self._code_classes[code] = obj.__name__
+            else:
+                self._code_classes[code] = ""
+        return self._code_classes[code]
+
     def _getClass2(self, obj, code):
         """ Internal function to get calling class. Returns class or None. """
         for value in obj.__dict__.values():
@@ -637,6 +699,17 @@ class Logger:
         if kwargs.has_key("is_debug"):
             is_debug = kwargs["is_debug"]
 
+        if is_debug:
+            _logging = self._debug_logging
+            _enabled = self._debug_enabled
+        else:
+            _logging = self._logging
+            _enabled = self._enabled
+
+        # no logging for this level at all
+        if not _enabled.has_key(level):
+            return
+
         nl = 1
         if kwargs.has_key("nl"):
             nl = kwargs["nl"]
@@ -649,20 +722,8 @@ class Logger:
         if not dict:
             return
 
-        if len(args) > 1:
-            dict['message'] = format % args
-        elif len(args) == 1:  # needed for format % dict
-            dict['message'] = format % args[0]
-        else:
-            dict['message'] = format
-
         point_domain = dict["domain"] + "."
 
-        if is_debug:
-            _logging = self._debug_logging
-        else:
-            _logging = self._logging
-
         used_targets = [ ]
         # log to target(s)
         for (domain, target, _format) in _logging[level]:
@@ -675,6 +736,18 @@ class Logger:
                     _format = self._format
                 if kwargs.has_key("fmt"):
                     _format = kwargs["fmt"]
+                # format message and date only if they are written
+                if not dict.has_key("message"):
+                    if len(args) > 1:
+                        dict['message'] = format % args
+                    elif len(args) == 1:  # needed for format % dict
+                        dict['message'] = format % args[0]
+                    else:
+                        dict['message'] = format
+                if not nofmt and not dict.has_key("date") and \
+                       _format.find("%(date)") >= 0:
+                    dict["date"] = time.strftime(self._date_format,
+                                                 time.localtime())
                 if nofmt:
                     target.write(dict["message"], level, self, is_debug)
                 else:
@@ -768,8 +841,7 @@ class Logger:
                  'function': co.co_name,
                  'domain': '',
                  'label' : level_str,
-                 'level' : level,
-                 'date' : time.strftime(self._date_format, time.localtime()) }
+                 'level' : level }
         if dict["function"] == "?":
             dict["function"] = ""
 
@@ -788,9 +860,7 @@ class Logger:
                self._format.find("%(class)") >= 0 or \
                domain_needed or \
                len(check_domains) > 0:
-            obj = self._getClass(f)
-            if obj:
-                dict["class"] = obj.__name__
+            dict["class"] = self._getClassName(f)
 
         # build domain string
         dict["domain"] = "" + dict["module"]
@@ -676,6 +676,9 @@ class RpmOrderer:
                         self.erases.remove(p)
         self.installdb = installdb
         self.erasedb = erasedb
+        # Installed RpmPackage => [RpmPackage's it requires], from the
+        # relations before ordering
+        self.prereqs = { }
 
     # ----
 
@@ -730,6 +733,8 @@ class RpmOrderer:
                 # generate relations
                 relations = RpmRelations(self.config, self.installs,
                                          OP_INSTALL, self.installdb)
+                for (pkg, rel) in relations.iteritems():
+                    self.prereqs[pkg] = [p for p in rel.pre if p is not None]
 
                 # order package list
                 order2 = relations.genOrder()
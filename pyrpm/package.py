@@ -23,9 +23,12 @@ from pyrpm.io import getRpmIOFactory
 from base import *
 import elf
 import functions
+import filestore
+from installfs import InstallFS
 from hashlist import HashList
 import openpgp
 from pyrpm.logger import log
+from pyrpm.profiling import profiler
 import se_linux
 
 class _RpmFilenamesIterator:
@@ -400,12 +403,14 @@ class RpmPackage(RpmData):
                 return r
         return 0
 
-    def install(self, db=None, tags=None, ntags=None, buildroot=''):
+    def install(self, db=None, tags=None, ntags=None, buildroot='',
+                extract=True):
         """Open package, read its header and install it.
 
         Use RpmDatabase db for getting information, don't modify it.  Run
-        specified scripts, but no triggers.  Raise ValueError on invalid
-        package data, IOError, OSError."""
+        specified scripts, but no triggers.  Don't extract the files if not
+        extract, they were extracted by extractFiles() already.  Raise
+        ValueError on invalid package data, IOError, OSError."""
 
         self.open()
         self.__readHeader(tags, ntags)
@@ -414,6 +419,8 @@ class RpmPackage(RpmData):
         if self["preinprog"] != None or self["postinprog"] != None:
             numPkgs = str(len(db.getPkgsByName(self["name"]))+1)
         if self["preinprog"] != None and not self.config.noscripts:
+            if profiler.enabled:
+                ptime = profiler.start()
             try:
                 (status, rusage, output) = functions.runScript(
                     self["preinprog"], self["prein"], [numPkgs],
@@ -429,9 +436,16 @@ class RpmPackage(RpmData):
                     log.error("Output running pre install script for "
                               "package %s", self.getNEVRA())
                     log.error(output, nofmt=1)
-        self.__extract(db, pathPrefix=buildroot)
+            if profiler.enabled:
+                profiler.stop("scriptlet.prein", ptime, self.getNEVRA())
+        if extract:
+            self.__extract(db, pathPrefix=buildroot)
+        else:
+            log.info2("", nofmt=1)
         # Don't fail if the post script fails, just print out an error
         if self["postinprog"] != None and not self.config.noscripts:
+            if profiler.enabled:
+                ptime = profiler.start()
             try:
                 (status, rusage, output) = functions.runScript(
                     self["postinprog"], self["postin"], [numPkgs],
@@ -446,6 +460,20 @@ class RpmPackage(RpmData):
                     log.error("Output running post install script for "
                               "package %s", self.getNEVRA())
                     log.error(output, nofmt=1)
+            if profiler.enabled:
+                profiler.stop("scriptlet.postin", ptime, self.getNEVRA())
+
+    def extractFiles(self, db=None, buildroot=''):
+        """Open package, read its header and extract its files for
+        installation, without running any scripts.
+
+        Use RpmDatabase db for getting information, don't modify it.  Raise
+        ValueError on invalid package data, IOError, OSError."""
+
+        self.open()
+        self.__readHeader()
+        os.umask(022)
+        self.__extract(db, pathPrefix=buildroot)
 
     def erase(self, db=None, buildroot=''):
         """Open package, read its header and remove it.
@@ -462,6 +490,8 @@ class RpmPackage(RpmData):
         if self["preunprog"] != None or self["postunprog"] != None:
             numPkgs = str(len(db.getPkgsByName(self["name"]))-1)
         if self["preunprog"] != None and not self.config.noscripts:
+            if profiler.enabled:
+                ptime = profiler.start()
             try:
                 (status, rusage, output) = functions.runScript(
                     self["preunprog"], self["preun"], [numPkgs],
@@ -476,6 +506,8 @@ class RpmPackage(RpmData):
                 log.error("Output running pre uninstall script for "
                           "package %s", self.getNEVRA())
                 log.error(output, nofmt=1)
+            if profiler.enabled:
+                profiler.stop("scriptlet.preun", ptime, self.getNEVRA())
         # Generate the rpmfileinfo list, needed for erase verification
         rfilist = self.__generateFileInfoList()
         # Remove files starting from the end (reverse process to install)
@@ -552,6 +584,8 @@ class RpmPackage(RpmData):
             return
         # Don't fail if the post script fails, just print out an error
         if self["postunprog"] != None and not self.config.noscripts:
+            if profiler.enabled:
+                ptime = profiler.start()
             try:
                 (status, rusage, output) = functions.runScript(
                     self["postunprog"], self["postun"], [numPkgs],
@@ -565,6 +599,8 @@ class RpmPackage(RpmData):
                 log.error("Output running post uninstall script for "
                           "package %s", self.getNEVRA())
                 log.error(output, nofmt=1)
+            if profiler.enabled:
+                profiler.stop("scriptlet.postun", ptime, self.getNEVRA())
 
     def verify(self, db, resolver):
         """Verify a package, using db for multilib conflict resolution and
@@ -865,7 +901,6 @@ class RpmPackage(RpmData):
         # before we actually start extracting files.
         rfilist = self.__generateFileInfoList()
         self.hardlinks = {}
-        (filename, cpio, filesize) = self.io.read()
         n = 0
         pos = 0
         issrc = self.isSourceRPM()
@@ -875,6 +910,31 @@ class RpmPackage(RpmData):
                 useSEcontext = False
         if useSEcontext is None:
             useSEcontext = self.config.selinux_enabled
+        store = None
+        if not issrc:
+            store = filestore.getFileStore(self.config)
+        fs = InstallFS()
+        if store is not None and store.hasAll(rfilist.itervalues()):
+            # All file data is in the store, don't read the payload
+            files = [(filename, rfi) for (filename, rfi) in rfilist.iteritems()
+                     if rfi.flags & RPMFILE_GHOST == 0]
+            files.sort()
+            files.append(("EOF", None))
+            files.reverse()
+            # Number of files left in each set of hard links; as in the
+            # payload, the last one gets the data
+            links = {}
+            for (filename, rfi) in files[1:]:
+                if stat.S_ISREG(rfi.mode) and rfi.filesize > 0:
+                    key = rfi.getHardLinkID()
+                    links[key] = links.get(key, 0) + 1
+            (filename, rfi) = files.pop()
+            (cpio, filesize) = (None, 0)
+            if profiler.enabled:
+                profiler.count("filestore.packages")
+        else:
+            files = None
+            (filename, cpio, filesize) = self.io.read()
         if self.config.printhash:
             log.info2("\r\t\t\t\t\t\t ", nl=0, nofmt=1)
         while filename != "EOF":
@@ -887,6 +947,13 @@ class RpmPackage(RpmData):
                 # src.rpm has empty tag "dirnames", but we use absolut paths in
                 # io.read(), so at least the directory '/' is there ...
                 filename = filename[1:]
+            if files is not None:
+                filesize = 0
+                if stat.S_ISREG(rfi.mode) and rfi.filesize > 0:
+                    key = rfi.getHardLinkID()
+                    links[key] -= 1
+                    if links[key] == 0:
+                        filesize = rfi.filesize
             if rfilist.has_key(filename):
                 rfi = rfilist[filename]
                 if self.__verifyFileInstall(rfi, db, pathPrefix=pathPrefix):
@@ -895,29 +962,39 @@ class RpmPackage(RpmData):
                     else:
                         functions.installFile(rfi, cpio, filesize, useAttrs,
                                               pathPrefix = pathPrefix,
-                                              useSEcontext = useSEcontext)
+                                              useSEcontext = useSEcontext,
+                                              store = store, fs = fs)
                         # Many scripts have problems like e.g. openssh is
                         # stopping all sshd (also outside of a chroot if
                         # it is de-installed. Real hacky workaround:
                         if pathPrefix is None and self.config.service \
                                and filename == "/sbin/service":
                             open("/sbin/service", "wb").write("exit 0\n")
-                        self.__handleHardlinks(rfi, pathPrefix)
+                        self.__handleHardlinks(rfi, pathPrefix, fs)
                 else:
-                    cpio.skipToNextFile()
+                    if cpio is not None:
+                        cpio.skipToNextFile()
                     if filesize > 0:
                         # FIXME: If other hard links are installed, the data
                         # is lost.
                         self.__removeHardlinks(rfi)
             # FIXME: else report error?
-            (filename, cpio, filesize) = self.io.read()
+            if files is not None:
+                (filename, rfi) = files.pop()
+            else:
+                (filename, cpio, filesize) = self.io.read()
         if nfiles == 0:
             nfiles = 1
         if self.config.printhash:
             log.info2("#"*(30-int(30*n/nfiles)), nofmt=1)
         else:
             log.info2('', nofmt=1)
-        self.__handleRemainingHardlinks(useAttrs, pathPrefix, useSEcontext)
+        self.__handleRemainingHardlinks(useAttrs, pathPrefix, useSEcontext,
+                                        fs)
+        log.debug1("%s: %s", self.getNEVRA(), fs.report())
+        if profiler.enabled:
+            for (name, value) in fs.counts.iteritems():
+                profiler.count("syscalls.%s" % name, value)
 
     def __verifyFileInstall(self, rfi, db, pathPrefix=''):
         """Return 1 if file with RpmFileInfo rfi should be installed.
@@ -1099,9 +1176,9 @@ class RpmPackage(RpmData):
         key = rfi.getHardLinkID()
         self.hardlinks.setdefault(key, []).append(rfi)
 
-    def __handleHardlinks(self, rfi, pathPrefix):
+    def __handleHardlinks(self, rfi, pathPrefix, fs):
         """Create hard links to RpmFileInfo rfi if specified so in
-        self.hardlinks.
+        self.hardlinks, using InstallFS fs.
 
         Raise IOError, OSError.  Prefix filenames by pathPrefix if defined."""
 
@@ -1115,7 +1192,8 @@ class RpmPackage(RpmData):
             if pathPrefix is not None:
                 src = pathPrefix + src
                 dest = pathPrefix + dest
-            functions.makeDirs(dest)
+            fs.makeDirs(dest)
+            fs.count("link")
             functions.createLink(src, dest)
         del self.hardlinks[key]
 
@@ -1126,8 +1204,10 @@ class RpmPackage(RpmData):
         if key in self.hardlinks:
             del self.hardlinks[key]
 
-    def __handleRemainingHardlinks(self, useAttrs, pathPrefix, useSEcontext):
-        """Create empty hard-linked files according to self.hardlinks.
+    def __handleRemainingHardlinks(self, useAttrs, pathPrefix, useSEcontext,
+                                   fs):
+        """Create empty hard-linked files according to self.hardlinks, using
+        InstallFS fs.
 
         Ignore file attributes if not useAttrs.  Prefix filenames by pathPrefix
         if defined.  Raise ValueError on invalid package data, IOError,
@@ -1137,8 +1217,8 @@ class RpmPackage(RpmData):
             rfi = self.hardlinks[key].pop(0)
             functions.installFile(rfi, None, 0, useAttrs,
                                   pathPrefix = pathPrefix,
-                                  useSEcontext = useSEcontext)
-            self.__handleHardlinks(rfi, pathPrefix)
+                                  useSEcontext = useSEcontext, fs = fs)
+            self.__handleHardlinks(rfi, pathPrefix, fs)
 
     def getRpmFileInfo(self, filename, i=None):
         """Return RpmFileInfo describing filename, or None if this package does
@@ -0,0 +1,138 @@
+#
+# Copyright (C) 2007 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as published by
+# the Free Software Foundation; version 2 only
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import time, atexit
+from logger import log
+
+class Profiler:
+    """Named timers and counters for the phases of a run, written as a JSON
+    report at exit.
+
+    Callers check Profiler.enabled before taking any time, so disabled
+    profiling costs a single attribute lookup:
+
+    if profiler.enabled:
+        ptime = profiler.start()
+    ...
+    if profiler.enabled:
+        profiler.stop("install", ptime, pkg.getNEVRA())"""
+
+    def __init__(self):
+        self.enabled = 0
+        self.filename = None
+        self.timers = { }               # name => [calls, seconds]
+        self.items = { }                # name => { item => seconds }
+        self.counters = { }             # name => value
+
+    def enable(self, filename):
+        """Start collecting data, write the report to filename at exit."""
+
+        if not self.enabled:
+            atexit.register(self.writeReport)
+        self.enabled = 1
+        self.filename = filename
+
+    def start(self):
+        """Return a start value for stop()."""
+
+        return time.time()
+
+    def stop(self, name, start, item=None):
+        """Add the wall clock time since start (from start()) to timer name,
+        and to the breakdown of timer name by item if item is not None."""
+
+        self.add(name, time.time() - start, item)
+
+    def add(self, name, seconds, item=None):
+        """Add seconds to timer name, and to the breakdown of timer name by
+        item if item is not None."""
+
+        timer = self.timers.setdefault(name, [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+        if item is not None:
+            items = self.items.setdefault(name, { })
+            items[item] = items.get(item, 0.0) + seconds
+
+    def count(self, name, value=1):
+        """Add value to counter name."""
+
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        """Return the collected data as a JSON document."""
+
+        timers = { }
+        for (name, (calls, seconds)) in self.timers.iteritems():
+            timer = { "calls": calls, "seconds": seconds }
+            if self.items.has_key(name):
+                timer["items"] = self.items[name]
+            timers[name] = timer
+        return toJSON({ "timers": timers, "counters": self.counters }) + "\n"
+
+    def writeReport(self, filename=None):
+        """Write report() to filename, or the file from enable().
+
+        Return 1 on success, 0 on error (after warning the user)."""
+
+        if filename is None:
+            filename = self.filename
+        try:
+            fd = open(filename, "w")
+            try:
+                fd.write(self.report())
+            finally:
+                fd.close()
+        except IOError, e:
+            log.error("Couldn't write profile %s: %s", filename, e)
+            return 0
+        return 1
+
+_json_escapes = { '"': '\\"', "\\": "\\\\", "\n": "\\n", "\r": "\\r",
+                  "\t": "\\t" }
+
+def toJSON(obj, indent=""):
+    """Return obj (dict, string, int or float) as a JSON string."""
+
+    if isinstance(obj, dict):
+        if not obj:
+            return "{}"
+        inner = indent + "  "
+        keys = obj.keys()
+        keys.sort()
+        entries = [ "%s%s: %s" % (inner, toJSON(str(key)),
+                                  toJSON(obj[key], inner))
+                    for key in keys ]
+        return "{\n%s\n%s}" % (",\n".join(entries), indent)
+    if isinstance(obj, basestring):
+        s = [ ]
+        for c in obj:
+            if _json_escapes.has_key(c):
+                s.append(_json_escapes[c])
+            elif ord(c) < 0x20:
+                s.append("\\u%04x" % ord(c))
+            else:
+                s.append(c)
+        return '"%s"' % "".join(s)
+    if isinstance(obj, float):
+        return "%.6f" % obj
+    return str(obj)
+
+# Global profiler object.
+profiler = Profiler()
+
+# vim:ts=4:sw=4:showmatch:expandtab
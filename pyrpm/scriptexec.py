@@ -0,0 +1,177 @@
+#
+# Copyright (C) 2007 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as published by
+# the Free Software Foundation; version 2 only
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""Run scripts from a small helper process that stays in a chroot.
+
+Forking the main process for every script copies the page tables of the
+whole resolver heap.  ScriptExecutor starts this file once per chroot in a
+fresh Python interpreter, which changes its root and then forks and execs
+the scripts it receives over a pipe.
+
+This module is also run as a program, so it may only import standard
+modules."""
+
+import fcntl, marshal, os, os.path, resource, signal, sys
+
+# Signals reset to the default action in scripts
+_signals = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGPIPE,
+            signal.SIGQUIT)
+
+class ScriptExecutor:
+    """A helper process that runs scripts with root directory chroot."""
+
+    def __init__(self, chroot):
+        self.chroot = chroot
+        (rfd, self.wfd) = os.pipe()     # Requests
+        (self.rfd, wfd) = os.pipe()     # Results
+        for fd in (self.rfd, self.wfd):
+            fcntl.fcntl(fd, fcntl.F_SETFD,
+                        fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        program = os.path.splitext(__file__)[0] + ".py"
+        if not os.path.exists(program):
+            program = __file__
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                for fd in (rfd, wfd):
+                    fcntl.fcntl(fd, fcntl.F_SETFD,
+                                fcntl.fcntl(fd, fcntl.F_GETFD) &
+                                ~fcntl.FD_CLOEXEC)
+                os.execv(sys.executable, [sys.executable, "-S", "-E", program,
+                                          str(rfd), str(wfd), chroot or "/"])
+            finally:
+                os._exit(255)
+        os.close(rfd)
+        os.close(wfd)
+        self.input = os.fdopen(self.rfd, "rb")
+        self.output = os.fdopen(self.wfd, "wb")
+
+    def send(self, args, env, rusage=False):
+        """Start program args[0] with arguments args and environment dict env
+        in the chroot, with stdin from /dev/null.
+
+        The program has not been started if this raises IOError, ValueError.
+        Use receive() for the result."""
+
+        marshal.dump((list(args), env, bool(rusage)), self.output)
+        self.output.flush()
+
+    def receive(self):
+        """Wait for the program started by send().
+
+        Return (exit status, getrusage() stats, output) as runScript().  Raise
+        IOError if the helper process failed, OSError if it could not start
+        the program."""
+
+        try:
+            result = marshal.load(self.input)
+        except (EOFError, ValueError, TypeError), e:
+            raise IOError, "script executor failed: %s" % e
+        if result[0] is None:
+            raise OSError, result[2]
+        return result
+
+    def close(self):
+        """Stop the helper process."""
+
+        if self.pid is None:
+            return
+        try:
+            self.output.close()
+        except IOError:
+            pass
+        self.input.close()
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+        self.pid = None
+
+
+def _run(args, env, rusage):
+    """Run args with env, return (status, rusage, output)."""
+
+    if not os.path.exists("/dev"):
+        os.mkdir("/dev")
+    if not os.path.exists("/dev/null"):
+        os.mknod("/dev/null", 0666, 259)
+    (rfd, wfd) = os.pipe()
+    if rusage:
+        rusage_old = resource.getrusage(resource.RUSAGE_CHILDREN)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(rfd)
+            for sig in _signals:
+                signal.signal(sig, signal.SIG_DFL)
+            fd = os.open("/dev/null", os.O_RDONLY)
+            if fd != 0:
+                os.dup2(fd, 0)
+                os.close(fd)
+            if wfd != 1:
+                os.dup2(wfd, 1)
+                os.close(wfd)
+            os.dup2(1, 2)
+            os.execve(args[0], args, env)
+        finally:
+            os._exit(255)
+    os.close(wfd)
+    output = [ ]
+    data = os.read(rfd, 8192)
+    while data:
+        output.append(data)
+        data = os.read(rfd, 8192)
+    os.close(rfd)
+    (cpid, status) = os.waitpid(pid, 0)
+    rusage_val = None
+    if rusage:
+        rusage_new = resource.getrusage(resource.RUSAGE_CHILDREN)
+        rusage_val = [rusage_new[i] - rusage_old[i]
+                      for i in xrange(len(rusage_new))]
+    return (status, rusage_val, "".join(output))
+
+def _serve(rfd, wfd, chroot):
+    """Run the requests from rfd in chroot, write the results to wfd."""
+
+    for fd in (rfd, wfd):
+        fcntl.fcntl(fd, fcntl.F_SETFD,
+                    fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+    input = os.fdopen(rfd, "rb")
+    output = os.fdopen(wfd, "wb")
+    # The main process decides what to do on Ctrl-C, but the helper can be
+    # terminated like any other process keeping a file system busy
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.umask(022)
+    if chroot != "/":
+        os.chroot(chroot)
+    os.chdir("/")
+    while True:
+        try:
+            (args, env, rusage) = marshal.load(input)
+        except EOFError:
+            break
+        try:
+            result = _run(args, env, rusage)
+        except (IOError, OSError), e:
+            result = (None, None, str(e))
+        marshal.dump(result, output)
+        output.flush()
+
+if __name__ == "__main__":
+    _serve(int(sys.argv[1]), int(sys.argv[2]), sys.argv[3])
+
+# vim:ts=4:sw=4:showmatch:expandtab
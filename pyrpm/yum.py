@@ -19,18 +19,23 @@
 #
 
 
-import os, os.path, glob, re, fnmatch
+import os, os.path, glob, re, fnmatch, threading, Queue, heapq
 from time import clock, time
+# pyrpm.io exports the time module as time
+from time import time as _now
 from pyrpm.resolver import RpmResolver
 from pyrpm.control import RpmController
 from pyrpm.functions import *
 from pyrpm.io import *
 import pyrpm.database as database
 import pyrpm.database.repodb
+import pyrpm.database.lrucache as lrucache
 # from pyrpm.database.repodb import RpmRepoDB
 from pyrpm.database.jointdb import JointDB
+from pyrpm.database.lists import rankSearch
 from pyrpm.database.rhndb import RhnRepoDB
 from pyrpm.logger import log
+from pyrpm.profiling import profiler
 
 MainVarnames = ("cachedir", "reposdir", "debuglevel", "errorlevel",
         "logfile", "gpgcheck", "assumeyes", "alwaysprompt", "tolerant",
@@ -175,6 +180,11 @@ class RpmYum:
         self.command = None
         # List of RpmRepo's
         self.repos = JointDB(config, "Yum repos")
+        # Update candidates of self.repos: (name, basearch) => packages with
+        # newest first, name => basearchs, and the repos it was built for
+        self.__updateindex = None
+        self.__updatearchs = None
+        self.__updateindexdbs = None
         # List of languages we want to install for.
         self.langs = [ ]
         # Flag if RHN support is enabled or not. True by default
@@ -283,6 +293,7 @@ class RpmYum:
             ritem = fnmatch.translate(ritem)
             regex = re.compile(ritem)
             drepo.append(regex)
+        repos = [ ]
         for key in conf.keys():
             sec = conf[key]
             if key == "main":
@@ -308,18 +319,73 @@ class RpmYum:
                 # Repo is not enabled: skip it.
                 if not enabled:
                     continue
-                if self.config.timer:
-                    time1 = clock()
-                log.info2("Reading repository '%s'", key)
-                repo = database.getRepoDB(self.config, conf, self.config.buildroot, key)
-                if repo.read() == 0:
-                    log.error("Error reading repository %s", key)
-                    return 0
-                self.repos.addDB(repo)
-                if self.config.timer:
-                    log.info2("Reading repository took %s seconds",
-                        (clock() - time1))
-        return 1
+                repos.append(database.getRepoDB(self.config, conf,
+                                                self.config.buildroot, key))
+        if self.config.timer:
+            time1 = _now()
+        results = self.__readRepos(repos)
+        # Add the repositories in configuration order, independent of the
+        # order in which they finished reading.
+        ret = 1
+        for (repo, (result, seconds)) in zip(repos, results):
+            if result == 0:
+                log.error("Error reading repository %s", repo.reponame)
+                ret = 0
+                continue
+            self.repos.addDB(repo)
+        if self.config.timer:
+            for (repo, (result, seconds)) in zip(repos, results):
+                log.info2("Reading repository '%s' took %.2f seconds",
+                          repo.reponame, seconds)
+            log.info2("Reading all repositories took %.2f seconds",
+                      (_now() - time1))
+        if profiler.enabled:
+            for (repo, (result, seconds)) in zip(repos, results):
+                profiler.add("yum.readrepo", seconds, repo.reponame)
+        return ret
+
+    def __readRepos(self, repos):
+        """Read all repositories in repos using up to config.repothreads
+        threads, so network transfers and parsing of different repositories
+        overlap.
+
+        Return a list of (read() result, seconds) in the order of repos."""
+
+        results = [ (0, 0.0) ] * len(repos)
+        queue = Queue.Queue()
+        for idx in xrange(len(repos)):
+            queue.put(idx)
+
+        def worker():
+            while True:
+                try:
+                    idx = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                repo = repos[idx]
+                log.info2("Reading repository '%s'", repo.reponame)
+                time1 = _now()
+                try:
+                    result = repo.read()
+                except Exception, e:
+                    log.error("Error reading repository %s: %s",
+                              repo.reponame, e)
+                    result = 0
+                results[idx] = (result, _now() - time1)
+
+        nthreads = min(self.config.repothreads, len(repos))
+        if nthreads <= 1:
+            worker()
+            return results
+        threads = [ ]
+        for i in xrange(nthreads):
+            thread = threading.Thread(target=worker)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return results
 
     def prepareTransaction(self, localDb=None):
         """Open the RPM database and prepare the transaction.
@@ -570,6 +636,67 @@ class RpmYum:
                 l.append(p)
         return l
 
+    def __getUpdateIndex(self):
+        # (Re)build the update candidate index if the repositories changed
+        if self.__updateindex is not None and \
+               self.__updateindexdbs == self.repos.dbs:
+            return self.__updateindex
+        if self.config.timer:
+            time1 = clock()
+        index = { }
+        archs = { }
+        for pkg in self.repos.getPkgs():
+            name = pkg["name"]
+            basearch = buildarchtranslate.get(pkg["arch"], pkg["arch"])
+            if not index.has_key((name, basearch)):
+                index[(name, basearch)] = [ ]
+                archs.setdefault(name, [ ]).append(basearch)
+            index[(name, basearch)].append(pkg)
+        for pkgs in index.itervalues():
+            pkgs.sort(lambda p1, p2: pkgCompare(p2, p1))
+        self.__updateindex = index
+        self.__updatearchs = archs
+        self.__updateindexdbs = self.repos.dbs[:]
+        if self.config.timer:
+            log.info2("Building update index took %s seconds",
+                      (clock() - time1))
+        return index
+
+    def getUpdateCandidates(self, ipkg):
+        """Return the repository packages newer than installed RpmPackage
+        ipkg that update() could select for it, newest first for each base
+        arch."""
+
+        index = self.__getUpdateIndex()
+        name = ipkg["name"]
+        arch = ipkg["arch"]
+        # Same rules as update(): noarch packages and non-exactarch updates
+        # may switch archs, exactarch only allows arch -> noarch.
+        exactarch = self.config.exactarch and arch != "noarch"
+        if exactarch:
+            basearchs = (buildarchtranslate.get(arch, arch), "noarch")
+        else:
+            basearchs = self.__updatearchs.get(name, ())
+        result = [ ]
+        for basearch in basearchs:
+            for pkg in index.get((name, basearch), ()):
+                if pkgCompare(ipkg, pkg) >= 0:
+                    break
+                if exactarch and pkg["arch"] != arch and \
+                       pkg["arch"] != "noarch":
+                    continue
+                result.append(pkg)
+        return result
+
+    def __hasUpdateCandidates(self, name):
+        # update(name, exact=True) can only select something if this is true
+        if name in self.always_install:
+            return True
+        for ipkg in self.opresolver.getDatabase().getPkgsByName(name):
+            if self.getUpdateCandidates(ipkg):
+                return True
+        return False
+
     def groupUpdate(self, name, exact=False):
         args = self.getGroupPackages(name)
         ret = 0
@@ -723,7 +850,8 @@ class RpmYum:
                 # For complete updates we need to do a full obsoletes run, not
                 # on a specific package.
                 for name in self.opresolver.getDatabase().getNames():
-                    self.update(name, exact=True, do_obsolete=False)
+                    if self.__hasUpdateCandidates(name):
+                        self.update(name, exact=True, do_obsolete=False)
                 #self.__handleObsoletes()
         # Select proper function to be called for every argument. We have
         # a fixed operation for runArgs(), so use a reference to the
@@ -835,10 +963,29 @@ class RpmYum:
         ret = 1
         if self.config.timer:
             time1 = clock()
+        if profiler.enabled:
+            ptime = profiler.start()
         if not self.config.nodeps:
             ret = self.__runDepResolution()
         if self.config.timer:
             log.info2("runDepRes() took %s seconds", (clock() - time1))
+            for (name, db) in (("transaction", self.opresolver.getDatabase()),
+                               ("repositories", self.repos)):
+                (hits, misses) = db.getDependencyCacheStats()
+                log.info2("searchDependency() cache of %s: %d hits, "
+                          "%d misses", name, hits, misses)
+            lrucache.logCacheStats()
+        if profiler.enabled:
+            profiler.stop("yum.depres", ptime)
+            for db in (self.opresolver.getDatabase(), self.repos):
+                (hits, misses) = db.getDependencyCacheStats()
+                profiler.count("depcache.hits", hits)
+                profiler.count("depcache.misses", misses)
+            for cache in lrucache.getCaches():
+                (hits, misses, evictions, entries, weight) = cache.stats()
+                profiler.count("cache.%s.hits" % cache.name, hits)
+                profiler.count("cache.%s.misses" % cache.name, misses)
+                profiler.count("cache.%s.evictions" % cache.name, evictions)
         return ret
 
     def runCommand(self, clearrepos=False):
@@ -1067,6 +1214,38 @@ class RpmYum:
             nlist.append(pkg)
             nhash[pkg["name"]] = 1
         self.__obsoleteslist = nlist
+        # Reverse index: obsoleted name =>
+        # [(order, number, RpmPackage, obsolete)], order is the position of
+        # the package in self.__obsoleteslist, number identifies the entry
+        self.__obsoletesindex = { }
+        self.__obsoletesfiles = [ ]
+        number = 0
+        for order in xrange(len(nlist)):
+            pkg = nlist[order]
+            for u in pkg["obsoletes"]:
+                if not self.__obsoletesindex.has_key(u[0]):
+                    self.__obsoletesindex[u[0]] = [ ]
+                    if u[0][0] == "/":
+                        self.__obsoletesfiles.append(u[0])
+                self.__obsoletesindex[u[0]].append((order, number, pkg, u))
+                number += 1
+
+    def __getObsoletedNames(self, pkgs):
+        # Names in self.__obsoletesindex that can match RpmPackages pkgs
+        names = self.__obsoletesfiles[:]
+        for pkg in pkgs:
+            names.append(pkg["name"])
+            for (name, flag, version) in pkg["provides"] or ():
+                names.append(name)
+        return names
+
+    def __queueObsoletes(self, heap, queued, names):
+        # Push the obsoletes index entries for names that are not queued yet
+        for name in names:
+            for entry in self.__obsoletesindex.get(name, ()):
+                if not queued.has_key(entry[1]):
+                    queued[entry[1]] = None
+                    heapq.heappush(heap, entry)
 
     def __runDepResolution(self):
         """Try to resolve all dependencies and remove all conflicts..
@@ -1184,6 +1363,14 @@ class RpmYum:
                         log.info2("Importing filelist took %.2f seconds",
                                   (clock() - time1))
                     modified_repo = 1
+            # With the filelist index the complete file lists are only
+            # loaded for packages providing the file, including those
+            # already added to the transaction.
+            if self.config.filelistindex:
+                db = self.opresolver.getDatabase()
+                for upkg in self.repos.searchFilenames(dep[0]):
+                    if upkg in db:
+                        modified_repo = 1
             # In case we have modified at least one repository we now check if
             # by loading the filelist we already fullfilled the dependency in
             # case the package was already added to the transaction.
@@ -1308,75 +1495,74 @@ class RpmYum:
         namehash = { }
         for pkg in pkglist:
             namehash.setdefault(pkg["name"], [ ]).append(pkg)
+        db = self.opresolver.getDatabase()
+        # Entries of self.__obsoletesindex to check, best obsoleting package
+        # first. Only obsoletes of names provided by pkglist can apply in a
+        # partial run.
+        heap = [ ]
+        queued = { }
+        if full:
+            names = self.__obsoletesindex.keys()
+        else:
+            names = self.__getObsoletedNames(pkglist)
+        self.__queueObsoletes(heap, queued, names)
         # Loop until we have found the end of the obsolete chain
-        while 1:
-            found = False
-            # Go over all packages we know have obsoletes
-            for opkg in self.__obsoleteslist:
-                # If the obsolete package has already been tried once or is in
-                # our erase_list skip it.
-                if opkg in self.opkg_list or opkg in self.erase_list:
+        while heap:
+            entry = heapq.heappop(heap)
+            del queued[entry[1]]
+            (order, number, opkg, u) = entry
+            # If the obsolete package has already been tried once or is in
+            # our erase_list skip it.
+            if opkg in self.opkg_list or opkg in self.erase_list:
+                continue
+            # Never add obsolete packages for packages with the same name.
+            if len(pkglist) > 0:
+                if len(pkglist) == len(namehash.get(opkg["name"], [ ])):
                     continue
-                # Never add obsolete packages for packages with the same name.
-                if len(pkglist) > 0:
-                    if len(pkglist) == len(namehash.get(opkg["name"], [ ])):
-                        continue
-                # Go through all obsoletes
-                for u in opkg["obsoletes"]:
-                    # Reinit plist
-                    plist = [ ]
-                    # Look in our current database for matches
-                    s = self.opresolver.getDatabase().searchDependency(u[0], u[1], u[2])
-                    # If we got no results, we don't obsolete.
-                    if len(s) == 0:
-                        continue
-                    # Same as for the outer loop, if the package names match
-                    # we never obsolete.
-                    if s[0]["name"] == opkg["name"]:
-                        continue
-                    # In case of a full run we always obsolete if we found a
-                    # match. Otherwise if the packages for which we were
-                    # checking the obsoletes right now isn't in the list skip
-                    # it.
-                    if len(pkglist) > 0:
-                        for p in s:
-                            if p["name"] != opkg["name"] and p in pkglist:
-                                plist.append(p)
-                        if len(plist) == 0:
-                            continue
-                    # Found a matching obsoleting package. Try adding it to
-                    # our opresolver with an update so it obsoletes the
-                    # installed package
-                    ret = self.opresolver.update(opkg)
-                    # If it has already been added before readd it by erasing
-                    # it and adding it again. This will ensure that the
-                    # obsoleting will occur in the resolver.
-                    if ret == self.opresolver.ALREADY_ADDED:
-                        self.opresolver.erase(opkg)
-                        ret = self.opresolver.update(opkg)
-                    # If everything went well note this and terminate the
-                    # inner obsoletes loop
-                    if ret > 0:
-                        obsoleted = True
-                        found = True
-                        break
-                # If we found and handled one obsolete proplerly break the
-                # loop over the obsoletes packages and restart
-                if found:
-                    break
-            # In case we found an obsolete in the last round replace the package
-            # we're trying to obsolete with the one we just added if we had an
-            # initial package. If we need to do a full run reset the package to
-            # None. The just do another iteration.
-            # If nothing was found we're finished and can return.
-            if found:
-                self.opkg_list.append(opkg)
-                if not full:
-                    pkglist.append(opkg)
-                    for p in plist:
-                        pkglist.remove(p)
-            else:
-                break
+            # Reinit plist
+            plist = [ ]
+            # Look in our current database for matches
+            s = db.searchDependency(u[0], u[1], u[2])
+            # If we got no results, we don't obsolete.
+            if len(s) == 0:
+                continue
+            # Same as for the package itself, if the package names match
+            # we never obsolete.
+            if s[0]["name"] == opkg["name"]:
+                continue
+            # In case of a full run we always obsolete if we found a
+            # match. Otherwise if the packages for which we were
+            # checking the obsoletes right now isn't in the list skip
+            # it.
+            if len(pkglist) > 0:
+                for p in s:
+                    if p["name"] != opkg["name"] and p in pkglist:
+                        plist.append(p)
+                if len(plist) == 0:
+                    continue
+            # Found a matching obsoleting package. Try adding it to
+            # our opresolver with an update so it obsoletes the
+            # installed package
+            ret = self.opresolver.update(opkg)
+            # If it has already been added before readd it by erasing
+            # it and adding it again. This will ensure that the
+            # obsoleting will occur in the resolver.
+            if ret == self.opresolver.ALREADY_ADDED:
+                self.opresolver.erase(opkg)
+                ret = self.opresolver.update(opkg)
+            if ret <= 0:
+                continue
+            # Replace the package we're trying to obsolete with the one we
+            # just added if we had an initial package, and follow the
+            # obsolete chain: obsoletes of the names the new package provides
+            # may apply now.
+            obsoleted = True
+            self.opkg_list.append(opkg)
+            if not full:
+                pkglist.append(opkg)
+                for p in plist:
+                    pkglist.remove(p)
+            self.__queueObsoletes(heap, queued, self.__getObsoletedNames([opkg]))
         # Return wether we obsoleted any package this time or not.
         return obsoleted
 
@@ -1491,13 +1677,28 @@ class RpmYum:
     ###  search/list/info commands ##########################################
 
     def search(self, args):
-        pkgs = self._mergePkgLists(self.pydb.search(args),
-                                   self.repos.search(args))
+        # Rank the installed and the repository packages together
+        pkgs = self._mergePkgLists(rankSearch(
+            self.pydb.searchScores(args) + self.repos.searchScores(args)))
         self.formatPkgs(pkgs)
         return 0
 
     def checkupdate(self, args):
-        log.error("Not invented here")
+        db = self.opresolver.getDatabase()
+        if args:
+            ipkgs = db.searchPkgs(args)
+        else:
+            ipkgs = db.getPkgs()
+        # Newest update for each name.arch
+        updates = { }
+        for ipkg in ipkgs:
+            for pkg in self.getUpdateCandidates(ipkg):
+                if not archCompat(pkg["arch"], self.config.machine):
+                    continue
+                na = pkg.getNA()
+                if not updates.has_key(na) or pkgCompare(updates[na], pkg) < 0:
+                    updates[na] = pkg
+        self.formatPkgs(updates.values())
         return 0
 
     def deplist(self, args):
@@ -1588,13 +1789,16 @@ class RpmYum:
         return 0
 
     def _mergePkgLists(self, *lists):
+        # Keeps the order of the first occurrence, e.g. search() ranking
         d = {}
+        result = []
         for l in lists:
             for pkg in l:
                 nevra = pkg.getNEVRA()
                 if not nevra in d:
                     d[nevra] = pkg
-        return d.values()
+                    result.append(pkg)
+        return result
 
     def _pkgNameDict(self, pkgs, dict_=None):
         if dict_ is None:
@@ -1622,7 +1826,9 @@ class RpmYum:
         
         pkgs = [(p.getNA(), p.getVR(), p.db.reponame, p)
                 for p in pkgs]
-        pkgs.sort()
+        # search results are ranked already
+        if self.command != "search":
+            pkgs.sort()
         if self.command in ("info", "search"):
             for p in pkgs:
                 pkg = p[-1]
@@ -1684,7 +1890,8 @@ class RpmYum:
         else:
             names = self.opresolver.getDatabase().getNames()
         for name in names:
-            self.update(name, exact=True, do_obsolete=False)
+            if self.__hasUpdateCandidates(name):
+                self.update(name, exact=True, do_obsolete=False)
         return self.opresolver.installs
 
     def getObsoletes(self, patterns):
@@ -1706,7 +1913,7 @@ class RpmYum:
         return result
 
     def getRecent(self, patterns):
-        now = time()
+        now = _now()
         result = []
         for pkg in self.getRepoPkgs(patterns):
             t = pkg["time_file"] or pkg['time_build']
@@ -0,0 +1,406 @@
+#!/usr/bin/python
+#
+# End-to-end benchmark on a generated repository.
+#
+# Generates synthetic packages (.rpm files with gzip cpio payload), yum
+# repodata and a rpmdb under a temporary directory, without network access,
+# and times header parsing, repo load, searchDependency(), resolving,
+# ordering, file conflict checks, payload extraction and rpmdb writes.
+# The timers and counters are written as JSON to compare versions.
+#
+# Usage: benchmark.py [-n packages] [-i installed] [-r requires] [-f files]
+#                     [-s seed] [-k dir] [-o report.json]
+#
+
+import sys, os, gzip, md5, random, shutil, tempfile, time, getopt
+sys.path[0:0] = ['..']
+import pyrpm
+from pyrpm.package import RpmPackage
+from pyrpm.database.repodb import RpmRepoDB
+from pyrpm.database.rpmdb import RpmDB
+from pyrpm.logger import log
+from pyrpm.profiling import profiler
+
+def usage():
+    print """Usage: %s [options]
+
+  -n N   number of packages (default 1000)
+  -i N   number of packages written to the rpmdb first (default n/2)
+  -r N   requires per package (default 4)
+  -f N   files per package (default 10)
+  -s N   random seed (default 0)
+  -k DIR generate into DIR and keep it instead of a temporary directory
+  -o F   JSON report (default benchmark.json)
+""" % sys.argv[0]
+
+# ----------------------------------------------------------------------------
+
+def pkgName(i):
+    return "bench%05d" % i
+
+def cpioEntry(name, mode, data, ino):
+    """Return a newc cpio archive entry."""
+
+    s = "070701" + "".join(["%08X" % v for v in
+                            (ino, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0,
+                             len(name) + 1, 0)])
+    s += name + "\0"
+    s += "\0" * ((4 - len(s) % 4) % 4)
+    return s + data + "\0" * ((4 - len(data) % 4) % 4)
+
+def genPackage(i, npkgs, ninstalled, nrequires, nfiles, arch, rand):
+    """Return the header RpmPackage and a list of (filename, data) for
+    package i.
+
+    Package i requires packages below i by name, virtual provide or file,
+    so the first ninstalled packages are closed under their requires.
+    Every 10th package above ninstalled also requires a later package,
+    which gives the orderer loops to break."""
+
+    name = pkgName(i)
+    p = RpmPackage(pyrpm.rpmconfig, None)
+    p["signature"] = { }
+    for (tag, value) in (("name", name), ("epoch", [0]), ("version", "1.0"),
+                         ("release", "1"), ("arch", arch), ("os", "linux"),
+                         ("rpmversion", "4.4.2"), ("group", "Benchmark"),
+                         ("license", "GPL"), ("summary", "%s summary" % name),
+                         ("description", "Synthetic package %s" % name),
+                         ("sourcerpm", "%s-1.0-1.src.rpm" % name),
+                         ("payloadformat", "cpio"),
+                         ("payloadcompressor", "gzip")):
+        p[tag] = value
+    p["providename"] = [name, "libbench%05d.so" % i]
+    p["provideflags"] = [pyrpm.RPMSENSE_EQUAL, 0]
+    p["provideversion"] = ["1.0-1", ""]
+
+    targets = { }
+    if i > 0:
+        for j in xrange(min(nrequires, i)):
+            targets[rand.randrange(i)] = None
+    if i >= ninstalled and i % 10 == 0 and i + 1 < npkgs:
+        targets[rand.randrange(i + 1, npkgs)] = None
+    targets = targets.keys()
+    targets.sort()
+    (names, flags, versions) = ([ ], [ ], [ ])
+    for j in targets:
+        kind = j % 3
+        if   kind == 0:
+            names.append(pkgName(j))
+            flags.append(pyrpm.RPMSENSE_GREATER | pyrpm.RPMSENSE_EQUAL)
+            versions.append("1.0")
+        elif kind == 1:
+            names.append("libbench%05d.so" % j)
+            flags.append(0)
+            versions.append("")
+        else:
+            names.append("/usr/bin/%s" % pkgName(j))
+            flags.append(0)
+            versions.append("")
+    if names:           # empty lists can't be written
+        p["requirename"] = names
+        p["requireflags"] = flags
+        p["requireversion"] = versions
+
+    # /usr/bin/<name>, files in /usr/share/bench/<name>/ and a file shared
+    # by all packages with identical contents (no file conflict)
+    files = [("/usr/bin/%s" % name, "#!/bin/sh\necho %s\n" % name)]
+    for j in xrange(nfiles - 2):
+        files.append(("/usr/share/bench/%s/file%d" % (name, j),
+                      "%s file %d\n" % (name, j) * (j + 1)))
+    files.append(("/usr/share/bench/COPYING", "Synthetic benchmark data\n"))
+    files = files[:max(nfiles, 1)]
+    dirnames = [ ]
+    dirindexes = [ ]
+    basenames = [ ]
+    for (filename, data) in files:
+        (dirname, basename) = os.path.split(filename)
+        dirname += "/"
+        if dirname not in dirnames:
+            dirnames.append(dirname)
+        dirindexes.append(dirnames.index(dirname))
+        basenames.append(basename)
+    p["basenames"] = basenames
+    p["dirnames"] = dirnames
+    p["dirindexes"] = dirindexes
+    p["filemodes"] = [0100755] + [0100644] * (len(files) - 1)
+    p["filesizes"] = [len(data) for (filename, data) in files]
+    p["filemd5s"] = [md5.new(data).hexdigest() for (filename, data) in files]
+    p["filemtimes"] = [0] * len(files)
+    p["filerdevs"] = [0] * len(files)
+    p["fileinodes"] = range(1, len(files) + 1)
+    p["filedevices"] = [1] * len(files)
+    p["fileflags"] = [0] * len(files)
+    p["fileusername"] = ["root"] * len(files)
+    p["filegroupname"] = ["root"] * len(files)
+    p["filelinktos"] = [""] * len(files)
+    p["filelangs"] = [""] * len(files)
+    return (p, files)
+
+def writeRpm(filename, pkg, files):
+    """Write header RpmPackage pkg and a payload with files to filename."""
+
+    pkg.write(filename)
+    pkg.close()
+    fd = open(filename, "ab")
+    payload = gzip.GzipFile(fileobj=fd, mode="wb")
+    ino = 1
+    for (name, data) in files:
+        payload.write(cpioEntry("." + name, 0100644, data, ino))
+        ino += 1
+    payload.write(cpioEntry("TRAILER!!!", 0, "", 0))
+    payload.close()
+    fd.close()
+
+_flagnames = { 0: None, pyrpm.RPMSENSE_EQUAL: "EQ",
+               pyrpm.RPMSENSE_GREATER | pyrpm.RPMSENSE_EQUAL: "GE" }
+
+def xmlDeps(tag, names, flags, versions):
+    lines = ["      <rpm:%s>" % tag]
+    for (name, flag, version) in zip(names, flags, versions):
+        if _flagnames[flag] is None:
+            lines.append('        <rpm:entry name="%s"/>' % name)
+            continue
+        (v, r) = (version.split("-") + [None])[:2]
+        entry = '        <rpm:entry name="%s" flags="%s" epoch="0" ver="%s"' \
+                % (name, _flagnames[flag], v)
+        if r is not None:
+            entry += ' rel="%s"' % r
+        lines.append(entry + "/>")
+    lines.append("      </rpm:%s>" % tag)
+    return lines
+
+def writeRepodata(repodir, pkgs):
+    """Write primary.xml.gz, filelists.xml.gz and repomd.xml for
+    [(RpmPackage, files, rpm file name)]."""
+
+    datadir = os.path.join(repodir, "repodata")
+    os.makedirs(datadir)
+    primary = gzip.GzipFile(os.path.join(datadir, "primary.xml.gz"), "wb")
+    primary.write('<?xml version="1.0" encoding="UTF-8"?>\n<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">\n' % len(pkgs))
+    filelists = gzip.GzipFile(os.path.join(datadir, "filelists.xml.gz"),
+                              "wb")
+    filelists.write('<?xml version="1.0" encoding="UTF-8"?>\n<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="%d">\n' % len(pkgs))
+    for (p, files, rpmname) in pkgs:
+        size = os.path.getsize(os.path.join(repodir, rpmname))
+        lines = ['<package type="rpm">',
+                 "  <name>%s</name>" % p["name"],
+                 "  <arch>%s</arch>" % p["arch"],
+                 '  <version epoch="0" ver="%s" rel="%s"/>' % (p["version"],
+                                                               p["release"]),
+                 "  <summary>%s</summary>" % p["summary"],
+                 "  <description>%s</description>" % p["description"],
+                 '  <size package="%d"/>' % size,
+                 '  <location href="%s"/>' % rpmname,
+                 "  <format>"]
+        lines.extend(xmlDeps("provides", p["providename"], p["provideflags"],
+                             p["provideversion"]))
+        if p["requirename"]:
+            lines.extend(xmlDeps("requires", p["requirename"],
+                                 p["requireflags"], p["requireversion"]))
+        for (filename, data) in files:
+            if filename.startswith("/usr/bin/"):
+                lines.append("    <file>%s</file>" % filename)
+        lines.extend(["  </format>", "</package>", ""])
+        primary.write("\n".join(lines))
+        lines = ['<package pkgid="%s" name="%s" arch="%s">' % (rpmname,
+                                                              p["name"],
+                                                              p["arch"]),
+                 '  <version epoch="0" ver="%s" rel="%s"/>' % (p["version"],
+                                                               p["release"])]
+        for (filename, data) in files:
+            lines.append("  <file>%s</file>" % filename)
+        lines.extend(["</package>", ""])
+        filelists.write("\n".join(lines))
+    primary.write("</metadata>\n")
+    primary.close()
+    filelists.write("</filelists>\n")
+    filelists.close()
+    repomd = open(os.path.join(datadir, "repomd.xml"), "w")
+    repomd.write('<?xml version="1.0" encoding="UTF-8"?>\n<repomd xmlns="http://linux.duke.edu/metadata/repo">\n')
+    for name in ("primary", "filelists"):
+        repomd.write('  <data type="%s">\n    <location href="repodata/%s.xml.gz"/>\n  </data>\n' % (name, name))
+    repomd.write("</repomd>\n")
+    repomd.close()
+
+def generate(topdir, npkgs, ninstalled, nrequires, nfiles, seed):
+    """Generate the repository in topdir/repo, return list of rpm files."""
+
+    rand = random.Random(seed)
+    arch = pyrpm.rpmconfig.machine
+    if not pyrpm.rpm_lead_arch.has_key(arch):
+        arch = "i386"
+    repodir = os.path.join(topdir, "repo")
+    os.makedirs(repodir)
+    pkgs = [ ]
+    for i in xrange(npkgs):
+        (p, files) = genPackage(i, npkgs, ninstalled, nrequires, nfiles, arch,
+                                rand)
+        rpmname = "%s.rpm" % p.getNVRA()
+        writeRpm(os.path.join(repodir, rpmname), p, files)
+        pkgs.append((p, files, rpmname))
+    writeRepodata(repodir, pkgs)
+    return [os.path.join(repodir, rpmname) for (p, files, rpmname) in pkgs]
+
+# ----------------------------------------------------------------------------
+
+def timed(name, func, *args):
+    """Run func(*args) as profiler timer name, print and return its result."""
+
+    ptime = profiler.start()
+    result = func(*args)
+    profiler.stop(name, ptime)
+    print "%-30s %10.3f s" % (name, time.time() - ptime)
+    return result
+
+def readHeaders(filenames):
+    pkgs = [ ]
+    for filename in filenames:
+        pkg = pyrpm.readRpmPackage(pyrpm.rpmconfig, filename)
+        if pkg is None:
+            raise ValueError, "can't read %s" % filename
+        pkgs.append(pkg)
+    return pkgs
+
+def loadRepo(topdir):
+    repo = RpmRepoDB(pyrpm.rpmconfig, ["file://%s/repo" % topdir],
+                     reponame="benchmark")
+    if not repo.read():
+        raise ValueError, "can't read repository"
+    return repo
+
+def searchDependencies(db, pkgs):
+    n = 0
+    for pkg in pkgs:
+        for (name, flag, version) in pkg["requires"]:
+            if not db.searchDependency(name, flag, version):
+                raise ValueError, "%s: unresolved %s" % \
+                      (pkg.getNEVRA(), name)
+            n += 1
+    return n
+
+def writeRpmdb(topdir, pkgs):
+    rpmdb = RpmDB(pyrpm.rpmconfig, "/var/lib/rpm", os.path.join(topdir, "root"))
+    for pkg in pkgs:
+        if not rpmdb.addPkg(pkg):
+            raise ValueError, "can't add %s to rpmdb" % pkg.getNEVRA()
+    rpmdb.close()
+
+def readRpmdb(topdir):
+    rpmdb = RpmDB(pyrpm.rpmconfig, "/var/lib/rpm", os.path.join(topdir, "root"))
+    if rpmdb.read() != rpmdb.OK:
+        raise ValueError, "can't read rpmdb"
+    for pkg in rpmdb.getPkgs():
+        pkg["requires"]
+    return rpmdb
+
+def resolve(rpmdb, pkgs):
+    resolver = pyrpm.RpmResolver(pyrpm.rpmconfig, rpmdb.getMemoryCopy())
+    for pkg in pkgs:
+        resolver.install(pkg)
+    if resolver.resolve() != 1:
+        raise ValueError, "resolving failed"
+    return resolver
+
+def fileConflicts(resolver):
+    pyrpm.rpmconfig.nofileconflicts = 0
+    try:
+        conflicts = resolver.getFileConflicts()
+    finally:
+        pyrpm.rpmconfig.nofileconflicts = 1
+    if conflicts:
+        raise ValueError, "unexpected file conflicts"
+
+def order(resolver):
+    orderer = pyrpm.RpmOrderer(pyrpm.rpmconfig, resolver.installs,
+                               resolver.updates, resolver.obsoletes,
+                               resolver.erases)
+    operations = orderer.order()
+    if operations is None:
+        raise ValueError, "ordering failed"
+    return operations
+
+def extract(topdir, filenames):
+    directory = os.path.join(topdir, "extract")
+    for filename in filenames:
+        pkg = RpmPackage(pyrpm.rpmconfig, filename)
+        pkg.extract(directory)
+        pkg.close()
+
+def main():
+    npkgs = 1000
+    ninstalled = None
+    nrequires = 4
+    nfiles = 10
+    seed = 0
+    keepdir = None
+    output = "benchmark.json"
+    try:
+        (opts, args) = getopt.getopt(sys.argv[1:], "hn:i:r:f:s:k:o:")
+        for (opt, val) in opts:
+            if   opt == "-h":
+                usage()
+                return 0
+            elif opt == "-n":
+                npkgs = int(val)
+            elif opt == "-i":
+                ninstalled = int(val)
+            elif opt == "-r":
+                nrequires = int(val)
+            elif opt == "-f":
+                nfiles = int(val)
+            elif opt == "-s":
+                seed = int(val)
+            elif opt == "-k":
+                keepdir = val
+            elif opt == "-o":
+                output = val
+    except (getopt.error, ValueError), e:
+        print e
+        usage()
+        return 1
+    if ninstalled is None:
+        ninstalled = npkgs / 2
+    ninstalled = min(ninstalled, npkgs)
+
+    log.setInfoLogLevel(log.NO_INFO)
+    pyrpm.rpmconfig.printhash = 0
+    pyrpm.rpmconfig.checkinstalled = 0
+    pyrpm.rpmconfig.nofileconflicts = 1
+    pyrpm.rpmconfig.selinux_enabled = 0
+    profiler.enable(output)
+    for (name, value) in (("packages", npkgs), ("installed", ninstalled),
+                          ("requires", nrequires), ("files", nfiles),
+                          ("seed", seed)):
+        profiler.count("benchmark.%s" % name, value)
+
+    if keepdir:
+        topdir = keepdir
+    else:
+        topdir = tempfile.mkdtemp(prefix="pyrpmbench")
+    pyrpm.rpmconfig.cachedir = os.path.join(topdir, "cache")
+    try:
+        filenames = timed("generate", generate, topdir, npkgs, ninstalled,
+                          nrequires, nfiles, seed)
+        pkgs = timed("header.read", readHeaders, filenames)
+        repo = timed("repo.load", loadRepo, topdir)
+        timed("repo.filelists", repo.importFilelist)
+        ndeps = timed("searchDependency", searchDependencies, repo, pkgs)
+        timed("searchDependency.cached", searchDependencies, repo, pkgs)
+        profiler.count("benchmark.searchDependency", ndeps)
+        timed("rpmdb.write", writeRpmdb, topdir, pkgs[:ninstalled])
+        rpmdb = timed("rpmdb.read", readRpmdb, topdir)
+        resolver = timed("resolve", resolve, rpmdb, pkgs[ninstalled:])
+        timed("fileconflicts", fileConflicts, resolver)
+        operations = timed("order", order, resolver)
+        profiler.count("benchmark.operations", len(operations))
+        timed("extract", extract, topdir, filenames)
+    finally:
+        if not keepdir:
+            shutil.rmtree(topdir, True)
+    print "Report written to %s" % output
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim:ts=4:sw=4:showmatch:expandtab
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+#
+# Per-call cost of pyrpm.logger calls.
+#
+# Usage: loggerbench.py [iterations]
+#
+
+import sys, time
+sys.path[0:0] = ['..']
+from pyrpm.logger import log, LogTarget
+
+class NullLog(LogTarget):
+    def write(self, data, level, logger, is_debug=0):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def noop(message, *args, **kwargs):
+    pass
+
+def bench(name, func, count):
+    start = time.time()
+    for i in xrange(count):
+        func("%s %d", "message", i)
+    usec = (time.time() - start) * 1000000.0 / count
+    print "%-40s %8.3f usec/call" % (name, usec)
+
+class Caller:
+    def call(self, func, count):
+        bench("enabled debug1 in method, %(domain)s", func, count)
+
+def main():
+    count = 100000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    null = NullLog()
+    log.setInfoLogging("*", null)
+    log.setDebugLogging("*", null)
+    log.setDebugLogLevel(log.NO_DEBUG)
+
+    bench("function call baseline", noop, count)
+    bench("disabled debug1", log.debug1, count)
+    bench("disabled debug(1, ...)", lambda *args: log.debug(1, *args), count)
+    bench("disabled info5", log.info5, count)
+
+    log.setDebugLogLevel(log.DEBUG1)
+    bench("enabled debug1", log.debug1, count)
+    log.setFormat("[%(domain)s] %(date)s %(label)s%(message)s")
+    Caller().call(log.debug1, count)
+
+if __name__ == '__main__':
+    main()
+
+# vim:ts=4:sw=4:showmatch:expandtab
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+#
+# Per-operation cost of pyrpm.database.lrucache.LRUCache.
+#
+# Usage: lrucachebench.py [iterations]
+#
+
+import sys, time
+sys.path[0:0] = ['..']
+from pyrpm.database.lrucache import LRUCache
+
+def bench(name, func, count):
+    start = time.time()
+    func(count)
+    usec = (time.time() - start) * 1000000.0 / count
+    print "%-40s %8.3f usec/op" % (name, usec)
+
+def main():
+    count = 200000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    def dictset(n):
+        d = { }
+        for i in xrange(n):
+            d[i] = i
+    bench("dict set baseline", dictset, count)
+
+    for size in (100, 10000, count):
+        cache = LRUCache(maxsize=size)
+        def fill(n):
+            for i in xrange(n):
+                cache[i] = i
+        bench("set, maxsize %d" % size, fill, count)
+        def hit(n):
+            key = n - 1
+            for i in xrange(n):
+                cache.get(key)
+        bench("get hit, maxsize %d" % size, hit, count)
+        def miss(n):
+            for i in xrange(n):
+                cache.get(-1)
+        bench("get miss, maxsize %d" % size, miss, count)
+
+    cache = LRUCache(maxsize=0, maxweight=1024 * 1024, weigh=len)
+    value = "x" * 1000
+    def weighted(n):
+        for i in xrange(n):
+            cache[i] = value
+    bench("set, maxweight 1MB, 1000 byte values", weighted, count)
+    print "hits %d, misses %d, evictions %d, entries %d, weight %d" % \
+          cache.stats()
+
+if __name__ == '__main__':
+    main()
+
+# vim:ts=4:sw=4:showmatch:expandtab